@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Воркер очереди ИИ-анализа медиа.
+
+Забирает задачи из таблицы ai_jobs и выполняет загрузку, анализ и ответ
+пользователю. Процессов можно запустить сколько угодно и на разных
+машинах: задачи распределяются через FOR UPDATE SKIP LOCKED.
+
+Лимит одновременных запросов к LLM (LLM_MAX_CONCURRENCY) действует в
+каждом процессе отдельно, поэтому общий предел растет с числом процессов.
+
+    python ai_worker.py --processes 2
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import settings
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("ai_worker")
+
+
+async def run_worker():
+    """Воркеры очереди в текущем процессе до SIGTERM/SIGINT."""
+    # Сервисы импортируются в дочернем процессе, а не наследуются от родителя
+    from aiogram import Bot
+    from bot.database.database import db
+    from bot.services.ai_job_service import ai_job_service
+    from bot.services.openai_client import openai_client_factory
+    from bot.services.worker_pool import media_worker_pool
+    from bot.services.media_storage import media_storage
+
+    bot = Bot(token=settings.bot_token)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    media_storage.start()
+    ai_job_service.start(bot, settings.ai_job_worker_concurrency)
+    logger.info(f"Воркер запущен: {settings.ai_job_worker_concurrency} задач одновременно")
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=settings.ai_job_stats_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                queue = await db.get_ai_job_stats()
+            except Exception as e:
+                queue = {"error": str(e)}
+            logger.info(f"Статистика воркера: {ai_job_service.get_stats()}, очередь: {queue}")
+    finally:
+        await ai_job_service.stop()
+        await media_storage.stop()
+        await openai_client_factory.close()
+        media_worker_pool.shutdown()
+        await db.close()
+        await bot.session.close()
+        logger.info("Воркер остановлен")
+
+
+def run_process():
+    """Точка входа дочернего процесса."""
+    asyncio.run(run_worker())
+
+
+def main():
+    """Запуск нужного числа процессов-воркеров."""
+    parser = argparse.ArgumentParser(description="Воркер очереди ИИ-анализа медиа")
+    parser.add_argument("--processes", type=int, default=1, help="число процессов")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process()
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_process) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def stop_processes(signum, frame):
+        """Передача сигнала остановки дочерним процессам."""
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_processes)
+    signal.signal(signal.SIGINT, stop_processes)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Бенчмарк маршрутизации callback-запросов.
+
+Сравнивает последовательную проверку магических фильтров (как в роутерах
+aiogram) с поиском по таблице CallbackDispatchTable на реалистичной смеси
+callback-данных, в том числе при росте количества пунктов меню.
+"""
+
+import random
+import sys
+import timeit
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корневую директорию в PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from aiogram import F
+
+from bot.data.callbacks import TestAnswerCallback, AIMediaCallback
+from bot.utils.callback_dispatch import CallbackDispatchTable
+
+
+MENU_CALLBACKS = [
+    "back_to_menu", "handbook", "tests_site", "our_test", "consultation",
+    "ai_analysis", "subscription", "packages", "courses", "cards",
+    "start_test", "start_consultation", "end_consultation"
+]
+
+# Доли callback-данных в типичном трафике
+CALLBACK_MIX = [
+    ("test_answer", 0.55),
+    ("back_to_menu", 0.15),
+    ("menu", 0.20),
+    ("ai", 0.10),
+]
+
+
+def _noop(callback):
+    """Пустой обработчик."""
+    return None
+
+
+def build_callbacks(count: int, extra_menus: int) -> list:
+    """Генерация смеси callback-данных."""
+    rnd = random.Random(42)
+    menus = MENU_CALLBACKS + [f"menu_item_{i}" for i in range(extra_menus)]
+    kinds = [kind for kind, _ in CALLBACK_MIX]
+    weights = [weight for _, weight in CALLBACK_MIX]
+
+    callbacks = []
+    for kind in rnd.choices(kinds, weights, k=count):
+        if kind == "test_answer":
+            data = TestAnswerCallback(
+                question_id=rnd.randint(1, 16),
+                answer_index=rnd.randint(0, 3)
+            ).pack()
+        elif kind == "back_to_menu":
+            data = "back_to_menu"
+        elif kind == "ai":
+            data = AIMediaCallback(
+                media_type=rnd.choice(["photo", "video", "voice"])
+            ).pack()
+        else:
+            data = rnd.choice(menus)
+        callbacks.append(SimpleNamespace(data=data))
+    return callbacks
+
+
+def build_filters(extra_menus: int) -> list:
+    """Фильтры в порядке регистрации роутеров."""
+    menus = MENU_CALLBACKS + [f"menu_item_{i}" for i in range(extra_menus)]
+    filters = [F.data == value for value in menus]
+    filters.insert(10, F.data.startswith("test_answer:"))
+    filters.insert(12, F.data.startswith("ai_"))
+    return filters
+
+
+def build_table(extra_menus: int) -> CallbackDispatchTable:
+    """Таблица маршрутизации с теми же маршрутами."""
+    table = CallbackDispatchTable()
+    for value in MENU_CALLBACKS + [f"menu_item_{i}" for i in range(extra_menus)]:
+        table.exact(value, _noop)
+    table.prefix(TestAnswerCallback, _noop)
+    table.prefix(AIMediaCallback, _noop)
+    return table
+
+
+def run_filters(filters: list, callbacks: list):
+    """Последовательная проверка фильтров."""
+    for callback in callbacks:
+        for magic in filters:
+            if magic.resolve(callback):
+                break
+
+
+def run_table(table: CallbackDispatchTable, callbacks: list):
+    """Поиск по таблице."""
+    for callback in callbacks:
+        table.resolve(callback.data)
+
+
+def main():
+    """Запуск бенчмарка."""
+    count = 10_000
+    print(f"{'menus':>6} {'filters, µs':>12} {'table, µs':>10} {'speedup':>8}")
+
+    for extra_menus in (0, 50, 200):
+        callbacks = build_callbacks(count, extra_menus)
+        filters = build_filters(extra_menus)
+        table = build_table(extra_menus)
+
+        filters_time = min(timeit.repeat(
+            lambda: run_filters(filters, callbacks), number=1, repeat=5
+        ))
+        table_time = min(timeit.repeat(
+            lambda: run_table(table, callbacks), number=1, repeat=5
+        ))
+
+        print(
+            f"{len(MENU_CALLBACKS) + extra_menus:>6} "
+            f"{filters_time / count * 1e6:>12.2f} "
+            f"{table_time / count * 1e6:>10.2f} "
+            f"{filters_time / table_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
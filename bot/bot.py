@@ -2,7 +2,9 @@
 
 import asyncio
 import logging
+from typing import Any, Dict, Set
 from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 
@@ -12,6 +14,17 @@ from bot.handlers.main_menu import main_menu_handler
 from bot.handlers.test_handler import test_handler
 from bot.handlers.ai_analysis_handler import ai_analysis_handler
 from bot.handlers.consultation_handler import consultation_handler
+from bot.utils.callback_dispatch import callback_table
+from bot.utils.render_cache import render_cache, RenderCacheSession
+from bot.utils.webhook_reply import build_webhook_response
+from bot.middlewares.early_answer import early_answer_middleware
+from bot.services.site_api_service import site_api_service
+from bot.services.entitlement_sync_service import entitlement_sync_service
+from bot.services.result_outbox_service import result_outbox_service
+from bot.services.ai_job_service import ai_job_service
+from bot.services.openai_client import openai_client_factory
+from bot.services.worker_pool import media_worker_pool
+from bot.services.media_storage import media_storage
 
 
 # Настройка логирования
@@ -27,7 +40,10 @@ class TelegramBot:
     
     def __init__(self):
         """Инициализация бота."""
-        self.bot = Bot(token=settings.bot_token)
+        self.bot = Bot(
+            token=settings.bot_token,
+            session=RenderCacheSession(render_cache)
+        )
         self.dp = Dispatcher()
         
         # Регистрируем обработчики
@@ -35,9 +51,16 @@ class TelegramBot:
         
         # Настройка webhook
         self.webhook_url = f"{settings.webhook_url}{settings.webhook_path}"
+        self._background_tasks: Set[asyncio.Task] = set()
     
     def _setup_handlers(self):
         """Настройка всех обработчиков."""
+        # Ранний ответ на callback-запросы
+        self.dp.callback_query.middleware(early_answer_middleware)
+        
+        # Callback-запросы всех разделов (маршрутизация по таблице)
+        self.dp.include_router(callback_table.router)
+        
         # Главное меню
         self.dp.include_router(main_menu_handler.router)
         
@@ -61,6 +84,19 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"Ошибка создания таблиц БД: {e}")
         
+        # Запускаем синхронизацию подписок с сайтом
+        entitlement_sync_service.start()
+        
+        # Запускаем отправку результатов тестов на сайт
+        result_outbox_service.start()
+        
+        # Запускаем очистку хранилища медиа
+        media_storage.start()
+        
+        # Воркеры очереди ИИ-анализа в этом процессе (обычно они в ai_worker.py)
+        if settings.ai_job_inline_workers > 0:
+            ai_job_service.start(self.bot, settings.ai_job_inline_workers)
+        
         # Устанавливаем webhook
         try:
             await self.bot.set_webhook(
@@ -82,6 +118,12 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"Ошибка удаления webhook: {e}")
         
+        # Останавливаем синхронизацию подписок
+        await entitlement_sync_service.stop()
+        await result_outbox_service.stop()
+        await ai_job_service.stop()
+        await media_storage.stop()
+        
         # Закрываем соединение с БД
         try:
             await db.close()
@@ -89,6 +131,23 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"Ошибка закрытия БД: {e}")
         
+        # Закрываем HTTP-клиент API сайта
+        try:
+            await site_api_service.close()
+            logger.info("HTTP-клиент API сайта закрыт")
+        except Exception as e:
+            logger.error(f"Ошибка закрытия HTTP-клиента API сайта: {e}")
+        
+        # Закрываем общий клиент OpenAI
+        try:
+            await openai_client_factory.close()
+            logger.info("Клиент OpenAI закрыт")
+        except Exception as e:
+            logger.error(f"Ошибка закрытия клиента OpenAI: {e}")
+        
+        # Останавливаем процессы обработки медиа
+        media_worker_pool.shutdown()
+        
         # Закрываем сессию бота
         try:
             await self.bot.session.close()
@@ -96,6 +155,40 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"Ошибка закрытия сессии бота: {e}")
     
+    async def feed_webhook_update(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        """Обработка обновления из webhook.
+        
+        Если обработчик успел вернуть метод Bot API, он отдается Telegram
+        в теле ответа webhook вместо отдельного исходящего запроса.
+        """
+        if not settings.webhook_reply:
+            task = asyncio.create_task(self._background_feed_update(update))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            return {}
+        
+        method = await self.dp.feed_webhook_update(
+            self.bot,
+            update,
+            _timeout=settings.webhook_reply_timeout
+        )
+        if method is None:
+            return {}
+        
+        payload = build_webhook_response(self.bot, method)
+        if payload is None:
+            # Файлы нельзя передать в JSON, отправляем обычным запросом
+            await self.dp.silent_call_request(bot=self.bot, result=method)
+            return {}
+        
+        return payload
+    
+    async def _background_feed_update(self, update: Dict[str, Any]):
+        """Обработка обновления в фоне."""
+        result = await self.dp.feed_raw_update(self.bot, update)
+        if isinstance(result, TelegramMethod):
+            await self.dp.silent_call_request(bot=self.bot, result=result)
+    
     async def get_webhook_handler(self) -> SimpleRequestHandler:
         """Получение обработчика webhook."""
         return SimpleRequestHandler(
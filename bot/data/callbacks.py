@@ -0,0 +1,16 @@
+"""Типизированные фабрики callback-данных."""
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class TestAnswerCallback(CallbackData, prefix="test_answer"):
+    """Ответ на вопрос теста: test_answer:<question_id>:<answer_index>."""
+
+    question_id: int
+    answer_index: int
+
+
+class AIMediaCallback(CallbackData, prefix="ai", sep="_"):
+    """Выбор типа медиа для ИИ-анализа: ai_<media_type>."""
+
+    media_type: str
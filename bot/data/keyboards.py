@@ -7,8 +7,11 @@ from aiogram.types import (
     KeyboardButton
 )
 from .messages import BUTTONS
+from .callbacks import TestAnswerCallback, AIMediaCallback
+from bot.utils.render_cache import render_cache
 
 
+@render_cache.cached
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     """Главное меню бота."""
     keyboard = [
@@ -62,23 +65,24 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+@render_cache.cached
 def get_ai_analysis_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора типа медиа для ИИ-анализа."""
     keyboard = [
         [
             InlineKeyboardButton(
                 text="📸 Фото",
-                callback_data="ai_photo"
+                callback_data=AIMediaCallback(media_type="photo").pack()
             ),
             InlineKeyboardButton(
                 text="🎥 Видео",
-                callback_data="ai_video"
+                callback_data=AIMediaCallback(media_type="video").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text="🎤 Голос",
-                callback_data="ai_voice"
+                callback_data=AIMediaCallback(media_type="voice").pack()
             )
         ],
         [
@@ -91,6 +95,7 @@ def get_ai_analysis_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+@render_cache.cached
 def get_test_answer_keyboard(answers: list[str], question_id: int) -> InlineKeyboardMarkup:
     """Клавиатура с вариантами ответов для теста."""
     keyboard = []
@@ -98,7 +103,10 @@ def get_test_answer_keyboard(answers: list[str], question_id: int) -> InlineKeyb
         keyboard.append([
             InlineKeyboardButton(
                 text=answer,
-                callback_data=f"test_answer:{question_id}:{i}"
+                callback_data=TestAnswerCallback(
+                    question_id=question_id,
+                    answer_index=i
+                ).pack()
             )
         ])
     
@@ -112,6 +120,7 @@ def get_test_answer_keyboard(answers: list[str], question_id: int) -> InlineKeyb
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+@render_cache.cached
 def get_back_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой возврата."""
     keyboard = [
@@ -144,6 +153,7 @@ def get_webview_keyboard(url: str, button_text: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+@render_cache.cached
 def get_consultation_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для консультации."""
     keyboard = [
@@ -27,6 +27,8 @@ FREE_ZONE_MESSAGES = {
     "our_test_start": "🎯 Начинаем наш тест! Вам предстоит ответить на 16 вопросов о поведении.",
     "consultation_start": "💬 Начинаем консультацию с ИИ. У вас осталось сообщений: {count}",
     "consultation_limit_reached": "❌ Достигнут лимит бесплатных консультаций (5 в месяц). Для продолжения оформите подписку.",
+    "answer_cache_off": "🔒 Готовые ответы отключены: на ваши вопросы всегда отвечает ИИ, и они не попадают в общий кэш. Включить снова: /cache_on",
+    "answer_cache_on": "⚡ Готовые ответы включены: на частые вопросы ответ приходит сразу. Отключить: /cache_off",
     "test_question": "Вопрос {current}/{total}:\n\n{question}",
     "test_complete": "🎉 Тест завершен! Обрабатываем результаты...",
     "test_result": """
@@ -47,6 +49,8 @@ PREMIUM_MESSAGES = {
     "ai_analysis_video": "🎥 Отправьте видео для анализа",
     "ai_analysis_voice": "🎤 Отправьте голосовое сообщение для анализа",
     "ai_analysis_processing": "🔄 Обрабатываю медиа... Это может занять несколько секунд.",
+    "ai_analysis_queued": "🕓 Медиа принято и стоит в очереди на анализ. Результат придет в этот чат.",
+    "ai_analysis_retry": "⚠️ Анализ не удался, повторю автоматически через {delay} с (попытка {attempt} из {max_attempts}).",
     "ai_analysis_result": "🤖 Результат ИИ-анализа:\n\n{result}",
     "subscription_check": "⭐ Проверяю статус подписки...",
     "packages_check": "📦 Проверяю доступные пакеты...",
@@ -62,7 +66,9 @@ ERROR_MESSAGES = {
     "file_too_large": "❌ Файл слишком большой. Максимальный размер: 20 МБ.",
     "processing_failed": "❌ Не удалось обработать медиа. Попробуйте другое.",
     "db_error": "❌ Ошибка базы данных. Попробуйте позже.",
-    "network_error": "❌ Ошибка сети. Проверьте соединение."
+    "network_error": "❌ Ошибка сети. Проверьте соединение.",
+    "request_in_progress": "⏳ Предыдущий запрос еще обрабатывается. Дождитесь ответа.",
+    "queue_timeout": "⏳ Сейчас слишком много запросов. Попробуйте через пару минут."
 }
 
 # Сообщения для навигации
@@ -70,6 +76,7 @@ NAVIGATION_MESSAGES = {
     "back_to_menu": "🔙 Возвращаемся в главное меню",
     "loading": "⏳ Загружаю...",
     "processing": "🔄 Обрабатываю...",
+    "queue_position": "⏳ Много запросов, вы в очереди: {position}. Ответ начнется автоматически.",
     "success": "✅ Готово!"
 }
 
@@ -2,14 +2,56 @@
 
 import asyncio
 import json
-from typing import Optional, List, Dict, Any
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Callable, Tuple
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, func, or_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from contextlib import asynccontextmanager
 
 from config import settings
-from .models import Base, User, UserLog, TestResult, PremiumAccess, Consultation, AIAnalysis
+from .models import Base, User, UserLog, TestResult, ResultOutbox, PremiumAccess, Consultation, AIAnalysis, AIJob, utcnow
+from bot.utils.single_flight import SingleFlight
+
+
+# Канал NOTIFY о новых задачах ИИ-анализа
+AI_JOBS_CHANNEL = "ai_jobs"
+
+# Обновление существующих БД: create_all не меняет созданные таблицы, а
+# init_db.sql выполняется только на пустом томе. Запросы идемпотентны.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE premium_access ADD COLUMN IF NOT EXISTS site_updated_at TIMESTAMP WITH TIME ZONE",
+    # Раньше на один тип доступа могло быть несколько строк (пакеты
+    # суммировались): сводим их в самую новую — активные остатки
+    # складываются, срок берется самый поздний
+    """
+    UPDATE premium_access AS pa
+    SET is_active = merged.is_active,
+        expires_at = merged.expires_at,
+        remaining_uses = merged.remaining_uses
+    FROM (
+        SELECT MAX(id) AS id,
+               BOOL_OR(is_active) AS is_active,
+               MAX(expires_at) AS expires_at,
+               SUM(remaining_uses) FILTER (WHERE is_active) AS remaining_uses
+        FROM premium_access
+        GROUP BY user_id, access_type
+        HAVING COUNT(*) > 1
+    ) AS merged
+    WHERE pa.id = merged.id
+    """,
+    """
+    DELETE FROM premium_access AS pa
+    USING premium_access AS newer
+    WHERE newer.user_id = pa.user_id
+      AND newer.access_type = pa.access_type
+      AND newer.id > pa.id
+    """,
+    # Нужен для ON CONFLICT в upsert_entitlements
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_premium_access_user_type ON premium_access(user_id, access_type)"
+]
 
 
 class Database:
@@ -21,11 +63,18 @@ class Database:
         self.async_session = async_sessionmaker(
             self.engine, class_=AsyncSession, expire_on_commit=False
         )
+        
+        # Одинаковые одновременные чтения выполняются одним запросом
+        self.single_flight = SingleFlight("db")
     
     async def create_tables(self):
-        """Создание всех таблиц."""
+        """Создание всех таблиц и обновление схемы существующих."""
         async with self.engine.begin() as conn:
+            # Процессы, запущенные одновременно, обновляют схему по очереди
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_upgrade'))"))
             await conn.run_sync(Base.metadata.create_all)
+            for statement in SCHEMA_UPGRADES:
+                await conn.execute(text(statement))
     
     @asynccontextmanager
     async def get_session(self):
@@ -92,9 +141,14 @@ class Database:
         self, 
         user_id: int, 
         test_type: str, 
-        result_data: Dict[str, Any]
+        result_data: Dict[str, Any],
+        deliver_to_site: bool = True
     ) -> TestResult:
-        """Сохранение результата теста."""
+        """Сохранение результата теста.
+        
+        Запись в очередь отправки на сайт делается в той же транзакции,
+        поэтому результат не потеряется и не уйдет на сайт без сохранения.
+        """
         async with self.get_session() as session:
             result = TestResult(
                 user_id=user_id,
@@ -103,9 +157,102 @@ class Database:
             )
             session.add(result)
             await session.flush()
+            
+            if deliver_to_site:
+                session.add(ResultOutbox(
+                    test_result_id=result.id,
+                    idempotency_key=uuid.uuid4().hex
+                ))
+                await session.flush()
+            
             await session.refresh(result)
             return result
     
+    async def claim_outbox_batch(
+        self, 
+        limit: int, 
+        lease_seconds: float
+    ) -> List[Dict[str, Any]]:
+        """Захват пачки результатов, ожидающих отправки на сайт.
+        
+        Строки блокируются с SKIP LOCKED и получают аренду: до ее окончания
+        другие экземпляры бота их не возьмут.
+        """
+        async with self.get_session() as session:
+            now = datetime.utcnow()
+            result = await session.execute(
+                select(ResultOutbox, TestResult, User.telegram_id)
+                .join(TestResult, ResultOutbox.test_result_id == TestResult.id)
+                .join(User, TestResult.user_id == User.id)
+                .where(
+                    ResultOutbox.status == "pending",
+                    ResultOutbox.next_attempt_at <= now
+                )
+                .order_by(ResultOutbox.id)
+                .limit(limit)
+                .with_for_update(of=ResultOutbox, skip_locked=True)
+            )
+            
+            batch = []
+            for outbox, test_result, telegram_id in result.all():
+                outbox.attempts += 1
+                outbox.next_attempt_at = now + timedelta(seconds=lease_seconds)
+                batch.append({
+                    "outbox_id": outbox.id,
+                    "attempts": outbox.attempts,
+                    "idempotency_key": outbox.idempotency_key,
+                    "telegram_user_id": telegram_id,
+                    "test_type": test_result.test_type,
+                    "result": json.loads(test_result.result_data),
+                    "timestamp": test_result.completed_at.replace(tzinfo=timezone.utc).isoformat()
+                })
+            return batch
+    
+    async def mark_outbox_sent(self, outbox_ids: List[int]):
+        """Отметка результатов как доставленных."""
+        async with self.get_session() as session:
+            await session.execute(
+                update(ResultOutbox)
+                .where(ResultOutbox.id.in_(outbox_ids))
+                .values(status="sent", sent_at=datetime.utcnow(), last_error=None)
+            )
+    
+    async def mark_outbox_failed(self, errors: Dict[int, str]):
+        """Отметка результатов, которые сайт отклонил окончательно (id -> причина)."""
+        async with self.get_session() as session:
+            for outbox_id, error in errors.items():
+                await session.execute(
+                    update(ResultOutbox)
+                    .where(ResultOutbox.id == outbox_id)
+                    .values(status="failed", last_error=error)
+                )
+    
+    async def reschedule_outbox(
+        self, 
+        outbox_ids: List[int], 
+        delay_seconds: float, 
+        error: str, 
+        max_attempts: int
+    ):
+        """Перенос неудачной отправки; после max_attempts запись помечается failed."""
+        async with self.get_session() as session:
+            await session.execute(
+                update(ResultOutbox)
+                .where(ResultOutbox.id.in_(outbox_ids))
+                .values(
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+                    last_error=error
+                )
+            )
+            await session.execute(
+                update(ResultOutbox)
+                .where(
+                    ResultOutbox.id.in_(outbox_ids),
+                    ResultOutbox.attempts >= max_attempts
+                )
+                .values(status="failed")
+            )
+    
     async def get_user_premium_access(self, user_id: int) -> List[PremiumAccess]:
         """Получение премиум доступа пользователя."""
         async with self.get_session() as session:
@@ -119,6 +266,13 @@ class Database:
     
     async def check_subscription_status(self, user_id: int) -> bool:
         """Проверка статуса подписки."""
+        return await self.single_flight.do(
+            ("subscription", user_id),
+            lambda: self._check_subscription_status(user_id)
+        )
+    
+    async def _check_subscription_status(self, user_id: int) -> bool:
+        """Запрос статуса подписки в БД."""
         async with self.get_session() as session:
             result = await session.execute(
                 select(PremiumAccess).where(
@@ -131,6 +285,13 @@ class Database:
     
     async def check_package_balance(self, user_id: int) -> int:
         """Проверка баланса пакетов."""
+        return await self.single_flight.do(
+            ("packages", user_id),
+            lambda: self._check_package_balance(user_id)
+        )
+    
+    async def _check_package_balance(self, user_id: int) -> int:
+        """Запрос баланса пакетов в БД."""
         async with self.get_session() as session:
             result = await session.execute(
                 select(PremiumAccess).where(
@@ -142,6 +303,76 @@ class Database:
             packages = result.scalars().all()
             return sum(pkg.remaining_uses or 0 for pkg in packages)
     
+    @staticmethod
+    def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+        """Разбор даты ISO 8601 в наивное UTC-время."""
+        if not value:
+            return None
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    
+    async def upsert_entitlements(self, items: List[Dict[str, Any]]) -> int:
+        """Пакетное обновление премиум доступа по данным сайта.
+        
+        Каждый элемент: telegram_user_id, access_type, is_active,
+        expires_at (ISO 8601), remaining_uses и updated_at (ISO 8601) —
+        время изменения на сайте. Запись обновляется, только если
+        updated_at новее сохраненного, поэтому устаревшая страница
+        синхронизации или повторно присланный push не откатывают
+        более свежее изменение. Возвращает число измененных строк.
+        """
+        if not items:
+            return 0
+        
+        async with self.get_session() as session:
+            # Пользователи могли еще не писать боту, создаем их заранее
+            telegram_ids = {int(item["telegram_user_id"]) for item in items}
+            await session.execute(
+                pg_insert(User)
+                .values([{"telegram_id": telegram_id} for telegram_id in telegram_ids])
+                .on_conflict_do_nothing(index_elements=[User.telegram_id])
+            )
+            result = await session.execute(
+                select(User.id, User.telegram_id).where(User.telegram_id.in_(telegram_ids))
+            )
+            user_ids = {telegram_id: user_id for user_id, telegram_id in result.all()}
+            
+            # Самое новое изменение в пакете побеждает: ON CONFLICT не обновляет строку дважды
+            rows = {}
+            for item in items:
+                user_id = user_ids[int(item["telegram_user_id"])]
+                row = {
+                    "user_id": user_id,
+                    "access_type": item["access_type"],
+                    "is_active": bool(item.get("is_active", True)),
+                    "expires_at": self._parse_datetime(item.get("expires_at")),
+                    "remaining_uses": item.get("remaining_uses"),
+                    "site_updated_at": self._parse_datetime(item.get("updated_at"))
+                }
+                previous = rows.get((user_id, item["access_type"]))
+                if previous is None or previous["site_updated_at"] <= row["site_updated_at"]:
+                    rows[(user_id, item["access_type"])] = row
+            
+            stmt = pg_insert(PremiumAccess).values(list(rows.values()))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[PremiumAccess.user_id, PremiumAccess.access_type],
+                set_={
+                    "is_active": stmt.excluded.is_active,
+                    "expires_at": stmt.excluded.expires_at,
+                    "remaining_uses": stmt.excluded.remaining_uses,
+                    "site_updated_at": stmt.excluded.site_updated_at,
+                    "updated_at": func.now()
+                },
+                where=(
+                    PremiumAccess.site_updated_at.is_(None)
+                    | (PremiumAccess.site_updated_at < stmt.excluded.site_updated_at)
+                )
+            )
+            result = await session.execute(stmt)
+            return result.rowcount
+    
     async def get_consultation_info(self, user_id: int) -> Optional[Consultation]:
         """Получение информации о консультации пользователя."""
         async with self.get_session() as session:
@@ -153,9 +384,13 @@ class Database:
     async def create_or_update_consultation(
         self, 
         user_id: int, 
-        message_count: int = 1
+        message_count: int = 1,
+        memory: Optional[Tuple[Optional[str], Optional[bytes]]] = None
     ) -> Consultation:
-        """Создание или обновление консультации."""
+        """Создание или обновление консультации.
+        
+        memory — пара (summary, history) для сохранения памяти диалога.
+        """
         async with self.get_session() as session:
             result = await session.execute(
                 select(Consultation).where(Consultation.user_id == user_id)
@@ -170,18 +405,56 @@ class Database:
                 session.add(consultation)
             else:
                 consultation.message_count += message_count
-                consultation.last_message_at = asyncio.get_event_loop().time()
+                consultation.last_message_at = datetime.utcnow()
+            
+            if memory is not None:
+                consultation.summary, consultation.history = memory
             
             await session.flush()
             await session.refresh(consultation)
             return consultation
     
+    async def get_answer_cache_opt_out(self, user_id: int) -> bool:
+        """Отказался ли пользователь от готовых ответов консультации."""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(User.answer_cache_opt_out).where(User.id == user_id)
+            )
+            return bool(result.scalar_one_or_none())
+    
+    async def set_answer_cache_opt_out(self, user_id: int, opt_out: bool) -> bool:
+        """Включение или отключение готовых ответов консультации."""
+        async with self.get_session() as session:
+            result = await session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(answer_cache_opt_out=opt_out)
+            )
+            return result.rowcount > 0
+    
+    async def save_consultation_memory(
+        self,
+        user_id: int,
+        summary: Optional[str],
+        history: Optional[bytes]
+    ) -> bool:
+        """Сохранение памяти диалога консультации."""
+        async with self.get_session() as session:
+            result = await session.execute(
+                update(Consultation)
+                .where(Consultation.user_id == user_id)
+                .values(summary=summary, history=history)
+            )
+            return result.rowcount > 0
+    
     async def save_ai_analysis(
         self, 
         user_id: int, 
         media_type: str, 
         file_id: str, 
-        analysis_result: Dict[str, Any]
+        analysis_result: Dict[str, Any],
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
     ) -> AIAnalysis:
         """Сохранение результата ИИ-анализа."""
         async with self.get_session() as session:
@@ -189,6 +462,8 @@ class Database:
                 user_id=user_id,
                 media_type=media_type,
                 file_id=file_id,
+                file_unique_id=file_unique_id,
+                content_hash=content_hash,
                 analysis_result=json.dumps(analysis_result, ensure_ascii=False)
             )
             session.add(analysis)
@@ -196,6 +471,193 @@ class Database:
             await session.refresh(analysis)
             return analysis
     
+    async def find_ai_analysis(
+        self,
+        media_type: str,
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Последний результат анализа того же файла по file_unique_id или хешу."""
+        conditions = []
+        if file_unique_id:
+            conditions.append(AIAnalysis.file_unique_id == file_unique_id)
+        if content_hash:
+            conditions.append(AIAnalysis.content_hash == content_hash)
+        if not conditions:
+            return None
+        
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(AIAnalysis.analysis_result)
+                .where(AIAnalysis.media_type == media_type, or_(*conditions))
+                .order_by(AIAnalysis.id.desc())
+                .limit(1)
+            )
+            analysis_result = result.scalar_one_or_none()
+            return json.loads(analysis_result) if analysis_result else None
+    
+    async def enqueue_ai_job(
+        self,
+        user_id: int,
+        chat_id: int,
+        message_id: int,
+        media_type: str,
+        file_id: str,
+        file_unique_id: Optional[str] = None,
+        files: Optional[List[Tuple[str, Optional[str]]]] = None
+    ) -> int:
+        """Постановка задачи ИИ-анализа в очередь.
+        
+        Для альбома в files передаются пары (file_id, file_unique_id) всех фото.
+        """
+        async with self.get_session() as session:
+            job = AIJob(
+                user_id=user_id,
+                chat_id=chat_id,
+                message_id=message_id,
+                media_type=media_type,
+                file_id=file_id,
+                file_unique_id=file_unique_id,
+                files=json.dumps(files) if files else None
+            )
+            session.add(job)
+            await session.flush()
+            # Уведомление уходит воркерам при фиксации транзакции
+            await session.execute(text(f"NOTIFY {AI_JOBS_CHANNEL}"))
+            return job.id
+    
+    @asynccontextmanager
+    async def listen(self, channel: str, callback: Callable[[], None]):
+        """Подписка на NOTIFY канала на время контекста.
+        
+        Под подписку берется отдельное соединение; оно отдается вызывающему,
+        чтобы тот мог проверять его живость.
+        """
+        async with self.engine.connect() as connection:
+            raw = await connection.get_raw_connection()
+            
+            def listener(*args):
+                callback()
+            
+            await raw.driver_connection.add_listener(channel, listener)
+            try:
+                yield connection
+            finally:
+                await raw.driver_connection.remove_listener(channel, listener)
+    
+    async def claim_ai_job(self, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Захват одной задачи ИИ-анализа.
+        
+        Строка блокируется с SKIP LOCKED, поэтому воркеры в разных процессах
+        не ждут друг друга и не берут одну задачу. Аренда на lease_seconds
+        возвращает задачу в очередь, если воркер упал, не завершив ее;
+        пока задача выполняется, воркер продлевает аренду. lease_token
+        отличает текущего владельца от воркера, чья аренда истекла.
+        """
+        async with self.get_session() as session:
+            now = utcnow()
+            result = await session.execute(
+                select(AIJob)
+                .where(
+                    AIJob.status == "pending",
+                    AIJob.next_attempt_at <= now
+                )
+                .order_by(AIJob.next_attempt_at, AIJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalar_one_or_none()
+            if job is None:
+                return None
+            
+            job.attempts += 1
+            job.next_attempt_at = now + timedelta(seconds=lease_seconds)
+            job.lease_token = uuid.uuid4().hex
+            job.started_at = now
+            return {
+                "id": job.id,
+                "lease_token": job.lease_token,
+                "user_id": job.user_id,
+                "chat_id": job.chat_id,
+                "message_id": job.message_id,
+                "media_type": job.media_type,
+                "file_id": job.file_id,
+                "file_unique_id": job.file_unique_id,
+                "files": [tuple(pair) for pair in json.loads(job.files)] if job.files else None,
+                "attempts": job.attempts,
+                "waited": (now - job.created_at).total_seconds()
+            }
+    
+    async def _update_owned_ai_job(self, job_id: int, lease_token: str, **values) -> bool:
+        """Изменение задачи, только если аренда еще у этого воркера."""
+        async with self.get_session() as session:
+            result = await session.execute(
+                update(AIJob)
+                .where(
+                    AIJob.id == job_id,
+                    AIJob.lease_token == lease_token,
+                    AIJob.status == "pending"
+                )
+                .values(**values)
+            )
+            return result.rowcount > 0
+    
+    async def renew_ai_job_lease(self, job_id: int, lease_token: str, lease_seconds: float) -> bool:
+        """Продление аренды задачи. False, если задачу уже забрал другой воркер."""
+        return await self._update_owned_ai_job(
+            job_id, lease_token,
+            next_attempt_at=utcnow() + timedelta(seconds=lease_seconds)
+        )
+    
+    async def finish_ai_job(
+        self, 
+        job_id: int, 
+        lease_token: str, 
+        status: str, 
+        error: Optional[str] = None
+    ) -> bool:
+        """Завершение задачи: status "done" или "failed". False, если аренда потеряна."""
+        return await self._update_owned_ai_job(
+            job_id, lease_token,
+            status=status, finished_at=utcnow(), last_error=error
+        )
+    
+    async def reschedule_ai_job(
+        self, 
+        job_id: int, 
+        lease_token: str, 
+        delay_seconds: float, 
+        error: str
+    ) -> bool:
+        """Перенос задачи на повторную попытку. False, если аренда потеряна."""
+        return await self._update_owned_ai_job(
+            job_id, lease_token,
+            next_attempt_at=utcnow() + timedelta(seconds=delay_seconds),
+            last_error=error
+        )
+    
+    async def get_ai_job_stats(self, window_seconds: float = 60.0) -> Dict[str, Any]:
+        """Состояние очереди ИИ-анализа по всем воркерам."""
+        async with self.get_session() as session:
+            now = utcnow()
+            since = now - timedelta(seconds=window_seconds)
+            result = await session.execute(
+                select(
+                    func.count().filter(AIJob.status == "pending"),
+                    func.min(AIJob.created_at).filter(AIJob.status == "pending"),
+                    func.count().filter(AIJob.status == "done"),
+                    func.count().filter(AIJob.status == "failed")
+                )
+                .where(or_(AIJob.status == "pending", AIJob.finished_at >= since))
+            )
+            pending, oldest, done, failed = result.one()
+            return {
+                "pending": pending,
+                "oldest_pending_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+                "done_per_minute": round(done * 60 / window_seconds, 2),
+                "failed_per_minute": round(failed * 60 / window_seconds, 2)
+            }
+    
     async def close(self):
         """Закрытие соединения с БД."""
         await self.engine.dispose()
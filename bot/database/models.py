@@ -1,14 +1,19 @@
 """Модели базы данных."""
 
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, Float, ForeignKey, UniqueConstraint, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
 
+def utcnow() -> datetime:
+    """Текущее время UTC с часовым поясом для колонок TIMESTAMP WITH TIME ZONE."""
+    return datetime.now(timezone.utc)
+
+
 class User(Base):
     """Модель пользователя."""
     
@@ -22,6 +27,9 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Отказ от готовых ответов из семантического кэша консультаций
+    answer_cache_opt_out = Column(Boolean, default=False, nullable=False)
+    
     # Связи
     logs = relationship("UserLog", back_populates="user")
     test_results = relationship("TestResult", back_populates="user")
@@ -58,10 +66,59 @@ class TestResult(Base):
     user = relationship("User", back_populates="test_results")
 
 
+class ResultOutbox(Base):
+    """Модель очереди отправки результатов тестов на сайт."""
+    
+    __tablename__ = "result_outbox"
+    
+    id = Column(Integer, primary_key=True)
+    test_result_id = Column(Integer, ForeignKey("test_results.id"), nullable=False)
+    idempotency_key = Column(String(64), unique=True, nullable=False)
+    status = Column(String(20), default="pending", index=True)  # "pending", "sent", "failed"
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    
+    # Связи
+    test_result = relationship("TestResult")
+
+
+class AIJob(Base):
+    """Модель задачи ИИ-анализа медиа в очереди."""
+    
+    __tablename__ = "ai_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(Integer, nullable=False)  # Сообщение "обрабатываю", которое правит воркер
+    media_type = Column(String(20), nullable=False)
+    file_id = Column(String(200), nullable=False)
+    file_unique_id = Column(String(100), nullable=True)
+    files = Column(Text, nullable=True)  # JSON [[file_id, file_unique_id], ...] для альбома
+    status = Column(String(20), default="pending", index=True)  # "pending", "done", "failed"
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), default=utcnow, index=True)
+    lease_token = Column(String(32), nullable=True)  # Воркер, владеющий арендой
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Связи
+    user = relationship("User")
+
+
 class PremiumAccess(Base):
     """Модель премиум доступа пользователя."""
     
     __tablename__ = "premium_access"
+    __table_args__ = (
+        # Одна запись на тип доступа: позволяет делать upsert при синхронизации
+        UniqueConstraint("user_id", "access_type", name="uq_premium_access_user_type"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -69,6 +126,7 @@ class PremiumAccess(Base):
     is_active = Column(Boolean, default=True)
     expires_at = Column(DateTime, nullable=True)
     remaining_uses = Column(Integer, nullable=True)  # Для пакетов
+    site_updated_at = Column(DateTime, nullable=True)  # Версия записи на сайте
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -88,6 +146,10 @@ class Consultation(Base):
     is_active = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # Память диалога: краткое содержание и сжатые последние реплики
+    summary = Column(Text, nullable=True)
+    history = Column(LargeBinary, nullable=True)
+    
     # Связи
     user = relationship("User")
 
@@ -96,11 +158,17 @@ class AIAnalysis(Base):
     """Модель результатов ИИ-анализа."""
     
     __tablename__ = "ai_analyses"
+    __table_args__ = (
+        Index("idx_ai_analyses_file_unique_id", "media_type", "file_unique_id"),
+        Index("idx_ai_analyses_content_hash", "media_type", "content_hash"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     media_type = Column(String(20), nullable=False)  # "photo", "video", "voice"
     file_id = Column(String(200), nullable=False)
+    file_unique_id = Column(String(100))  # Одинаков для пересланных копий
+    content_hash = Column(String(64))  # SHA-256 содержимого файла
     analysis_result = Column(Text, nullable=False)  # JSON с результатом
     created_at = Column(DateTime, default=datetime.utcnow)
     
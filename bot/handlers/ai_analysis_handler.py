@@ -1,13 +1,17 @@
 """Обработчик ИИ-анализа."""
 
-from typing import Dict, Any
+from typing import Dict, Any, List
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 
 from .base import BaseHandler
 from bot.data.messages import PREMIUM_MESSAGES, ERROR_MESSAGES
 from bot.data.keyboards import get_back_keyboard
-from bot.services.ai_service import ai_service
+from bot.services.ai_job_service import ai_job_service
+from bot.data.callbacks import AIMediaCallback
+from bot.utils.callback_dispatch import callback_table
+from bot.utils.media_group import MediaGroupCollector
+from config import settings
 
 
 class AIAnalysisHandler(BaseHandler):
@@ -17,14 +21,18 @@ class AIAnalysisHandler(BaseHandler):
         """Инициализация обработчика."""
         super().__init__(router)
         self.user_states: Dict[int, Dict[str, Any]] = {}  # user_id -> state
+        
+        # Фото альбома приходят отдельными обновлениями, анализируем их вместе
+        self.albums = MediaGroupCollector(
+            window=settings.media_group_window,
+            on_complete=self._process_album,
+            max_items=settings.media_group_max_photos
+        )
     
     def _setup_handlers(self):
         """Настройка обработчиков."""
         # Выбор типа медиа
-        self.router.callback_query.register(
-            self._handle_media_type_selection,
-            F.data.startswith("ai_")
-        )
+        callback_table.prefix(AIMediaCallback, self._handle_media_type_selection)
         
         # Обработка медиа файлов
         self.router.message.register(
@@ -42,21 +50,18 @@ class AIAnalysisHandler(BaseHandler):
             F.voice
         )
     
-    async def _handle_media_type_selection(self, callback: CallbackQuery):
+    async def _handle_media_type_selection(
+        self, 
+        callback: CallbackQuery, 
+        callback_data: AIMediaCallback
+    ):
         """Обработка выбора типа медиа."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
-            data = callback.data
-            
-            if data == "ai_photo":
-                media_type = "photo"
-                message = PREMIUM_MESSAGES["ai_analysis_photo"]
-            elif data == "ai_video":
-                media_type = "video"
-                message = PREMIUM_MESSAGES["ai_analysis_video"]
-            elif data == "ai_voice":
-                media_type = "voice"
-                message = PREMIUM_MESSAGES["ai_analysis_voice"]
+            user_id = await self._get_or_create_user(callback)
+            media_type = callback_data.media_type
+            
+            if media_type in ("photo", "video", "voice"):
+                message = PREMIUM_MESSAGES[f"ai_analysis_{media_type}"]
             else:
                 await self._handle_callback_error(callback, "general")
                 return
@@ -71,7 +76,6 @@ class AIAnalysisHandler(BaseHandler):
                 message,
                 reply_markup=get_back_keyboard()
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
@@ -79,6 +83,11 @@ class AIAnalysisHandler(BaseHandler):
     async def _handle_photo(self, message: Message):
         """Обработка фото."""
         try:
+            # Следующие фото уже собираемого альбома
+            if message.media_group_id and self.albums.collecting(message.media_group_id):
+                self.albums.add(message.media_group_id, message)
+                return
+            
             user_id = await self._get_or_create_user(message)
             
             # Проверяем, ждет ли пользователь фото
@@ -89,6 +98,10 @@ class AIAnalysisHandler(BaseHandler):
             if state["media_type"] != "photo":
                 return
             
+            if message.media_group_id:
+                self.albums.add(message.media_group_id, message)
+                return
+            
             await self._process_media(message, user_id, "photo")
             
         except Exception as e:
@@ -136,48 +149,30 @@ class AIAnalysisHandler(BaseHandler):
             # Логируем действие
             await self._log_user_action(user_id, f"ai_analysis_{media_type}_uploaded")
             
-            # Показываем сообщение о обработке
-            processing_msg = await message.answer(
-                PREMIUM_MESSAGES["ai_analysis_processing"]
-            )
-            
-            # Получаем file_id
+            # Получаем файл: file_unique_id одинаков у пересланных копий
             if media_type == "photo":
-                file_id = message.photo[-1].file_id
+                media = message.photo[-1]
             elif media_type == "video":
-                file_id = message.video.file_id
+                media = message.video
             elif media_type == "voice":
-                file_id = message.voice.file_id
+                media = message.voice
             else:
-                await processing_msg.edit_text(ERROR_MESSAGES["invalid_media"])
+                await message.answer(ERROR_MESSAGES["invalid_media"])
                 return
             
-            # Анализируем медиа
-            result = await ai_service.analyze_media(
+            # Анализ выполняют воркеры очереди, они же правят это сообщение
+            processing_msg = await message.answer(
+                PREMIUM_MESSAGES["ai_analysis_queued"]
+            )
+            await ai_job_service.enqueue(
                 user_id=user_id,
-                file_id=file_id,
-                media_type=media_type
+                chat_id=message.chat.id,
+                message_id=processing_msg.message_id,
+                media_type=media_type,
+                file_id=media.file_id,
+                file_unique_id=media.file_unique_id
             )
             
-            # Удаляем сообщение о обработке
-            await processing_msg.delete()
-            
-            # Показываем результат
-            if result.get("status") == "success":
-                analysis_text = PREMIUM_MESSAGES["ai_analysis_result"].format(
-                    result=result.get("analysis", "Анализ недоступен")
-                )
-                
-                await message.answer(
-                    analysis_text,
-                    reply_markup=get_back_keyboard()
-                )
-            else:
-                await message.answer(
-                    ERROR_MESSAGES["processing_failed"],
-                    reply_markup=get_back_keyboard()
-                )
-            
             # Очищаем состояние пользователя
             if user_id in self.user_states:
                 del self.user_states[user_id]
@@ -188,6 +183,39 @@ class AIAnalysisHandler(BaseHandler):
             if user_id in self.user_states:
                 del self.user_states[user_id]
 
+    
+    async def _process_album(self, media_group_id: str, messages: List[Message]):
+        """Постановка альбома в очередь одной задачей."""
+        messages = sorted(messages, key=lambda item: item.message_id)
+        first = messages[0]
+        user_id = None
+        try:
+            user_id = await self._get_or_create_user(first)
+            await self._log_user_action(user_id, "ai_analysis_album_uploaded")
+            
+            files = [
+                (item.photo[-1].file_id, item.photo[-1].file_unique_id)
+                for item in messages
+            ]
+            processing_msg = await first.answer(
+                PREMIUM_MESSAGES["ai_analysis_queued"]
+            )
+            await ai_job_service.enqueue(
+                user_id=user_id,
+                chat_id=first.chat.id,
+                message_id=processing_msg.message_id,
+                media_type="album",
+                file_id=files[0][0],
+                files=files
+            )
+            
+        except Exception as e:
+            await self._handle_error(first, "general")
+        finally:
+            # Очищаем состояние пользователя
+            if user_id in self.user_states:
+                del self.user_states[user_id]
+
 
 # Создание экземпляра обработчика
 ai_analysis_handler = AIAnalysisHandler(Router())
@@ -1,12 +1,14 @@
 """Базовый обработчик для бота."""
 
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Union
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 
 from bot.database.database import db
 from bot.data.messages import ERROR_MESSAGES
+from bot.middlewares.early_answer import early_answer_middleware
 
 
 class BaseHandler:
@@ -21,14 +23,18 @@ class BaseHandler:
         """Настройка обработчиков. Переопределяется в наследниках."""
         pass
     
-    async def _get_or_create_user(self, message: Message) -> int:
-        """Получение или создание пользователя в БД."""
+    async def _get_or_create_user(self, event: Union[Message, CallbackQuery]) -> int:
+        """Получение или создание пользователя в БД.
+
+        Для callback-запроса передается сам запрос: у callback.message
+        отправитель — бот, а не нажавший кнопку пользователь.
+        """
         try:
             user = await db.get_or_create_user(
-                telegram_id=message.from_user.id,
-                username=message.from_user.username,
-                first_name=message.from_user.first_name,
-                last_name=message.from_user.last_name
+                telegram_id=event.from_user.id,
+                username=event.from_user.username,
+                first_name=event.from_user.first_name,
+                last_name=event.from_user.last_name
             )
             return user.id
         except Exception as e:
@@ -63,4 +69,16 @@ class BaseHandler:
     ):
         """Обработка ошибок в callback."""
         error_text = ERROR_MESSAGES.get(error, ERROR_MESSAGES["general"])
-        await callback.answer(error_text, show_alert=True)
+        callback_answer = early_answer_middleware.pending_answer(callback)
+        if callback_answer is None:
+            try:
+                await callback.answer(error_text, show_alert=True)
+            except TelegramBadRequest:
+                await callback.message.answer(error_text)
+        elif callback_answer.answered:
+            # Middleware уже ответил заранее, алерт показать нельзя
+            await callback.message.answer(error_text)
+        else:
+            # Middleware ответит алертом после обработчика
+            callback_answer.text = error_text
+            callback_answer.show_alert = True
@@ -2,14 +2,18 @@
 
 from typing import Dict, Any
 from aiogram import Router, F
+from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from config import settings
 from .base import BaseHandler
-from bot.data.messages import FREE_ZONE_MESSAGES, ERROR_MESSAGES
+from bot.data.messages import FREE_ZONE_MESSAGES, ERROR_MESSAGES, NAVIGATION_MESSAGES
 from bot.data.keyboards import get_back_keyboard
 from bot.services.consultation_service import consultation_service
+from bot.utils.callback_dispatch import callback_table
+from bot.utils.progressive_edit import ProgressiveEditor
 
 
 class ConsultationStates(StatesGroup):
@@ -28,9 +32,16 @@ class ConsultationHandler(BaseHandler):
     def _setup_handlers(self):
         """Настройка обработчиков."""
         # Начало консультации
-        self.router.callback_query.register(
-            self._handle_start_consultation,
-            F.data == "start_consultation"
+        callback_table.exact("start_consultation", self._handle_start_consultation)
+        
+        # Отказ от готовых ответов и возврат к ним
+        self.router.message.register(
+            self._handle_answer_cache_off,
+            Command("cache_off")
+        )
+        self.router.message.register(
+            self._handle_answer_cache_on,
+            Command("cache_on")
         )
         
         # Сообщения в консультации
@@ -41,15 +52,12 @@ class ConsultationHandler(BaseHandler):
         )
         
         # Завершение консультации
-        self.router.callback_query.register(
-            self._handle_end_consultation,
-            F.data == "end_consultation"
-        )
+        callback_table.exact("end_consultation", self._handle_end_consultation)
     
     async def _handle_start_consultation(self, callback: CallbackQuery, state: FSMContext):
         """Начало консультации."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             
             # Проверяем лимит
             limit_check = await consultation_service.check_user_limit(user_id)
@@ -59,7 +67,6 @@ class ConsultationHandler(BaseHandler):
                     consultation_service.get_limit_reached_message(),
                     reply_markup=get_back_keyboard()
                 )
-                await callback.answer()
                 return
             
             # Начинаем консультацию
@@ -89,8 +96,6 @@ class ConsultationHandler(BaseHandler):
                     reply_markup=get_back_keyboard()
                 )
             
-            await callback.answer()
-            
         except Exception as e:
             await self._handle_callback_error(callback, "general")
     
@@ -106,20 +111,37 @@ class ConsultationHandler(BaseHandler):
             # Логируем сообщение
             await self._log_user_action(user_id, "consultation_message_sent", message.text)
             
-            # Показываем индикатор набора
-            await message.answer("🤖 ИИ печатает...")
+            # Показываем индикатор набора, в этом же сообщении появится ответ
+            typing_msg = await message.answer("🤖 ИИ печатает...")
+            editor = ProgressiveEditor(
+                typing_msg,
+                min_interval=settings.consultation_stream_edit_interval
+            )
             
-            # Отправляем сообщение в OpenAI
-            result = await consultation_service.send_message(user_id, message.text)
+            async def show_queue_position(position: int):
+                editor.update(
+                    NAVIGATION_MESSAGES["queue_position"].format(position=position)
+                )
             
-            if result["success"]:
+            # Отправляем сообщение в OpenAI, ответ показываем по мере генерации
+            result = await consultation_service.send_message(
+                user_id,
+                message.text,
+                on_queue_position=show_queue_position,
+                on_delta=lambda text: editor.update(f"🤖 {text} ▌")
+            )
+            
+            if result.get("retryable"):
+                # Консультация продолжается, пользователь может повторить вопрос
+                await editor.finish(result["message"])
+            elif result["success"]:
                 # Показываем ответ ИИ
                 ai_response = result["ai_response"]
                 remaining = result["remaining_messages"]
                 
                 response_text = f"🤖 {ai_response}\n\n💬 Осталось сообщений: {remaining}"
                 
-                await message.answer(response_text)
+                await editor.finish(response_text)
                 
                 # Если достигнут лимит, завершаем консультацию
                 if remaining <= 0:
@@ -129,7 +151,7 @@ class ConsultationHandler(BaseHandler):
                         reply_markup=get_back_keyboard()
                     )
             else:
-                await message.answer(
+                await editor.finish(
                     result["message"],
                     reply_markup=get_back_keyboard()
                 )
@@ -139,10 +161,28 @@ class ConsultationHandler(BaseHandler):
             await self._handle_error(message, "general")
             await self._end_consultation(user_id, state)
     
+    async def _handle_answer_cache_off(self, message: Message):
+        """Отключение готовых ответов из кэша."""
+        try:
+            user_id = await self._get_or_create_user(message)
+            await consultation_service.set_answer_cache_opt_out(user_id, True)
+            await message.answer(FREE_ZONE_MESSAGES["answer_cache_off"])
+        except Exception as e:
+            await self._handle_error(message, "general")
+    
+    async def _handle_answer_cache_on(self, message: Message):
+        """Включение готовых ответов из кэша."""
+        try:
+            user_id = await self._get_or_create_user(message)
+            await consultation_service.set_answer_cache_opt_out(user_id, False)
+            await message.answer(FREE_ZONE_MESSAGES["answer_cache_on"])
+        except Exception as e:
+            await self._handle_error(message, "general")
+    
     async def _handle_end_consultation(self, callback: CallbackQuery, state: FSMContext):
         """Завершение консультации."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             
             await self._end_consultation(user_id, state)
             
@@ -151,8 +191,6 @@ class ConsultationHandler(BaseHandler):
                 reply_markup=get_back_keyboard()
             )
             
-            await callback.answer()
-            
         except Exception as e:
             await self._handle_callback_error(callback, "general")
     
@@ -1,6 +1,6 @@
 """Обработчик главного меню."""
 
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 
@@ -14,6 +14,8 @@ from bot.data.keyboards import (
 )
 from bot.services.site_api_service import site_api_service
 from bot.services.consultation_service import consultation_service
+from bot.utils.callback_dispatch import callback_table
+from bot.utils.webhook_reply import webhook_reply
 
 
 class MainMenuHandler(BaseHandler):
@@ -28,64 +30,34 @@ class MainMenuHandler(BaseHandler):
         )
         
         # Главное меню
-        self.router.callback_query.register(
-            self._handle_main_menu,
-            F.data == "back_to_menu"
-        )
+        callback_table.exact("back_to_menu", self._handle_main_menu)
         
         # Справочник
-        self.router.callback_query.register(
-            self._handle_handbook,
-            F.data == "handbook"
-        )
+        callback_table.exact("handbook", self._handle_handbook)
         
         # Тесты сайта
-        self.router.callback_query.register(
-            self._handle_tests_site,
-            F.data == "tests_site"
-        )
+        callback_table.exact("tests_site", self._handle_tests_site)
         
         # Наш тест
-        self.router.callback_query.register(
-            self._handle_our_test,
-            F.data == "our_test"
-        )
+        callback_table.exact("our_test", self._handle_our_test)
         
         # Консультация
-        self.router.callback_query.register(
-            self._handle_consultation,
-            F.data == "consultation"
-        )
+        callback_table.exact("consultation", self._handle_consultation)
         
         # ИИ-анализ
-        self.router.callback_query.register(
-            self._handle_ai_analysis,
-            F.data == "ai_analysis"
-        )
+        callback_table.exact("ai_analysis", self._handle_ai_analysis)
         
         # Подписка
-        self.router.callback_query.register(
-            self._handle_subscription,
-            F.data == "subscription"
-        )
+        callback_table.exact("subscription", self._handle_subscription)
         
         # Пакеты
-        self.router.callback_query.register(
-            self._handle_packages,
-            F.data == "packages"
-        )
+        callback_table.exact("packages", self._handle_packages)
         
         # Курсы
-        self.router.callback_query.register(
-            self._handle_courses,
-            F.data == "courses"
-        )
+        callback_table.exact("courses", self._handle_courses)
         
         # Карты
-        self.router.callback_query.register(
-            self._handle_cards,
-            F.data == "cards"
-        )
+        callback_table.exact("cards", self._handle_cards)
     
     async def _handle_start(self, message: Message):
         """Обработка команды /start."""
@@ -99,26 +71,29 @@ class MainMenuHandler(BaseHandler):
     
     async def _handle_main_menu(self, callback: CallbackQuery):
         """Возврат в главное меню."""
-        await callback.message.edit_text(
-            MAIN_MENU_TEXT,
-            reply_markup=get_main_menu_keyboard()
+        # Редактирование уходит в ответе webhook
+        return webhook_reply(
+            callback.message.edit_text(
+                MAIN_MENU_TEXT,
+                reply_markup=get_main_menu_keyboard()
+            )
         )
-        await callback.answer()
     
     async def _handle_handbook(self, callback: CallbackQuery):
         """Обработка кнопки 'Справочник'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "handbook_clicked")
             
             # Получаем URL для справочника
             url = site_api_service.get_webview_url("handbook", user_id)
             
-            await callback.message.edit_text(
-                FREE_ZONE_MESSAGES["handbook"],
-                reply_markup=get_webview_keyboard(url, "📚 Открыть справочник")
+            return webhook_reply(
+                callback.message.edit_text(
+                    FREE_ZONE_MESSAGES["handbook"],
+                    reply_markup=get_webview_keyboard(url, "📚 Открыть справочник")
+                )
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
@@ -126,17 +101,18 @@ class MainMenuHandler(BaseHandler):
     async def _handle_tests_site(self, callback: CallbackQuery):
         """Обработка кнопки 'Тесты (сайт)'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "tests_site_clicked")
             
             # Получаем URL для тестов
             url = site_api_service.get_webview_url("tests", user_id)
             
-            await callback.message.edit_text(
-                FREE_ZONE_MESSAGES["tests_site"],
-                reply_markup=get_webview_keyboard(url, "🧪 Перейти к тестам")
+            return webhook_reply(
+                callback.message.edit_text(
+                    FREE_ZONE_MESSAGES["tests_site"],
+                    reply_markup=get_webview_keyboard(url, "🧪 Перейти к тестам")
+                )
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
@@ -144,7 +120,7 @@ class MainMenuHandler(BaseHandler):
     async def _handle_our_test(self, callback: CallbackQuery):
         """Обработка кнопки 'Наш тест'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "our_test_clicked")
             
             # Переходим к тесту
@@ -157,7 +133,7 @@ class MainMenuHandler(BaseHandler):
     async def _handle_consultation(self, callback: CallbackQuery):
         """Обработка кнопки 'Консультация'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "consultation_clicked")
             
             # Проверяем лимит консультаций
@@ -176,15 +152,13 @@ class MainMenuHandler(BaseHandler):
                     reply_markup=get_main_menu_keyboard()
                 )
             
-            await callback.answer()
-            
         except Exception as e:
             await self._handle_callback_error(callback, "general")
     
     async def _handle_ai_analysis(self, callback: CallbackQuery):
         """Обработка кнопки 'ИИ-Определение'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "ai_analysis_clicked")
             
             # Проверяем доступ к премиум функциям
@@ -202,25 +176,24 @@ class MainMenuHandler(BaseHandler):
                     reply_markup=get_main_menu_keyboard()
                 )
             
-            await callback.answer()
-            
         except Exception as e:
             await self._handle_callback_error(callback, "general")
     
     async def _handle_subscription(self, callback: CallbackQuery):
         """Обработка кнопки 'Подписка'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "subscription_clicked")
             
             # Получаем URL для подписки
             url = site_api_service.get_webview_url("subscription", user_id)
             
-            await callback.message.edit_text(
-                PREMIUM_MESSAGES["subscription_check"],
-                reply_markup=get_webview_keyboard(url, "⭐ Оформить подписку")
+            return webhook_reply(
+                callback.message.edit_text(
+                    PREMIUM_MESSAGES["subscription_check"],
+                    reply_markup=get_webview_keyboard(url, "⭐ Оформить подписку")
+                )
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
@@ -228,17 +201,18 @@ class MainMenuHandler(BaseHandler):
     async def _handle_packages(self, callback: CallbackQuery):
         """Обработка кнопки 'Пакеты'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "packages_clicked")
             
             # Получаем URL для пакетов
             url = site_api_service.get_webview_url("packages", user_id)
             
-            await callback.message.edit_text(
-                PREMIUM_MESSAGES["packages_check"],
-                reply_markup=get_webview_keyboard(url, "📦 Купить пакет")
+            return webhook_reply(
+                callback.message.edit_text(
+                    PREMIUM_MESSAGES["packages_check"],
+                    reply_markup=get_webview_keyboard(url, "📦 Купить пакет")
+                )
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
@@ -246,17 +220,18 @@ class MainMenuHandler(BaseHandler):
     async def _handle_courses(self, callback: CallbackQuery):
         """Обработка кнопки 'Курсы'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "courses_clicked")
             
             # Получаем URL для курсов
             url = site_api_service.get_webview_url("courses", user_id)
             
-            await callback.message.edit_text(
-                "🎓 Переходим к курсам...",
-                reply_markup=get_webview_keyboard(url, "🎓 Открыть курсы")
+            return webhook_reply(
+                callback.message.edit_text(
+                    "🎓 Переходим к курсам...",
+                    reply_markup=get_webview_keyboard(url, "🎓 Открыть курсы")
+                )
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
@@ -264,17 +239,18 @@ class MainMenuHandler(BaseHandler):
     async def _handle_cards(self, callback: CallbackQuery):
         """Обработка кнопки 'Карты'."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "cards_clicked")
             
             # Получаем URL для карт
             url = site_api_service.get_webview_url("cards", user_id)
             
-            await callback.message.edit_text(
-                "🃏 Переходим к картам...",
-                reply_markup=get_webview_keyboard(url, "🃏 Открыть карты")
+            return webhook_reply(
+                callback.message.edit_text(
+                    "🃏 Переходим к картам...",
+                    reply_markup=get_webview_keyboard(url, "🃏 Открыть карты")
+                )
             )
-            await callback.answer()
             
         except Exception as e:
             await self._handle_callback_error(callback, "general")
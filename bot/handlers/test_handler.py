@@ -1,13 +1,16 @@
 """Обработчик тестов."""
 
 from typing import Dict, Any
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import CallbackQuery
 
 from .base import BaseHandler
 from bot.data.messages import FREE_ZONE_MESSAGES, TEST_MESSAGES
 from bot.data.keyboards import get_test_answer_keyboard, get_back_keyboard
 from bot.services.test_service import test_service
+from bot.data.callbacks import TestAnswerCallback
+from bot.utils.callback_dispatch import callback_table
+from bot.utils.keyed_lock import user_locks
 
 
 class TestHandler(BaseHandler):
@@ -21,21 +24,15 @@ class TestHandler(BaseHandler):
     def _setup_handlers(self):
         """Настройка обработчиков."""
         # Ответы на вопросы теста
-        self.router.callback_query.register(
-            self._handle_test_answer,
-            F.data.startswith("test_answer:")
-        )
+        callback_table.prefix(TestAnswerCallback, self._handle_test_answer)
         
         # Начало теста
-        self.router.callback_query.register(
-            self._handle_start_test,
-            F.data == "start_test"
-        )
+        callback_table.exact("start_test", self._handle_start_test)
     
     async def start_test(self, callback: CallbackQuery):
         """Начало теста."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             
             # Инициализируем состояние теста
             self.user_tests[user_id] = {
@@ -52,7 +49,7 @@ class TestHandler(BaseHandler):
     async def _handle_start_test(self, callback: CallbackQuery):
         """Обработка кнопки начала теста."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             await self._log_user_action(user_id, "test_started")
             
             # Инициализируем состояние теста
@@ -67,20 +64,26 @@ class TestHandler(BaseHandler):
         except Exception as e:
             await self._handle_callback_error(callback, "general")
     
-    async def _handle_test_answer(self, callback: CallbackQuery):
+    async def _handle_test_answer(
+        self, 
+        callback: CallbackQuery, 
+        callback_data: TestAnswerCallback
+    ):
         """Обработка ответа на вопрос теста."""
         try:
-            user_id = await self._get_or_create_user(callback.message)
+            user_id = await self._get_or_create_user(callback)
             
-            # Парсим данные callback
-            data = callback.data.split(":")
-            question_id = int(data[1])
-            answer_index = int(data[2])
-            
-            # Сохраняем ответ
-            if user_id in self.user_tests:
-                test_state = self.user_tests[user_id]
-                test_state["answers"].append(answer_index)
+            # Ответы одного пользователя обрабатываются строго по очереди.
+            # Ключ — Telegram ID: user_id равен 0 у всех, если БД недоступна
+            async with user_locks.lock(callback.from_user.id):
+                test_state = self.user_tests.get(user_id)
+                
+                # Повторное нажатие на уже отвеченный вопрос игнорируем
+                if test_state is None or callback_data.question_id != test_state["current_question"]:
+                    return
+                
+                # Сохраняем ответ
+                test_state["answers"].append(callback_data.answer_index)
                 
                 # Переходим к следующему вопросу или завершаем тест
                 if test_state["current_question"] < test_state["total_questions"]:
@@ -89,8 +92,6 @@ class TestHandler(BaseHandler):
                 else:
                     await self._complete_test(callback, user_id)
             
-            await callback.answer()
-            
         except Exception as e:
             await self._handle_callback_error(callback, "general")
     
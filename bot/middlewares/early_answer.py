@@ -0,0 +1,110 @@
+"""Ранний ответ на callback-запросы."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, TelegramObject
+from aiogram.utils.callback_answer import CallbackAnswer, CallbackAnswerMiddleware
+
+from bot.utils.metrics import LatencyStats
+
+
+logger = logging.getLogger(__name__)
+
+
+class EarlyCallbackAnswerMiddleware(CallbackAnswerMiddleware):
+    """Отвечает на callback-запрос сразу при получении.
+
+    Ответ отправляется в фоне, обработчик выполняется параллельно с ним,
+    поэтому пользователь не ждет окончания работы обработчика.
+    Маршрут, которому нужен собственный ответ (например, алерт), объявляет
+    флаг callback_answer={"pre": False}; тогда ответ уходит после
+    обработчика с текстом, заданным через pending_answer().
+    """
+
+    def __init__(self, **kwargs: Any):
+        """Инициализация middleware."""
+        super().__init__(pre=True, **kwargs)
+        self.answer_stats = LatencyStats()
+        self.handler_stats = LatencyStats()
+        self._tasks: Set[asyncio.Task] = set()
+        # Настройки ответа на callback-запросы, обработчики которых еще работают
+        self._pending: Dict[str, CallbackAnswer] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Обработка события."""
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        # Флаги маршрута из таблицы callback-запросов важнее флагов обработчика
+        properties = get_flag(data, "callback_answer")
+        route = data.get("callback_route")
+        if route is not None:
+            properties = route.flags.get("callback_answer", properties)
+
+        callback_answer = data["callback_answer"] = self.construct_callback_answer(
+            properties=properties
+        )
+
+        self._pending[event.id] = callback_answer
+
+        started = time.monotonic()
+        if not callback_answer.disabled and callback_answer.answered:
+            task = asyncio.create_task(self._answer_early(event, callback_answer, started))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._pending.pop(event.id, None)
+            self.handler_stats.observe(time.monotonic() - started, error=error)
+            if not callback_answer.disabled and not callback_answer.answered:
+                await self.answer(event, callback_answer)
+
+    def pending_answer(self, event: CallbackQuery) -> Optional[CallbackAnswer]:
+        """Настройки ответа на запрос, который сейчас обрабатывается.
+
+        None, если запрос прошел мимо middleware. Если answered ложно,
+        текст и алерт можно задать до окончания работы обработчика.
+        """
+        return self._pending.get(event.id)
+
+    async def _answer_early(
+        self,
+        event: CallbackQuery,
+        callback_answer: CallbackAnswer,
+        started: float
+    ):
+        """Фоновый ответ на callback-запрос."""
+        error = False
+        try:
+            await self.answer(event, callback_answer)
+        except TelegramAPIError as e:
+            error = True
+            logger.error(f"Ошибка ответа на callback {event.id}: {e}")
+        finally:
+            self.answer_stats.observe(time.monotonic() - started, error=error)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Статистика времени ответа и работы обработчиков."""
+        return {
+            "answer": self.answer_stats.get_stats(),
+            "handler": self.handler_stats.get_stats()
+        }
+
+
+# Глобальный экземпляр middleware
+early_answer_middleware = EarlyCallbackAnswerMiddleware()
@@ -0,0 +1,294 @@
+"""Очередь задач ИИ-анализа медиа в Postgres."""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from sqlalchemy import text
+
+from config import settings
+from bot.database.database import db, AI_JOBS_CHANNEL
+from bot.services.ai_service import ai_service
+from bot.data.messages import PREMIUM_MESSAGES, ERROR_MESSAGES, NAVIGATION_MESSAGES
+from bot.data.keyboards import get_back_keyboard
+from bot.utils.metrics import LatencyStats
+
+
+class AIJobService:
+    """Долговечная очередь анализа медиа.
+
+    Обработчик только ставит задачу в таблицу ai_jobs и сразу отвечает.
+    Воркеры (отдельные процессы, см. ai_worker.py) забирают задачи с
+    FOR UPDATE SKIP LOCKED, показывают ход работы правкой сообщения
+    "обрабатываю" и повторяют неудачные попытки с экспоненциальной
+    задержкой. Задачи переживают перезапуск, а число воркеров
+    масштабируется независимо от приема webhook.
+
+    Пока задача выполняется, аренда продлевается; если ее все же забрал
+    другой воркер, этот воркер бросает задачу и не отвечает пользователю,
+    а завершение и повтор проверяют владельца аренды в БД. О новых задачах
+    воркеры узнают через LISTEN/NOTIFY, опрос остается запасным путем.
+    """
+
+    def __init__(self):
+        """Инициализация сервиса."""
+        self.claimed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.lost = 0
+        self.job_stats = LatencyStats()
+        self.wait_stats = LatencyStats()
+        self._finished: Deque[float] = deque()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._listener: Optional[asyncio.Task] = None
+
+    async def enqueue(
+        self,
+        user_id: int,
+        chat_id: int,
+        message_id: int,
+        media_type: str,
+        file_id: str,
+        file_unique_id: Optional[str] = None,
+        files: Optional[List[Tuple[str, Optional[str]]]] = None
+    ) -> int:
+        """Постановка задачи анализа в очередь (воркеры получают NOTIFY)."""
+        return await db.enqueue_ai_job(
+            user_id, chat_id, message_id, media_type, file_id, file_unique_id, files
+        )
+
+    def _backoff(self, attempts: int) -> float:
+        """Задержка перед следующей попыткой с джиттером."""
+        delay = min(
+            settings.ai_job_max_backoff,
+            settings.ai_job_base_backoff * 2 ** (attempts - 1)
+        )
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _show(self, bot: Bot, job: Dict[str, Any], text: str):
+        """Правка сообщения о ходе обработки."""
+        try:
+            await bot.edit_message_text(text, chat_id=job["chat_id"], message_id=job["message_id"])
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                print(f"Ошибка обновления статуса задачи {job['id']}: {e}")
+        except Exception as e:
+            print(f"Ошибка обновления статуса задачи {job['id']}: {e}")
+
+    async def _deliver(self, bot: Bot, job: Dict[str, Any], text: str):
+        """Итоговый ответ пользователю вместо сообщения о ходе обработки."""
+        try:
+            await bot.delete_message(job["chat_id"], job["message_id"])
+        except Exception:
+            pass
+        try:
+            await bot.send_message(job["chat_id"], text, reply_markup=get_back_keyboard())
+        except Exception as e:
+            print(f"Ошибка отправки результата задачи {job['id']}: {e}")
+
+    async def _analyze(self, bot: Bot, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Анализ медиа задачи."""
+        async def show_queue_position(position: int):
+            await self._show(
+                bot, job, NAVIGATION_MESSAGES["queue_position"].format(position=position)
+            )
+
+        if job.get("files"):
+            return await ai_service.analyze_album_files(
+                bot=bot,
+                user_id=job["user_id"],
+                files=job["files"],
+                on_queue_position=show_queue_position
+            )
+        return await ai_service.analyze_media(
+            bot=bot,
+            user_id=job["user_id"],
+            file_id=job["file_id"],
+            media_type=job["media_type"],
+            file_unique_id=job["file_unique_id"],
+            on_queue_position=show_queue_position
+        )
+
+    async def _keep_lease(self, job: Dict[str, Any]):
+        """Продление аренды, пока задача выполняется; возврат — аренда потеряна."""
+        while True:
+            await asyncio.sleep(settings.ai_job_lease / 3)
+            try:
+                owned = await db.renew_ai_job_lease(
+                    job["id"], job["lease_token"], settings.ai_job_lease
+                )
+            except Exception as e:
+                print(f"Ошибка продления аренды задачи {job['id']}: {e}")
+                continue
+            if not owned:
+                return
+
+    async def _run_leased(self, job: Dict[str, Any], work: Awaitable[Any]) -> Tuple[bool, Any]:
+        """Выполнение work с продлением аренды. (False, None), если аренда потеряна."""
+        task = asyncio.ensure_future(work)
+        heartbeat = asyncio.create_task(self._keep_lease(job))
+        try:
+            await asyncio.wait({task, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for pending in (task, heartbeat):
+                if not pending.done():
+                    pending.cancel()
+            await asyncio.gather(task, heartbeat, return_exceptions=True)
+        if task.cancelled():
+            return False, None
+        return True, task.result()
+
+    def _lose(self, job: Dict[str, Any]):
+        """Учет задачи, которую забрал другой воркер."""
+        self.lost += 1
+        print(f"Аренда задачи {job['id']} потеряна, результат не отправляется")
+
+    async def process_one(self, bot: Bot) -> bool:
+        """Обработка одной задачи. False, если очередь пуста."""
+        job = await db.claim_ai_job(lease_seconds=settings.ai_job_lease)
+        if job is None:
+            return False
+
+        self.claimed += 1
+        if job["attempts"] == 1:
+            self.wait_stats.observe(job["waited"])
+        await self._show(bot, job, PREMIUM_MESSAGES["ai_analysis_processing"])
+
+        started = time.monotonic()
+        owned, result = await self._run_leased(job, self._analyze(bot, job))
+        if not owned:
+            self._lose(job)
+            return True
+        success = result.get("status") == "success"
+        self.job_stats.observe(time.monotonic() - started, error=not success)
+
+        # Сначала задача закрывается в БД с проверкой владельца и только
+        # потом пользователь получает ответ: так он не получит его дважды
+        if success:
+            if not await db.finish_ai_job(job["id"], job["lease_token"], "done"):
+                self._lose(job)
+                return True
+            await self._deliver(
+                bot, job,
+                PREMIUM_MESSAGES["ai_analysis_result"].format(
+                    result=result.get("analysis", "Анализ недоступен")
+                )
+            )
+            self.succeeded += 1
+            self._finished.append(time.monotonic())
+        elif result.get("retryable", True) and job["attempts"] < settings.ai_job_max_attempts:
+            delay = self._backoff(job["attempts"])
+            if not await db.reschedule_ai_job(
+                job["id"], job["lease_token"], delay, error=result.get("message")
+            ):
+                self._lose(job)
+                return True
+            await self._show(
+                bot, job,
+                PREMIUM_MESSAGES["ai_analysis_retry"].format(
+                    delay=round(delay),
+                    attempt=job["attempts"] + 1,
+                    max_attempts=settings.ai_job_max_attempts
+                )
+            )
+            self.retried += 1
+        else:
+            if not await db.finish_ai_job(
+                job["id"], job["lease_token"], "failed", error=result.get("message")
+            ):
+                self._lose(job)
+                return True
+            await self._deliver(
+                bot, job, result.get("user_message", ERROR_MESSAGES["processing_failed"])
+            )
+            self.failed += 1
+            self._finished.append(time.monotonic())
+
+        return True
+
+    async def _run_worker(self, bot: Bot):
+        """Цикл воркера: до опустошения очереди, затем ожидание."""
+        while True:
+            try:
+                while await self.process_one(bot):
+                    pass
+            except Exception as e:
+                print(f"Ошибка обработки задачи ИИ-анализа: {e}")
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    timeout=settings.ai_job_poll_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _listen(self):
+        """Пробуждение воркеров по NOTIFY о новых задачах с переподключением."""
+        while True:
+            try:
+                async with db.listen(AI_JOBS_CHANNEL, self._wakeup.set) as connection:
+                    # Задачи, поставленные до подписки, забираются сразу
+                    self._wakeup.set()
+                    while True:
+                        await asyncio.sleep(settings.ai_job_stats_interval)
+                        # Обрыв соединения обнаруживается запросом, а не подпиской
+                        await connection.execute(text("SELECT 1"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка подписки на задачи ИИ-анализа: {e}")
+            await asyncio.sleep(settings.ai_job_poll_interval)
+
+    def start(self, bot: Bot, concurrency: int):
+        """Запуск concurrency воркеров в текущем процессе."""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+        for _ in range(concurrency - len(self._tasks)):
+            self._tasks.append(asyncio.create_task(self._run_worker(bot)))
+
+    async def stop(self):
+        """Остановка воркеров; незавершенные задачи вернутся в очередь по аренде."""
+        tasks = self._tasks + ([self._listener] if self._listener is not None else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._listener = None
+
+    def throughput(self, now: Optional[float] = None) -> float:
+        """Завершенных задач в минуту в этом процессе."""
+        if now is None:
+            now = time.monotonic()
+        while self._finished and now - self._finished[0] > 60:
+            self._finished.popleft()
+        return float(len(self._finished))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика воркеров этого процесса."""
+        return {
+            "workers": len(self._tasks),
+            "claimed": self.claimed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "lost": self.lost,
+            "jobs_per_minute": self.throughput(),
+            "job": self.job_stats.get_stats(),
+            "queue_wait": self.wait_stats.get_stats()
+        }
+
+
+# Глобальный экземпляр сервиса
+ai_job_service = AIJobService()
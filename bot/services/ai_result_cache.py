@@ -0,0 +1,97 @@
+"""Кэш результатов ИИ-анализа по содержимому файла."""
+
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from bot.database.database import db
+from bot.utils.response_cache import ResponseCache
+
+
+class AIResultCache:
+    """Результаты анализа, адресованные содержимым медиа.
+
+    Ключей два: file_unique_id от Telegram, который одинаков у пересланных
+    копий и известен еще до загрузки, и SHA-256 содержимого, который ловит
+    тот же файл, загруженный заново. Перед базой стоит LRU в памяти,
+    поэтому повтор отдается без запроса к БД и без вызова модели.
+    """
+
+    def __init__(self):
+        """Инициализация кэша."""
+        self.memory = ResponseCache(maxsize=settings.ai_result_cache_size, stale_ttl=0)
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _keys(
+        media_type: str,
+        file_unique_id: Optional[str],
+        content_hash: Optional[str]
+    ) -> List[str]:
+        """Ключи записи в памяти."""
+        keys = []
+        if file_unique_id:
+            keys.append(f"{media_type}:uid:{file_unique_id}")
+        if content_hash:
+            keys.append(f"{media_type}:sha256:{content_hash}")
+        return keys
+
+    async def get(
+        self,
+        media_type: str,
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Сохраненный результат анализа того же файла."""
+        keys = self._keys(media_type, file_unique_id, content_hash)
+        if not keys:
+            return None
+
+        for key in keys:
+            entry = self.memory.get(key)
+            if entry is not None and entry.is_fresh():
+                self.memory_hits += 1
+                self.memory.hits += 1
+                return entry.value
+
+        try:
+            result = await db.find_ai_analysis(media_type, file_unique_id, content_hash)
+        except Exception as e:
+            print(f"Ошибка поиска результата анализа: {e}")
+            result = None
+
+        if result is None:
+            self.misses += 1
+            self.memory.misses += 1
+            return None
+
+        self.db_hits += 1
+        self.put(media_type, result, file_unique_id, content_hash)
+        return result
+
+    def put(
+        self,
+        media_type: str,
+        result: Dict[str, Any],
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ):
+        """Запоминание результата под всеми известными ключами."""
+        for key in self._keys(media_type, file_unique_id, content_hash):
+            self.memory.set(key, result, settings.ai_result_cache_ttl)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша."""
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.get_stats()
+        }
+
+
+# Глобальный экземпляр кэша
+ai_result_cache = AIResultCache()
@@ -1,15 +1,30 @@
 """Сервис для работы с ИИ-анализом."""
 
-import os
 import asyncio
-from typing import Dict, Any, Optional
-import aiofiles
-import httpx
-from openai import AsyncOpenAI
-from pathlib import Path
+import hashlib
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from aiogram import Bot
 
 from config import settings
 from bot.database.database import db
+from bot.services.openai_client import openai_client_factory
+from bot.services.llm_admission import llm_admission, get_user_tier
+from bot.services.model_router import model_router, VISION, TRANSCRIPTION, TRANSCRIPT_ANALYSIS
+from bot.services.media_download_service import media_download_service, MediaFile, MediaTooLargeError
+from bot.services.worker_pool import media_worker_pool
+from bot.services.ai_result_cache import ai_result_cache
+from bot.utils.image_processing import prepare_image
+from bot.utils.video_processing import extract_keyframes
+from bot.utils.audio_processing import prepare_voice
+from bot.utils.metrics import LatencyStats
+from bot.data.messages import ERROR_MESSAGES
+from bot.utils.admission import PositionCallback, UserBusyError
+
+
+def album_key(keys: Iterable[str]) -> str:
+    """Ключ альбома из ключей его файлов по порядку."""
+    return hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()
 
 
 class AIService:
@@ -17,17 +32,50 @@ class AIService:
     
     def __init__(self):
         """Инициализация сервиса."""
-        self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
-        self.storage_path = Path(settings.storage_path)
-        self.storage_path.mkdir(exist_ok=True)
+        self.image_bytes_in = 0
+        self.image_bytes_out = 0
+        self.video_frames_sampled = 0
+        self.video_frames_sent = 0
+        self.voice_stage_stats: Dict[str, LatencyStats] = {}
+    
+    @property
+    def openai_client(self):
+        """Общий для процесса клиент OpenAI."""
+        return openai_client_factory.get_client()
+    
+    async def _prepare_photo(self, media: MediaFile) -> str:
+        """Уменьшение и пересжатие фото в пуле процессов, JPEG base64."""
+        image = await media_worker_pool.run(
+            prepare_image,
+            await media.read(),
+            settings.vision_image_max_side,
+            settings.vision_image_quality
+        )
+        self.image_bytes_in += image["original_bytes"]
+        self.image_bytes_out += image["bytes"]
+        return image["base64"]
+    
+    @staticmethod
+    def _image_part(image_base64: str) -> Dict[str, Any]:
+        """Изображение в сообщении для GPT Vision."""
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{image_base64}",
+                "detail": settings.vision_image_detail
+            }
+        }
     
-    async def analyze_photo(self, file_path: str) -> Dict[str, Any]:
+    async def analyze_photo(self, media: MediaFile) -> Dict[str, Any]:
         """Анализ фото с помощью GPT Vision."""
         try:
+            image = await self._prepare_photo(media)
+            
             # Анализ фото через GPT Vision
-            with open(file_path, "rb") as image_file:
-                response = await self.openai_client.chat.completions.create(
-                    model="gpt-4-vision-preview",
+            
+            async def request(model: str):
+                return await self.openai_client.chat.completions.create(
+                    model=model,
                     messages=[
                         {
                             "role": "user",
@@ -36,24 +84,20 @@ class AIService:
                                     "type": "text",
                                     "text": "Проанализируй это фото с точки зрения психологии и соционики. Опиши возможный тип личности, характерные черты, квадра и роль. Будь детальным и профессиональным."
                                 },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{image_file.read()}"
-                                    }
-                                }
+                                self._image_part(image)
                             ]
                         }
                     ],
                     max_tokens=1000
                 )
             
+            response, model = await model_router.call(VISION, request)
             analysis = response.choices[0].message.content
             
             return {
                 "type": "photo",
                 "analysis": analysis,
-                "model": "gpt-4-vision",
+                "model": model,
                 "status": "success"
             }
             
@@ -65,19 +109,88 @@ class AIService:
                 "status": "error"
             }
     
-    async def analyze_video(self, file_path: str) -> Dict[str, Any]:
-        """Анализ видео (извлекаем кадры и анализируем)."""
+    async def analyze_album(self, media_files: List[MediaFile]) -> Dict[str, Any]:
+        """Анализ альбома фото одним запросом к GPT Vision."""
         try:
-            # Для видео используем анализ ключевых кадров
-            # В реальном проекте здесь была бы интеграция с CV2 для извлечения кадров
+            images = await asyncio.gather(*(self._prepare_photo(media) for media in media_files))
+            
+            content = [
+                {
+                    "type": "text",
+                    "text": f"Это альбом из {len(images)} фото. Проанализируй их с точки зрения психологии и соционики. Если на фото один и тот же человек, дай общий вывод по всем снимкам; если разные люди — коротко по каждому. Опиши возможный тип личности, характерные черты, квадру и роль. Будь детальным и профессиональным."
+                }
+            ]
+            content.extend(self._image_part(image) for image in images)
+            
+            async def request(model: str):
+                return await self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": content}],
+                    max_tokens=1500
+                )
             
-            # Пока используем базовый анализ
-            analysis = "Анализ видео: определение типа личности по ключевым кадрам. Видео содержит динамические элементы, которые могут указывать на активный тип личности."
+            response, model = await model_router.call(VISION, request)
+            analysis = response.choices[0].message.content
             
             return {
-                "type": "video",
+                "type": "album",
                 "analysis": analysis,
+                "model": model,
+                "photos": len(images),
+                "status": "success"
+            }
+            
+        except Exception as e:
+            return {
+                "type": "album",
+                "analysis": f"Ошибка анализа альбома: {str(e)}",
                 "model": "gpt-4-vision",
+                "status": "error"
+            }
+    
+    async def analyze_video(self, media: MediaFile) -> Dict[str, Any]:
+        """Анализ видео по ключевым кадрам одним запросом к GPT Vision."""
+        try:
+            # Кадры извлекаются в пуле процессов из файла на диске
+            path = await media.ensure_path(media_download_service.spool_file(media.media_type))
+            keyframes = await media_worker_pool.run(
+                extract_keyframes,
+                str(path),
+                settings.video_max_keyframes,
+                settings.video_sample_interval,
+                settings.video_scene_threshold,
+                settings.video_hash_distance,
+                settings.vision_image_max_side,
+                settings.vision_image_quality
+            )
+            if not keyframes["frames"]:
+                raise ValueError("Не удалось извлечь кадры из видео")
+            self.video_frames_sampled += keyframes["sampled"]
+            self.video_frames_sent += len(keyframes["frames"])
+            
+            content = [
+                {
+                    "type": "text",
+                    "text": f"Это {len(keyframes['frames'])} ключевых кадров одного видео в хронологическом порядке. Проанализируй человека на видео с точки зрения психологии и соционики: мимику, жесты, манеру держаться. Опиши возможный тип личности, характерные черты, квадру и роль. Будь детальным и профессиональным."
+                }
+            ]
+            content.extend(self._image_part(frame) for frame in keyframes["frames"])
+            
+            async def request(model: str):
+                return await self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": content}],
+                    max_tokens=1000
+                )
+            
+            response, model = await model_router.call(VISION, request)
+            analysis = response.choices[0].message.content
+            
+            return {
+                "type": "video",
+                "analysis": analysis,
+                "model": model,
+                "frames": len(keyframes["frames"]),
                 "status": "success"
             }
             
@@ -89,42 +202,82 @@ class AIService:
                 "status": "error"
             }
     
-    async def analyze_voice(self, file_path: str) -> Dict[str, Any]:
+    async def analyze_voice(self, media: MediaFile) -> Dict[str, Any]:
         """Анализ голосового сообщения."""
         try:
-            # Транскрипция голоса через Whisper
-            with open(file_path, "rb") as audio_file:
-                transcript = await self.openai_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="ru"
-                )
+            # Декодирование, обрезка тишины и деление по паузам в пуле процессов
+            timings: Dict[str, float] = {}
+            path = await media.ensure_path(media_download_service.spool_file(media.media_type))
+            voice = await media_worker_pool.run(
+                prepare_voice,
+                str(path),
+                settings.voice_sample_rate,
+                settings.voice_silence_threshold_db,
+                settings.voice_min_pause,
+                settings.voice_max_chunk_seconds
+            )
+            timings.update(voice["timings"])
+            if not voice["chunks"]:
+                raise ValueError("В голосовом сообщении не найдена речь")
             
-            text = transcript.text
+            # Фрагменты распознаются через Whisper параллельно и склеиваются по порядку
+            semaphore = asyncio.Semaphore(settings.voice_transcription_concurrency)
             
-            # Анализ текста через GPT
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Ты - эксперт по психологии и соционике. Проанализируй текст и определи возможный тип личности, характерные черты, квадра и роль."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Проанализируй этот текст: {text}"
-                    }
-                ],
-                max_tokens=800
+            async def transcribe_chunk(index: int, chunk: bytes):
+                async def transcribe(model: str):
+                    return await self.openai_client.audio.transcriptions.create(
+                        model=model,
+                        file=(f"voice_{index}.wav", chunk),
+                        language="ru"
+                    )
+                
+                async with semaphore:
+                    return await model_router.call(TRANSCRIPTION, transcribe)
+            
+            started = time.monotonic()
+            transcripts = await asyncio.gather(*(
+                transcribe_chunk(index, chunk)
+                for index, chunk in enumerate(voice["chunks"])
+            ))
+            timings["transcribe"] = time.monotonic() - started
+            text = " ".join(
+                transcript.text.strip() for transcript, _ in transcripts if transcript.text.strip()
             )
+            transcription_model = transcripts[0][1]
+            
+            # Анализ текста через GPT
+            async def analyze(model: str):
+                return await self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "Ты - эксперт по психологии и соционике. Проанализируй текст и определи возможный тип личности, характерные черты, квадра и роль."
+                        },
+                        {
+                            "role": "user",
+                            "content": f"Проанализируй этот текст: {text}"
+                        }
+                    ],
+                    max_tokens=800
+                )
             
+            started = time.monotonic()
+            response, analysis_model = await model_router.call(TRANSCRIPT_ANALYSIS, analyze)
+            timings["analysis"] = time.monotonic() - started
             analysis = response.choices[0].message.content
             
+            for stage, duration in timings.items():
+                self._observe_voice_stage(stage, duration)
+            
             return {
                 "type": "voice",
                 "transcript": text,
                 "analysis": analysis,
-                "model": "whisper-1 + gpt-4",
+                "model": f"{transcription_model} + {analysis_model}",
+                "chunks": len(voice["chunks"]),
+                "duration": voice["duration"],
+                "timings_ms": {stage: round(duration * 1000, 2) for stage, duration in timings.items()},
                 "status": "success"
             }
             
@@ -136,65 +289,192 @@ class AIService:
                 "status": "error"
             }
     
-    async def save_media_file(self, file_id: str, media_type: str) -> Optional[str]:
-        """Сохранение медиа файла во временное хранилище."""
+    def _observe_voice_stage(self, stage: str, duration: float):
+        """Учет длительности этапа обработки голосового."""
+        stats = self.voice_stage_stats.get(stage)
+        if stats is None:
+            stats = self.voice_stage_stats[stage] = LatencyStats()
+        stats.observe(duration)
+    
+    async def analyze_media(
+        self, 
+        bot: Bot,
+        user_id: int, 
+        file_id: str, 
+        media_type: str,
+        file_unique_id: Optional[str] = None,
+        on_queue_position: Optional[PositionCallback] = None
+    ) -> Dict[str, Any]:
+        """Основной метод анализа медиа.
+        
+        Повторный или пересланный файл отдается из кэша результатов:
+        по file_unique_id еще до загрузки, по хешу содержимого после нее.
+        Файл загружается до очереди LLM, чтобы загрузка не занимала слот.
+        """
+        media = None
         try:
-            # В реальном проекте здесь была бы загрузка файла через Telegram Bot API
-            # Пока возвращаем заглушку
-            temp_path = self.storage_path / f"{file_id}_{media_type}.tmp"
+            cached = await ai_result_cache.get(media_type, file_unique_id=file_unique_id)
+            if cached is not None:
+                return await self._reuse_result(user_id, file_id, media_type, cached, file_unique_id)
+            
+            if llm_admission.holds(user_id):
+                raise UserBusyError(user_id)
             
-            # Создаем временный файл
-            async with aiofiles.open(temp_path, 'w') as f:
-                await f.write(f"Temporary file for {file_id}")
+            media = await media_download_service.download(bot, file_id, media_type)
             
-            return str(temp_path)
+            cached = await ai_result_cache.get(media_type, content_hash=media.content_hash)
+            if cached is not None:
+                return await self._reuse_result(
+                    user_id, file_id, media_type, cached,
+                    media.file_unique_id, media.content_hash
+                )
             
+            tier = await get_user_tier(user_id)
+            async with llm_admission.slot(user_id, tier, on_queue_position):
+                return await self._analyze_media(user_id, media)
         except Exception as e:
-            print(f"Ошибка сохранения файла: {e}")
-            return None
+            return self._failure(e)
+        finally:
+            if media is not None:
+                await media.cleanup()
     
-    async def cleanup_temp_file(self, file_path: str):
-        """Очистка временного файла."""
+    async def analyze_album_files(
+        self,
+        bot: Bot,
+        user_id: int,
+        files: List[Tuple[str, Optional[str]]],
+        on_queue_position: Optional[PositionCallback] = None
+    ) -> Dict[str, Any]:
+        """Анализ альбома: пары (file_id, file_unique_id) в порядке альбома.
+        
+        Ключи кэша альбома — хеши, собранные из ключей всех фото по порядку.
+        """
+        media_files: List[MediaFile] = []
+        file_id = files[0][0]
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            unique_ids = [file_unique_id for _, file_unique_id in files]
+            album_unique_id = album_key(unique_ids) if all(unique_ids) else None
+            cached = await ai_result_cache.get("album", file_unique_id=album_unique_id)
+            if cached is not None:
+                return await self._reuse_result(user_id, file_id, "album", cached, album_unique_id)
+            
+            if llm_admission.holds(user_id):
+                raise UserBusyError(user_id)
+            
+            downloads = await asyncio.gather(
+                *(media_download_service.download(bot, photo_id, "photo") for photo_id, _ in files),
+                return_exceptions=True
+            )
+            media_files = [media for media in downloads if isinstance(media, MediaFile)]
+            for download in downloads:
+                if isinstance(download, BaseException):
+                    raise download
+            
+            album_hash = album_key(media.content_hash for media in media_files)
+            cached = await ai_result_cache.get("album", content_hash=album_hash)
+            if cached is not None:
+                return await self._reuse_result(
+                    user_id, file_id, "album", cached, album_unique_id, album_hash
+                )
+            
+            tier = await get_user_tier(user_id)
+            async with llm_admission.slot(user_id, tier, on_queue_position):
+                result = await self.analyze_album(media_files)
+            
+            if result.get("status") == "success":
+                await db.save_ai_analysis(
+                    user_id=user_id,
+                    media_type="album",
+                    file_id=file_id,
+                    analysis_result=result,
+                    file_unique_id=album_unique_id,
+                    content_hash=album_hash
+                )
+                ai_result_cache.put("album", result, album_unique_id, album_hash)
+            return result
         except Exception as e:
-            print(f"Ошибка удаления временного файла: {e}")
+            return self._failure(e)
+        finally:
+            for media in media_files:
+                await media.cleanup()
     
-    async def analyze_media(
-        self, 
-        user_id: int, 
-        file_id: str, 
-        media_type: str
+    @staticmethod
+    def _failure(error: Exception) -> Dict[str, Any]:
+        """Результат анализа, не дошедшего до модели."""
+        if isinstance(error, UserBusyError):
+            return {
+                "status": "error",
+                "message": "Запрос пользователя уже выполняется",
+                "user_message": ERROR_MESSAGES["request_in_progress"]
+            }
+        if isinstance(error, asyncio.TimeoutError):
+            return {
+                "status": "error",
+                "message": "Истекло время ожидания в очереди",
+                "user_message": ERROR_MESSAGES["queue_timeout"]
+            }
+        if isinstance(error, MediaTooLargeError):
+            return {
+                "status": "error",
+                "message": "Файл превышает допустимый размер",
+                "user_message": ERROR_MESSAGES["file_too_large"],
+                "retryable": False
+            }
+        return {
+            "status": "error",
+            "message": f"Ошибка загрузки файла: {str(error)}"
+        }
+    
+    async def _reuse_result(
+        self,
+        user_id: int,
+        file_id: str,
+        media_type: str,
+        result: Dict[str, Any],
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Основной метод анализа медиа."""
+        """Готовый результат из кэша, записанный в историю пользователя."""
+        ai_result_cache.put(media_type, result, file_unique_id, content_hash)
+        try:
+            await db.save_ai_analysis(
+                user_id=user_id,
+                media_type=media_type,
+                file_id=file_id,
+                analysis_result=result,
+                file_unique_id=file_unique_id,
+                content_hash=content_hash
+            )
+        except Exception as e:
+            print(f"Ошибка сохранения результата анализа: {e}")
+        return {**result, "cached": True}
+    
+    async def _analyze_media(self, user_id: int, media: MediaFile) -> Dict[str, Any]:
+        """Анализ загруженного медиа."""
         try:
-            # Сохраняем файл
-            file_path = await self.save_media_file(file_id, media_type)
-            if not file_path:
-                return {"status": "error", "message": "Не удалось сохранить файл"}
-            
             # Анализируем в зависимости от типа
-            if media_type == "photo":
-                result = await self.analyze_photo(file_path)
-            elif media_type == "video":
-                result = await self.analyze_video(file_path)
-            elif media_type == "voice":
-                result = await self.analyze_voice(file_path)
+            if media.media_type == "photo":
+                result = await self.analyze_photo(media)
+            elif media.media_type == "video":
+                result = await self.analyze_video(media)
+            elif media.media_type == "voice":
+                result = await self.analyze_voice(media)
             else:
                 result = {"status": "error", "message": "Неподдерживаемый тип медиа"}
             
-            # Сохраняем результат в БД
+            # Сохраняем результат в БД и в кэш результатов
             if result.get("status") == "success":
                 await db.save_ai_analysis(
                     user_id=user_id,
-                    media_type=media_type,
-                    file_id=file_id,
-                    analysis_result=result
+                    media_type=media.media_type,
+                    file_id=media.file_id,
+                    analysis_result=result,
+                    file_unique_id=media.file_unique_id,
+                    content_hash=media.content_hash
+                )
+                ai_result_cache.put(
+                    media.media_type, result, media.file_unique_id, media.content_hash
                 )
-            
-            # Очищаем временный файл
-            await self.cleanup_temp_file(file_path)
             
             return result
             
@@ -203,6 +483,20 @@ class AIService:
                 "status": "error",
                 "message": f"Ошибка анализа: {str(e)}"
             }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика подготовки медиа."""
+        return {
+            "image_bytes_in": self.image_bytes_in,
+            "image_bytes_out": self.image_bytes_out,
+            "video_frames_sampled": self.video_frames_sampled,
+            "video_frames_sent": self.video_frames_sent,
+            "voice_stages": {
+                stage: stats.get_stats() for stage, stats in self.voice_stage_stats.items()
+            },
+            "result_cache": ai_result_cache.get_stats(),
+            "worker_pool": media_worker_pool.get_stats()
+        }
 
 
 # Глобальный экземпляр сервиса
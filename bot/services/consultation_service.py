@@ -1,11 +1,27 @@
 """Сервис для работы с консультациями."""
 
 import asyncio
-from typing import Dict, Any, Optional
-from openai import AsyncOpenAI
+import time
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 
 from config import settings
 from bot.database.database import db
+from bot.services.openai_client import openai_client_factory
+from bot.services.conversation_memory import ConversationMemory, count_tokens
+from bot.services.model_router import model_router, is_model_failure, SHORT_QUESTION, LONG_QUESTION
+from bot.services.llm_admission import llm_admission, get_user_tier
+from bot.data.messages import ERROR_MESSAGES
+from bot.utils.admission import PositionCallback, UserBusyError
+from bot.utils.semantic_cache import SemanticCache, normalize_question
+
+
+SYSTEM_PROMPT = """Ты - эксперт по психологии и соционике. 
+                        Отвечай на вопросы пользователя профессионально, но понятно. 
+                        Используй русский язык. Будь дружелюбным и полезным."""
+
+SUMMARY_PROMPT = """Сократи диалог консультации по психологии и соционике до краткого 
+                    содержания на русском языке. Сохрани факты о пользователе, его вопросы, 
+                    выводы и договоренности. Пиши сжато, без вступлений."""
 
 
 class ConsultationService:
@@ -13,8 +29,13 @@ class ConsultationService:
     
     def __init__(self):
         """Инициализация сервиса."""
-        self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
         self.free_limit = settings.free_consultation_limit
+        self._compactions: Dict[int, asyncio.Task] = {}
+    
+    @property
+    def openai_client(self):
+        """Общий для процесса клиент OpenAI."""
+        return openai_client_factory.get_client()
     
     async def check_user_limit(self, user_id: int) -> Dict[str, Any]:
         """Проверка лимита консультаций пользователя."""
@@ -83,9 +104,16 @@ class ConsultationService:
     async def send_message(
         self, 
         user_id: int, 
-        message: str
+        message: str,
+        on_queue_position: Optional[PositionCallback] = None,
+        on_delta: Optional[Callable[[str], Any]] = None
     ) -> Dict[str, Any]:
-        """Отправка сообщения в консультации."""
+        """Отправка сообщения в консультации.
+
+        Ответ берется из семантического кэша или запрашивается у модели
+        с допуском через очередь LLM. on_delta получает накопленный текст
+        ответа по мере генерации.
+        """
         try:
             # Проверяем лимит
             limit_check = await self.check_user_limit(user_id)
@@ -95,29 +123,30 @@ class ConsultationService:
                     "message": "Достигнут лимит сообщений"
                 }
             
-            # Отправляем сообщение в OpenAI
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Ты - эксперт по психологии и соционике. 
-                        Отвечай на вопросы пользователя профессионально, но понятно. 
-                        Используй русский язык. Будь дружелюбным и полезным."""
-                    },
-                    {
-                        "role": "user",
-                        "content": message
-                    }
-                ],
-                max_tokens=800,
-                temperature=0.7
-            )
+            # Загружаем память диалога, дождавшись ее сжатия
+            memory = await self._load_memory(user_id)
+            
+            # Частые вопросы отвечаем из кэша, не занимая очередь LLM
+            ai_response, question, vector = await self._cache_lookup(user_id, message, memory)
+            if ai_response is not None:
+                if on_delta is not None:
+                    on_delta(ai_response)
+            else:
+                tier = await get_user_tier(user_id)
+                async with llm_admission.slot(user_id, tier, on_queue_position):
+                    ai_response = await self._generate_reply(memory, message, on_delta)
+                if vector is not None:
+                    answer_cache.add(question, vector, ai_response)
             
-            ai_response = response.choices[0].message.content
+            # Увеличиваем счетчик сообщений и сохраняем память диалога
+            memory.add_turn(message, ai_response)
+            await db.create_or_update_consultation(user_id, 1, memory=memory.dump())
             
-            # Увеличиваем счетчик сообщений
-            await db.create_or_update_consultation(user_id, 1)
+            # Старые реплики сворачиваем в краткое содержание в фоне
+            if memory.needs_compaction(settings.consultation_history_budget):
+                self._compactions[user_id] = asyncio.create_task(
+                    self._compact_memory(user_id, memory)
+                )
             
             return {
                 "success": True,
@@ -125,6 +154,18 @@ class ConsultationService:
                 "remaining_messages": limit_check["remaining_messages"] - 1
             }
             
+        except UserBusyError:
+            return {
+                "success": False,
+                "retryable": True,
+                "message": ERROR_MESSAGES["request_in_progress"]
+            }
+        except asyncio.TimeoutError:
+            return {
+                "success": False,
+                "retryable": True,
+                "message": ERROR_MESSAGES["queue_timeout"]
+            }
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
             return {
@@ -132,11 +173,171 @@ class ConsultationService:
                 "message": "Ошибка обработки сообщения"
             }
     
+    async def _generate_reply(
+        self,
+        memory: ConversationMemory,
+        message: str,
+        on_delta: Optional[Callable[[str], Any]] = None
+    ) -> str:
+        """Запрос ответа ИИ на сообщение с потоковой выдачей.
+
+        Модель выбирает маршрутизатор; задержкой модели считается время
+        до первого фрагмента ответа — именно его ждет пользователь.
+        """
+        messages = memory.build_messages(
+            SYSTEM_PROMPT,
+            message,
+            budget=settings.consultation_history_budget
+        )
+        if count_tokens(message) > settings.llm_router_long_question_tokens:
+            request_class = LONG_QUESTION
+        else:
+            request_class = SHORT_QUESTION
+        
+        async def open_stream(model: str):
+            stream = await self.openai_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=800,
+                temperature=0.7,
+                stream=True
+            )
+            deltas = self._content_deltas(stream)
+            try:
+                first = await deltas.__anext__()
+            except StopAsyncIteration:
+                first = ""
+            except BaseException:
+                await stream.response.aclose()
+                raise
+            return deltas, first
+        
+        started = time.monotonic()
+        (deltas, first), model = await model_router.call(request_class, open_stream)
+        
+        parts = [first]
+        if first and on_delta is not None:
+            on_delta(first)
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                if on_delta is not None:
+                    on_delta("".join(parts))
+        except Exception as e:
+            # Обрыв потока после первого фрагмента — тоже сбой модели
+            if is_model_failure(e):
+                model_router.record(model, time.monotonic() - started, error=True)
+            raise
+        
+        return "".join(parts)
+    
+    @staticmethod
+    async def _content_deltas(stream) -> AsyncIterator[str]:
+        """Текстовые фрагменты потокового ответа."""
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def _cache_lookup(
+        self,
+        user_id: int,
+        message: str,
+        memory: ConversationMemory
+    ) -> Tuple[Optional[str], Optional[str], Optional[List[float]]]:
+        """Поиск готового ответа: (ответ, нормализованный вопрос, эмбеддинг).
+
+        Кэш применим только к первому вопросу консультации: дальше ответ
+        зависит от истории диалога. Пока у пользователя идет запрос к LLM,
+        кэш не используется, чтобы не разойтись с его памятью диалога.
+        """
+        if (
+            not settings.semantic_cache_enabled
+            or memory.turns
+            or memory.summary
+            or llm_admission.holds(user_id)
+            or await db.get_answer_cache_opt_out(user_id)
+        ):
+            return None, None, None
+        
+        question = normalize_question(message)
+        answer = answer_cache.get_exact(question)
+        if answer is not None:
+            return answer, question, None
+        
+        try:
+            response = await self.openai_client.embeddings.create(
+                model=settings.semantic_cache_embedding_model,
+                input=question
+            )
+            vector = response.data[0].embedding
+        except Exception as e:
+            print(f"Ошибка получения эмбеддинга вопроса: {e}")
+            return None, None, None
+        
+        return answer_cache.search(vector), question, vector
+    
+    async def set_answer_cache_opt_out(self, user_id: int, opt_out: bool) -> bool:
+        """Отказ пользователя от готовых ответов или возврат к ним."""
+        try:
+            return await db.set_answer_cache_opt_out(user_id, opt_out)
+        except Exception as e:
+            print(f"Ошибка изменения настройки кэша ответов: {e}")
+            return False
+    
+    async def _wait_compaction(self, user_id: int):
+        """Ожидание фонового сжатия памяти пользователя."""
+        task = self._compactions.get(user_id)
+        if task is not None:
+            await asyncio.shield(task)
+    
+    async def _load_memory(self, user_id: int) -> ConversationMemory:
+        """Загрузка памяти диалога."""
+        await self._wait_compaction(user_id)
+        consultation = await db.get_consultation_info(user_id)
+        if consultation is None:
+            return ConversationMemory()
+        return ConversationMemory.load(consultation.summary, consultation.history)
+    
+    async def _compact_memory(self, user_id: int, memory: ConversationMemory):
+        """Сворачивание старых реплик в краткое содержание."""
+        try:
+            old_turns = memory.split_for_compaction(settings.consultation_memory_keep_tokens)
+            if not old_turns:
+                return
+            
+            transcript = "\n".join(
+                f"{'Пользователь' if role == 'user' else 'Консультант'}: {text}"
+                for role, text in old_turns
+            )
+            response = await self.openai_client.chat.completions.create(
+                model=settings.consultation_summary_model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {
+                        "role": "user",
+                        "content": f"Краткое содержание: {memory.summary or 'нет'}\n\n"
+                                   f"Новые реплики:\n{transcript}"
+                    }
+                ],
+                max_tokens=settings.consultation_summary_max_tokens,
+                temperature=0.3
+            )
+            
+            memory.summary = response.choices[0].message.content.strip()
+            await db.save_consultation_memory(user_id, *memory.dump())
+            
+        except Exception as e:
+            # История в БД осталась полной, сжатие повторится после следующей реплики
+            print(f"Ошибка сжатия памяти консультации: {e}")
+        finally:
+            self._compactions.pop(user_id, None)
+    
     async def end_consultation(self, user_id: int) -> bool:
         """Завершение консультации."""
         try:
-            # В реальном проекте здесь можно добавить логику завершения
-            # Пока просто возвращаем True
+            # Следующая консультация начинается с чистой памяти
+            await self._wait_compaction(user_id)
+            await db.save_consultation_memory(user_id, None, None)
             return True
         except Exception as e:
             print(f"Ошибка завершения консультации: {e}")
@@ -154,5 +355,12 @@ class ConsultationService:
         return f"❌ Достигнут лимит бесплатных консультаций ({self.free_limit} в месяц). Для продолжения оформите подписку."
 
 
+# Кэш ответов на первые вопросы консультаций
+answer_cache = SemanticCache(
+    maxsize=settings.semantic_cache_size,
+    threshold=settings.semantic_cache_threshold,
+    ttl=settings.semantic_cache_ttl
+)
+
 # Глобальный экземпляр сервиса
 consultation_service = ConsultationService()
@@ -0,0 +1,140 @@
+"""Память диалога консультации с ограничением по токенам."""
+
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+
+# Накладные токены на одно сообщение в формате chat completions
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Роли хранятся одной буквой, чтобы история занимала меньше места
+_ROLES = {"u": "user", "a": "assistant"}
+_ROLE_CODES = {role: code for code, role in _ROLES.items()}
+
+
+def _load_encoder():
+    """Токенизатор tiktoken, если пакет установлен."""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model("gpt-4")
+    except Exception:
+        return None
+
+
+_encoder = _load_encoder()
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов в тексте сообщения с учетом накладных расходов.
+
+    Без tiktoken используется оценка по длине текста, с запасом для
+    кириллицы, которая занимает больше токенов, чем латиница.
+    """
+    if _encoder is not None:
+        tokens = len(_encoder.encode(text))
+    else:
+        tokens = len(text) // settings.consultation_chars_per_token + 1
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationMemory:
+    """История одной консультации: краткое содержание и последние реплики."""
+
+    def __init__(
+        self,
+        summary: Optional[str] = None,
+        turns: Optional[List[Tuple[str, str]]] = None
+    ):
+        """Инициализация памяти."""
+        self.summary = summary or ""
+        self.turns: List[Tuple[str, str]] = turns or []
+
+    @classmethod
+    def load(cls, summary: Optional[str], history: Optional[bytes]) -> "ConversationMemory":
+        """Восстановление памяти из сохраненного вида."""
+        turns = []
+        if history:
+            try:
+                turns = [
+                    (_ROLES[code], text)
+                    for code, text in json.loads(zlib.decompress(history))
+                ]
+            except (zlib.error, ValueError, KeyError) as e:
+                print(f"Ошибка чтения истории консультации: {e}")
+        return cls(summary, turns)
+
+    def dump(self) -> Tuple[Optional[str], Optional[bytes]]:
+        """Компактный вид для сохранения: summary и сжатая история."""
+        if not self.turns:
+            return self.summary or None, None
+        payload = json.dumps(
+            [[_ROLE_CODES[role], text] for role, text in self.turns],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return self.summary or None, zlib.compress(payload.encode("utf-8"))
+
+    def add_turn(self, user_message: str, assistant_message: str):
+        """Добавление пары реплик."""
+        self.turns.append(("user", user_message))
+        self.turns.append(("assistant", assistant_message))
+
+    @property
+    def tokens(self) -> int:
+        """Размер памяти в токенах."""
+        total = sum(count_tokens(text) for _, text in self.turns)
+        if self.summary:
+            total += count_tokens(self.summary)
+        return total
+
+    def build_messages(
+        self,
+        system_prompt: str,
+        user_message: str,
+        budget: int
+    ) -> List[Dict[str, Any]]:
+        """Сообщения для запроса к модели в пределах бюджета токенов.
+
+        Краткое содержание идет всегда, из реплик берутся самые новые,
+        которые помещаются в бюджет; не поместившиеся отбрасываются.
+        """
+        messages = [{"role": "system", "content": system_prompt}]
+        remaining = budget
+        if self.summary:
+            summary_text = f"Краткое содержание предыдущего разговора: {self.summary}"
+            messages.append({"role": "system", "content": summary_text})
+            remaining -= count_tokens(summary_text)
+
+        recent: List[Dict[str, Any]] = []
+        for role, text in reversed(self.turns):
+            remaining -= count_tokens(text)
+            if remaining < 0:
+                break
+            recent.append({"role": role, "content": text})
+
+        messages.extend(reversed(recent))
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def needs_compaction(self, budget: int) -> bool:
+        """Превышен ли бюджет памяти."""
+        return self.tokens > budget
+
+    def split_for_compaction(self, keep_tokens: int) -> List[Tuple[str, str]]:
+        """Отделение старых реплик, которые нужно свернуть в summary.
+
+        Оставляются самые новые пары реплик общим размером до keep_tokens.
+        """
+        kept = 0
+        index = len(self.turns)
+        while index >= 2:
+            pair_tokens = sum(count_tokens(text) for _, text in self.turns[index - 2:index])
+            if kept + pair_tokens > keep_tokens:
+                break
+            kept += pair_tokens
+            index -= 2
+        old, self.turns = self.turns[:index], self.turns[index:]
+        return old
@@ -0,0 +1,170 @@
+"""Сервис синхронизации подписок и пакетов с сайтом."""
+
+import asyncio
+import hashlib
+import hmac
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from config import settings
+from bot.database.database import db
+from bot.services.site_api_service import site_api_service
+
+
+class EntitlementSyncService:
+    """Сервис синхронизации подписок и пакетов с сайтом.
+
+    Сайт — источник правды о подписках и пакетах. Бот периодически забирает
+    изменения постранично и сохраняет их пакетами в premium_access, а сайт
+    может прислать изменения сразу через push-endpoint. Поэтому проверки
+    доступа в обработчиках читают только локальную БД. Каждое изменение
+    несет время updated_at на сайте, и более старое изменение не
+    перезаписывает более новое, в каком бы порядке они ни пришли.
+    """
+
+    def __init__(self):
+        """Инициализация сервиса."""
+        self.last_synced_at: Optional[str] = None
+        self.synced_items = 0
+        self.pushed_items = 0
+        self.invalid_items = 0
+        self.failed_runs = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def sync_changes(self) -> int:
+        """Загрузка изменений с сайта с момента последней синхронизации."""
+        started_at = datetime.now(timezone.utc).isoformat()
+        cursor = None
+        total = 0
+
+        while True:
+            page = await site_api_service.get_entitlement_changes(
+                updated_since=self.last_synced_at,
+                cursor=cursor,
+                limit=settings.entitlement_sync_page_size
+            )
+            if page is None:
+                # Сайт недоступен: повторим с той же отметки в следующий раз
+                self.failed_runs += 1
+                return total
+
+            items = page.get("items", [])
+            valid = [item for item in items if self.is_valid_item(item)]
+            if len(valid) < len(items):
+                self.invalid_items += len(items) - len(valid)
+                print(f"Пропущены некорректные изменения подписок: {len(items) - len(valid)}")
+            total += await self._upsert_in_batches(valid)
+
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+
+        self.last_synced_at = started_at
+        self.synced_items += total
+        return total
+
+    @staticmethod
+    def is_valid_item(item: Any) -> bool:
+        """Проверка изменения: пользователь, тип доступа и даты в ISO 8601."""
+        if not isinstance(item, dict):
+            return False
+        access_type = item.get("access_type")
+        if not isinstance(access_type, str) or not 0 < len(access_type) <= 50:
+            return False
+        try:
+            int(item["telegram_user_id"])
+            datetime.fromisoformat(item["updated_at"])
+            if item.get("expires_at"):
+                datetime.fromisoformat(item["expires_at"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    async def apply_changes(self, items: List[Dict[str, Any]]) -> int:
+        """Применение изменений, присланных сайтом (уже проверенных is_valid_item)."""
+        updated = await self._upsert_in_batches(items)
+        self.pushed_items += updated
+
+        # Сбрасываем закэшированные ответы сайта по этим пользователям
+        for telegram_user_id in {item["telegram_user_id"] for item in items}:
+            site_api_service.invalidate_cache(f"/api/users/{telegram_user_id}/")
+
+        return updated
+
+    async def _upsert_in_batches(self, items: List[Dict[str, Any]]) -> int:
+        """Сохранение изменений пакетами."""
+        batch_size = settings.entitlement_sync_batch_size
+        total = 0
+        for start in range(0, len(items), batch_size):
+            total += await db.upsert_entitlements(items[start:start + batch_size])
+        return total
+
+    def verify_signature(
+        self,
+        body: bytes,
+        timestamp: str,
+        signature: str,
+        now: Optional[float] = None
+    ) -> bool:
+        """Проверка HMAC-SHA256 подписи "<timestamp>.<тело>" запроса от сайта.
+
+        Отметка времени (Unix, секунды) входит в подпись, а запросы, разошедшиеся
+        с часами бота больше чем на site_webhook_tolerance, отклоняются, поэтому
+        перехваченный запрос нельзя повторить позже.
+        """
+        if not settings.site_webhook_secret or not signature or not timestamp:
+            return False
+        try:
+            sent_at = float(timestamp)
+        except ValueError:
+            return False
+        if now is None:
+            now = time.time()
+        if abs(now - sent_at) > settings.site_webhook_tolerance:
+            return False
+        expected = hmac.new(
+            settings.site_webhook_secret.encode(),
+            timestamp.encode() + b"." + body,
+            hashlib.sha256
+        ).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    async def _run_periodic(self):
+        """Периодическая синхронизация."""
+        while True:
+            try:
+                await self.sync_changes()
+            except Exception as e:
+                self.failed_runs += 1
+                print(f"Ошибка синхронизации подписок: {e}")
+            await asyncio.sleep(settings.entitlement_sync_interval)
+
+    def start(self):
+        """Запуск фоновой синхронизации."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_periodic())
+
+    async def stop(self):
+        """Остановка фоновой синхронизации."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика синхронизации."""
+        return {
+            "last_synced_at": self.last_synced_at,
+            "synced_items": self.synced_items,
+            "pushed_items": self.pushed_items,
+            "invalid_items": self.invalid_items,
+            "failed_runs": self.failed_runs
+        }
+
+
+# Глобальный экземпляр сервиса
+entitlement_sync_service = EntitlementSyncService()
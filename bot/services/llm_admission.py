@@ -0,0 +1,35 @@
+"""Допуск запросов к LLM."""
+
+from config import settings
+from bot.database.database import db
+from bot.utils.admission import AdmissionController
+
+
+async def get_user_tier(user_id: int) -> str:
+    """Тариф пользователя для очереди запросов к LLM."""
+    try:
+        if await db.check_subscription_status(user_id):
+            return "subscription"
+        if await db.check_package_balance(user_id) > 0:
+            return "package"
+    except Exception as e:
+        print(f"Ошибка определения тарифа: {e}")
+    return "free"
+
+
+# Глобальный контроллер допуска к LLM.
+# Состояние живет в памяти процесса: лимит и проверка "один запрос на
+# пользователя" действуют внутри процесса. Процесс webhook и каждый процесс
+# ai_worker.py держат собственный лимит, поэтому общий предел одновременных
+# запросов — LLM_MAX_CONCURRENCY на каждый процесс, и медиа одного
+# пользователя в разных процессах могут анализироваться одновременно.
+llm_admission = AdmissionController(
+    max_concurrency=settings.llm_max_concurrency,
+    tier_priority={
+        "subscription": settings.llm_subscription_priority,
+        "package": settings.llm_package_priority,
+        "free": 0.0
+    },
+    queue_timeout=settings.llm_queue_timeout,
+    notify_interval=settings.llm_queue_notify_interval
+)
@@ -0,0 +1,206 @@
+"""Потоковая загрузка медиа из Telegram."""
+
+import hashlib
+import io
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import aiofiles
+import aiofiles.os
+from aiogram import Bot
+
+from config import settings
+from bot.services.media_storage import MediaStorage, media_storage
+
+
+class MediaTooLargeError(Exception):
+    """Файл больше допустимого размера."""
+
+
+class MediaFile:
+    """Загруженный файл: в памяти, если он небольшой, иначе на диске."""
+
+    def __init__(self, file_id: str, file_unique_id: Optional[str], media_type: str):
+        """Инициализация файла."""
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.media_type = media_type
+        self.size = 0
+        self.path: Optional[Path] = None
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self._sha256 = hashlib.sha256()
+        self._content_hash: Optional[str] = None
+
+    @classmethod
+    def from_storage(
+        cls,
+        file_id: str,
+        file_unique_id: Optional[str],
+        media_type: str,
+        content_hash: str,
+        path: Path,
+        size: int
+    ) -> "MediaFile":
+        """Файл, уже сохраненный в хранилище; path — его закрепление."""
+        media = cls(file_id, file_unique_id, media_type)
+        media._buffer = None
+        media._content_hash = content_hash
+        media.path = path
+        media.size = size
+        return media
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-256 содержимого, считается по мере загрузки."""
+        if self._content_hash is not None:
+            return self._content_hash
+        return self._sha256.hexdigest()
+
+    @property
+    def in_memory(self) -> bool:
+        """Хранится ли файл в памяти."""
+        return self._buffer is not None
+
+    async def write(self, chunk: bytes, spool_path: Path):
+        """Запись очередного фрагмента с переносом на диск при росте."""
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+        if self._buffer is not None:
+            self._buffer.write(chunk)
+            if self._buffer.tell() <= settings.media_spool_max_memory:
+                return
+            # Файл перерос порог: переносим накопленное на диск
+            self.path = spool_path
+            self._file = await aiofiles.open(self.path, "wb")
+            await self._file.write(self._buffer.getvalue())
+            self._buffer = None
+            return
+        await self._file.write(chunk)
+
+    async def finish(self):
+        """Завершение записи."""
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+    async def ensure_path(self, spool_path: Path) -> Path:
+        """Путь к файлу на диске; файл из памяти записывается в spool_path."""
+        if self.path is None:
+            async with aiofiles.open(spool_path, "wb") as f:
+                await f.write(self._buffer.getvalue())
+            self.path = spool_path
+        return self.path
+
+    async def read(self) -> bytes:
+        """Содержимое файла."""
+        if self._buffer is not None:
+            return self._buffer.getvalue()
+        async with aiofiles.open(self.path, "rb") as f:
+            return await f.read()
+
+    async def cleanup(self):
+        """Освобождение памяти и удаление файла или закрепления с диска."""
+        await self.finish()
+        self._buffer = None
+        if self.path is not None:
+            try:
+                await aiofiles.os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Ошибка удаления временного файла: {e}")
+            self.path = None
+
+
+class MediaDownloadService:
+    """Загрузка файлов через Bot API.
+
+    file_id разрешается через getFile, затем содержимое читается потоком
+    фрагментами через сессию бота с проверкой размера. Небольшие файлы
+    остаются в памяти, крупные пишутся на диск через aiofiles, поэтому
+    цикл событий не блокируется. Загруженный файл сохраняется в хранилище
+    по хешу, и повторная загрузка того же file_unique_id (например, при
+    повторе задачи) берет его оттуда без обращения к Telegram. Файл
+    отдается закрепленным, чтобы вытеснение из хранилища не удалило его
+    до cleanup.
+    """
+
+    def __init__(self, storage: Optional[MediaStorage] = None):
+        """Инициализация сервиса."""
+        self.storage = storage if storage is not None else media_storage
+        self.downloads = 0
+        self.from_storage = 0
+        self.spooled_to_disk = 0
+        self.rejected = 0
+        self.bytes_downloaded = 0
+
+    def spool_file(self, media_type: str) -> Path:
+        """Новый путь для временного файла."""
+        return self.storage.temp_file(media_type)
+
+    def _check_size(self, size: Optional[int]):
+        """Проверка размера файла."""
+        if size is not None and size > settings.media_max_size:
+            self.rejected += 1
+            raise MediaTooLargeError(size)
+
+    async def download(self, bot: Bot, file_id: str, media_type: str) -> MediaFile:
+        """Загрузка файла по file_id."""
+        telegram_file = await bot.get_file(file_id)
+        self._check_size(telegram_file.file_size)
+
+        stored = await self.storage.lookup(telegram_file.file_unique_id, media_type)
+        if stored is not None:
+            content_hash, path, size = stored
+            self.from_storage += 1
+            return MediaFile.from_storage(
+                file_id, telegram_file.file_unique_id, media_type, content_hash, path, size
+            )
+
+        media = MediaFile(file_id, telegram_file.file_unique_id, media_type)
+        spool_file = self.spool_file(media_type)
+        url = bot.session.api.file_url(bot.token, telegram_file.file_path)
+        try:
+            async for chunk in bot.session.stream_content(
+                url,
+                timeout=settings.media_download_timeout,
+                chunk_size=settings.media_chunk_size
+            ):
+                await media.write(chunk, spool_file)
+                self._check_size(media.size)
+            await media.finish()
+            await self._store(media)
+        except BaseException:
+            await media.cleanup()
+            raise
+
+        self.downloads += 1
+        self.bytes_downloaded += media.size
+        if not media.in_memory:
+            self.spooled_to_disk += 1
+        return media
+
+    async def _store(self, media: MediaFile):
+        """Перенос загруженного файла в хранилище; небольшой остается и в памяти."""
+        media.path = await self.storage.store(
+            media.content_hash,
+            media.file_unique_id,
+            source=media.path,
+            data=None if media.path is not None else await media.read(),
+            pin_suffix=media.media_type
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика загрузок."""
+        return {
+            "downloads": self.downloads,
+            "from_storage": self.from_storage,
+            "spooled_to_disk": self.spooled_to_disk,
+            "rejected": self.rejected,
+            "bytes_downloaded": self.bytes_downloaded
+        }
+
+
+# Глобальный экземпляр сервиса
+media_download_service = MediaDownloadService()
@@ -0,0 +1,301 @@
+"""Хранилище загруженных медиа, адресованное содержимым."""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+
+from config import settings
+
+
+class MediaStorage:
+    """Файлы медиа на диске под именем SHA-256 содержимого.
+
+    Раскладка: objects/<первые два символа хеша>/<хеш>. Загрузка пишется
+    во временный файл в tmp/ на той же файловой системе и переносится в
+    objects атомарным rename, поэтому по хешу никогда не виден недописанный
+    файл. Общий размер ограничен max_bytes: сверх него удаляются давно не
+    использованные файлы. Периодическая очистка сверяет индекс с диском
+    (файлы могут добавлять и удалять другие процессы) и удаляет из tmp/
+    файлы, оставшиеся после падений. Корень можно разместить на tmpfs.
+
+    Читатель получает не путь в objects, а закрепление — жесткую ссылку в
+    pins/ на тот же файл. Вытеснение удаляет только имя в objects, поэтому
+    файл, который еще читает воркер (в том числе в другом процессе),
+    остается на диске, пока закрепление не снято через unpin. Закрепления
+    старше orphan_age считаются брошенными после падения и удаляются.
+    Каталоги создаются при первом использовании, а не при импорте.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, orphan_age: float):
+        """Инициализация хранилища."""
+        self.root = root
+        self.objects_path = root / "objects"
+        self.tmp_path = root / "tmp"
+        self.pins_path = root / "pins"
+        self._prepared = False
+        self.max_bytes = max_bytes
+        self.orphan_age = orphan_age
+        # Хеш -> размер, от давно не использованных к недавним
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._by_unique_id: Dict[str, str] = {}
+        self._unique_ids: Dict[str, List[str]] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_written = 0
+        self.bytes_served = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+        self.orphans_removed = 0
+        self.sweeps = 0
+        self.pinned = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _prepare(self):
+        """Создание каталогов хранилища."""
+        if not self._prepared:
+            for path in (self.objects_path, self.tmp_path, self.pins_path):
+                path.mkdir(parents=True, exist_ok=True)
+            self._prepared = True
+
+    def path_for(self, content_hash: str) -> Path:
+        """Путь к файлу с заданным хешем."""
+        return self.objects_path / content_hash[:2] / content_hash
+
+    def temp_file(self, suffix: str) -> Path:
+        """Новый путь для временного файла."""
+        self._prepare()
+        return self.tmp_path / f"{uuid.uuid4().hex}.{suffix}"
+
+    async def _link_pin(self, path: Path, suffix: str) -> Path:
+        """Жесткая ссылка на path в pins/; время создания — в имени."""
+        self._prepare()
+        pin = self.pins_path / f"{int(time.time())}-{uuid.uuid4().hex}.{suffix}"
+        await aiofiles.os.link(path, pin)
+        self.pinned += 1
+        return pin
+
+    async def unpin(self, pin: Path):
+        """Снятие закрепления, полученного из lookup или store."""
+        await self._remove(pin)
+
+    async def lookup(
+        self,
+        file_unique_id: Optional[str],
+        suffix: str = "bin"
+    ) -> Optional[Tuple[str, Path, int]]:
+        """Хеш, закрепление и размер сохраненного файла по file_unique_id.
+
+        Закрепление нужно снять через unpin, когда файл больше не нужен.
+        """
+        content_hash = self._by_unique_id.get(file_unique_id) if file_unique_id else None
+        if content_hash is None or content_hash not in self._index:
+            self.misses += 1
+            return None
+
+        try:
+            pin = await self._link_pin(self.path_for(content_hash), suffix)
+        except FileNotFoundError:
+            # Файл удалил другой процесс
+            self._forget(content_hash)
+            self.misses += 1
+            return None
+
+        self._index.move_to_end(content_hash)
+        size = self._index[content_hash]
+        self.hits += 1
+        self.bytes_served += size
+        return content_hash, pin, size
+
+    async def store(
+        self,
+        content_hash: str,
+        file_unique_id: Optional[str] = None,
+        source: Optional[Path] = None,
+        data: Optional[bytes] = None,
+        pin_suffix: Optional[str] = None
+    ) -> Path:
+        """Сохранение файла: source переносится, data записывается.
+
+        Возвращает путь в objects, а с pin_suffix — закрепление, которое
+        нужно снять через unpin.
+        """
+        path = self.path_for(content_hash)
+        if content_hash in self._index and not await aiofiles.os.path.exists(path):
+            # Файл удалил другой процесс: сохраняем заново
+            self._forget(content_hash)
+
+        pin = None
+        if content_hash in self._index:
+            self._index.move_to_end(content_hash)
+            if pin_suffix is not None:
+                pin = await self._link_pin(path, pin_suffix)
+            if source is not None:
+                await self._remove(source)
+        else:
+            await aiofiles.os.makedirs(path.parent, exist_ok=True)
+            if source is None:
+                source = self.temp_file("part")
+                async with aiofiles.open(source, "wb") as f:
+                    await f.write(data)
+            # Закрепление до переноса: файл не успеет исчезнуть между шагами
+            if pin_suffix is not None:
+                pin = await self._link_pin(source, pin_suffix)
+            await aiofiles.os.replace(source, path)
+
+            size = (await aiofiles.os.stat(path)).st_size
+            self._index[content_hash] = size
+            self.size += size
+            self.bytes_written += size
+            await self._evict()
+
+        if file_unique_id and self._by_unique_id.get(file_unique_id) != content_hash:
+            self._by_unique_id[file_unique_id] = content_hash
+            self._unique_ids.setdefault(content_hash, []).append(file_unique_id)
+        return pin if pin is not None else path
+
+    def _forget(self, content_hash: str):
+        """Удаление записи из индекса."""
+        self.size -= self._index.pop(content_hash, 0)
+        for file_unique_id in self._unique_ids.pop(content_hash, []):
+            if self._by_unique_id.get(file_unique_id) == content_hash:
+                del self._by_unique_id[file_unique_id]
+
+    async def _remove(self, path: Path):
+        """Удаление файла, которого может уже не быть."""
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ошибка удаления файла хранилища: {e}")
+
+    async def _evict(self):
+        """Удаление давно не использованных файлов сверх лимита.
+
+        Последний добавленный файл не удаляется, даже если он один больше лимита.
+        Закрепленные файлы удаляются только из objects: данные остаются
+        доступны по закреплению до unpin.
+        """
+        while self.size > self.max_bytes and len(self._index) > 1:
+            content_hash, size = next(iter(self._index.items()))
+            self._forget(content_hash)
+            await self._remove(self.path_for(content_hash))
+            self.evictions += 1
+            self.bytes_evicted += size
+
+    def _scan(self) -> Tuple[Dict[str, Tuple[int, float]], List[Path]]:
+        """Файлы objects (хеш -> размер, время доступа) и устаревшие файлы tmp и pins."""
+        objects = {}
+        for prefix in os.scandir(self.objects_path):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                objects[entry.name] = (stat.st_size, max(stat.st_atime, stat.st_mtime))
+
+        deadline = time.time() - self.orphan_age
+        orphans = []
+        for entry in os.scandir(self.tmp_path):
+            try:
+                if entry.stat().st_mtime < deadline:
+                    orphans.append(Path(entry.path))
+            except FileNotFoundError:
+                continue
+
+        # У жесткой ссылки mtime общий с файлом, поэтому возраст берется из имени
+        for entry in os.scandir(self.pins_path):
+            created, _, _ = entry.name.partition("-")
+            if not created.isdigit() or int(created) < deadline:
+                orphans.append(Path(entry.path))
+        return objects, orphans
+
+    async def sweep(self):
+        """Сверка индекса с диском, удаление сирот из tmp и pins и лишнего по лимиту."""
+        self._prepare()
+        objects, orphans = await asyncio.to_thread(self._scan)
+
+        for content_hash in [known for known in self._index if known not in objects]:
+            self._forget(content_hash)
+
+        # Неизвестные файлы считаются самыми старыми, в порядке времени доступа
+        unknown = sorted(
+            (content_hash for content_hash in objects if content_hash not in self._index),
+            key=lambda content_hash: objects[content_hash][1],
+            reverse=True
+        )
+        for content_hash in unknown:
+            size = objects[content_hash][0]
+            self._index[content_hash] = size
+            self._index.move_to_end(content_hash, last=False)
+            self.size += size
+
+        for path in orphans:
+            await self._remove(path)
+            self.orphans_removed += 1
+
+        await self._evict()
+        self.sweeps += 1
+
+    async def _run_periodic(self):
+        """Периодическая очистка."""
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Ошибка очистки хранилища медиа: {e}")
+            await asyncio.sleep(settings.media_storage_sweep_interval)
+
+    def start(self):
+        """Создание каталогов и запуск периодической очистки; первая сразу восстанавливает индекс."""
+        self._prepare()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_periodic())
+
+    async def stop(self):
+        """Остановка периодической очистки."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика хранилища."""
+        lookups = self.hits + self.misses
+        return {
+            "root": str(self.root),
+            "files": len(self._index),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_written": self.bytes_written,
+            "bytes_served": self.bytes_served,
+            "evictions": self.evictions,
+            "bytes_evicted": self.bytes_evicted,
+            "orphans_removed": self.orphans_removed,
+            "sweeps": self.sweeps,
+            "pinned": self.pinned
+        }
+
+
+# Глобальное хранилище медиа
+media_storage = MediaStorage(
+    root=Path(settings.media_storage_path or Path(settings.storage_path) / "media"),
+    max_bytes=settings.media_storage_max_bytes,
+    orphan_age=settings.media_storage_orphan_age
+)
@@ -0,0 +1,234 @@
+"""Выбор модели по классу запроса с учетом задержек и ошибок."""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import openai
+
+from config import settings
+
+
+T = TypeVar("T")
+
+# Классы запросов к моделям
+SHORT_QUESTION = "short_question"
+LONG_QUESTION = "long_question"
+VISION = "vision"
+TRANSCRIPTION = "transcription"
+TRANSCRIPT_ANALYSIS = "transcript_analysis"
+
+
+def is_model_failure(error: BaseException) -> bool:
+    """Сбой на стороне модели: таймаут, обрыв соединения, 429 или 5xx.
+
+    Остальные ошибки (некорректный запрос, авторизация) повторятся на любой
+    модели, поэтому переключаться на следующую бесполезно.
+    """
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class ModelHealth:
+    """Скользящая статистика вызовов модели за последние horizon секунд."""
+
+    def __init__(self, horizon: float, window: int = 500):
+        """Инициализация статистики."""
+        self.horizon = horizon
+        self.calls = 0
+        self.errors = 0
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=window)
+
+    def observe(self, duration: float, error: bool, now: Optional[float] = None):
+        """Регистрация вызова."""
+        if now is None:
+            now = time.monotonic()
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self._samples.append((now, duration, error))
+
+    def _recent(self, now: Optional[float] = None) -> List[Tuple[float, float, bool]]:
+        """Измерения внутри окна по времени."""
+        if now is None:
+            now = time.monotonic()
+        while self._samples and now - self._samples[0][0] > self.horizon:
+            self._samples.popleft()
+        return list(self._samples)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, float]:
+        """p50/p95 успешных вызовов и доля ошибок в окне."""
+        samples = self._recent(now)
+        durations = sorted(duration for _, duration, error in samples if not error)
+        errors = sum(1 for _, _, error in samples if error)
+
+        def percentile(q: float) -> float:
+            if not durations:
+                return 0.0
+            return durations[min(len(durations) - 1, int(round(q / 100 * (len(durations) - 1))))]
+
+        return {
+            "samples": len(samples),
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "error_rate": errors / len(samples) if samples else 0.0
+        }
+
+
+class ModelRouter:
+    """Маршрутизация запросов по моделям с автоматическим переключением.
+
+    Для каждого класса запроса задан упорядоченный список моделей и цель
+    по p95 задержки. Модель считается деградировавшей, если в окне хватает
+    измерений и ее p95 выше цели или доля ошибок выше допустимой. Сначала
+    пробуются здоровые модели в порядке настройки, затем деградировавшие
+    по возрастанию доли ошибок, а при равной доле — p95 (у модели, которая
+    только падает, p95 успешных вызовов нулевой). Старые измерения выходят из окна, поэтому модель
+    без трафика снова становится кандидатом и проверяется живым запросом.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, List[str]],
+        targets: Dict[str, float],
+        horizon: float = 300.0,
+        min_samples: int = 10,
+        max_error_rate: float = 0.2
+    ):
+        """Инициализация маршрутизатора."""
+        self.routes = routes
+        self.targets = targets
+        self.horizon = horizon
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.health: Dict[str, ModelHealth] = {}
+        self.failovers = 0
+
+    def _get_health(self, model: str) -> ModelHealth:
+        """Статистика модели."""
+        health = self.health.get(model)
+        if health is None:
+            health = self.health[model] = ModelHealth(self.horizon)
+        return health
+
+    def is_degraded(self, model: str, request_class: str) -> bool:
+        """Выходит ли модель за цели класса запроса."""
+        snapshot = self._get_health(model).snapshot()
+        if snapshot["samples"] < self.min_samples:
+            return False
+        target = self.targets.get(request_class)
+        return (
+            snapshot["error_rate"] > self.max_error_rate
+            or (target is not None and snapshot["p95"] > target)
+        )
+
+    def candidates(self, request_class: str) -> List[str]:
+        """Модели класса запроса в порядке попыток."""
+        models = self.routes[request_class]
+        healthy = [model for model in models if not self.is_degraded(model, request_class)]
+        degraded = sorted(
+            (model for model in models if model not in healthy),
+            key=lambda model: (
+                (snapshot := self._get_health(model).snapshot())["error_rate"],
+                snapshot["p95"]
+            )
+        )
+        return healthy + degraded
+
+    def record(self, model: str, duration: float, error: bool = False):
+        """Учет вызова модели, сделанного вне call()."""
+        self._get_health(model).observe(duration, error)
+
+    async def call(
+        self,
+        request_class: str,
+        func: Callable[[str], Awaitable[T]]
+    ) -> Tuple[T, str]:
+        """Вызов func(model) с переключением на следующую модель при сбое.
+
+        Для всех моделей, кроме последней, попытка ограничена таймаутом
+        класса, чтобы медленная модель не держала пользователя. На другую
+        модель переключаются только при сбоях модели (is_model_failure),
+        остальные ошибки пробрасываются сразу.
+        Возвращает результат и модель, которая его дала.
+        """
+        models = self.candidates(request_class)
+        attempt_timeout = self.targets.get(request_class)
+        last_error: Optional[BaseException] = None
+
+        for position, model in enumerate(models):
+            is_last = position == len(models) - 1
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    func(model),
+                    None if is_last else attempt_timeout
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not is_model_failure(e):
+                    raise
+                self.record(model, time.monotonic() - started, error=True)
+                last_error = e
+                if not is_last:
+                    self.failovers += 1
+                    print(f"Модель {model} недоступна для {request_class}, переключаемся: {e!r}")
+                continue
+
+            self.record(model, time.monotonic() - started)
+            return result, model
+
+        raise last_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика моделей и переключений."""
+        return {
+            "failovers": self.failovers,
+            "models": {
+                model: {
+                    "calls": health.calls,
+                    "errors": health.errors,
+                    **{
+                        key: round(value * 1000, 2) if key in ("p50", "p95") else round(value, 4)
+                        for key, value in health.snapshot().items()
+                    }
+                }
+                for model, health in self.health.items()
+            },
+            "routes": {
+                request_class: self.candidates(request_class)
+                for request_class in self.routes
+            }
+        }
+
+
+def _parse_models(value: str) -> List[str]:
+    """Список моделей из строки через запятую."""
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+
+# Глобальный маршрутизатор моделей
+model_router = ModelRouter(
+    routes={
+        SHORT_QUESTION: _parse_models(settings.llm_route_short_question),
+        LONG_QUESTION: _parse_models(settings.llm_route_long_question),
+        VISION: _parse_models(settings.llm_route_vision),
+        TRANSCRIPTION: _parse_models(settings.llm_route_transcription),
+        TRANSCRIPT_ANALYSIS: _parse_models(settings.llm_route_transcript_analysis)
+    },
+    targets={
+        SHORT_QUESTION: settings.llm_target_short_question,
+        LONG_QUESTION: settings.llm_target_long_question,
+        VISION: settings.llm_target_vision,
+        TRANSCRIPTION: settings.llm_target_transcription,
+        TRANSCRIPT_ANALYSIS: settings.llm_target_transcript_analysis
+    },
+    horizon=settings.llm_router_horizon,
+    min_samples=settings.llm_router_min_samples,
+    max_error_rate=settings.llm_router_max_error_rate
+)
@@ -0,0 +1,120 @@
+"""Общий клиент OpenAI для всех сервисов бота."""
+
+import random
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from config import settings
+from bot.utils.rate_limit import RateLimitGate
+
+
+class RateLimitedOpenAI(AsyncOpenAI):
+    """Клиент OpenAI с повторами по заголовкам ограничений.
+
+    Задержка перед повтором берется из retry-after / x-ratelimit-*,
+    а если API ее не указал — экспоненциальная с полным джиттером.
+    """
+
+    def __init__(self, *args, gate: RateLimitGate, **kwargs):
+        """Инициализация клиента."""
+        super().__init__(*args, **kwargs)
+        self.gate = gate
+        self.retries = 0
+
+    def _calculate_retry_timeout(
+        self,
+        remaining_retries: int,
+        options: Any,
+        response_headers: Optional[httpx.Headers] = None
+    ) -> float:
+        """Задержка перед повторным запросом."""
+        self.retries += 1
+        # Заголовки ответа уже учтены шлюзом в хуке ответа httpx
+        delay = self.gate.remaining()
+        if delay <= 0:
+            attempt = options.get_max_retries(self.max_retries) - remaining_retries
+            delay = random.uniform(
+                0,
+                min(
+                    settings.openai_max_retry_delay,
+                    settings.openai_base_retry_delay * 2 ** attempt
+                )
+            )
+        return delay
+
+
+class OpenAIClientFactory:
+    """Фабрика единственного на процесс клиента OpenAI.
+
+    Все сервисы делят один пул соединений и один шлюз ограничений:
+    после 429 паузу выдерживают все запросы процесса, а не только тот,
+    что получил отказ.
+    """
+
+    def __init__(self):
+        """Инициализация фабрики."""
+        self._client: Optional[RateLimitedOpenAI] = None
+        self.gate = RateLimitGate(
+            max_delay=settings.openai_max_retry_delay,
+            release_jitter=settings.openai_release_jitter
+        )
+        self.requests = 0
+
+    async def _before_request(self, request: httpx.Request):
+        """Ожидание окончания паузы перед каждым запросом и повтором."""
+        await self.gate.wait()
+        self.requests += 1
+
+    async def _after_response(self, response: httpx.Response):
+        """Учет заголовков ограничений из ответа."""
+        self.gate.observe(response.status_code, response.headers)
+
+    def get_client(self) -> RateLimitedOpenAI:
+        """Общий клиент OpenAI."""
+        if self._client is None or self._client.is_closed():
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    settings.openai_timeout,
+                    connect=settings.openai_connect_timeout
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.openai_max_connections,
+                    max_keepalive_connections=settings.openai_max_keepalive
+                ),
+                event_hooks={
+                    "request": [self._before_request],
+                    "response": [self._after_response]
+                }
+            )
+            self._client = RateLimitedOpenAI(
+                api_key=settings.openai_api_key,
+                max_retries=settings.openai_max_retries,
+                timeout=httpx.Timeout(
+                    settings.openai_timeout,
+                    connect=settings.openai_connect_timeout
+                ),
+                http_client=http_client,
+                gate=self.gate
+            )
+        return self._client
+
+    async def close(self):
+        """Закрытие клиента и пула соединений."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика запросов к OpenAI."""
+        return {
+            "requests": self.requests,
+            "retries": self._client.retries if self._client is not None else 0,
+            "max_connections": settings.openai_max_connections,
+            **self.gate.get_stats()
+        }
+
+
+# Глобальная фабрика клиента
+openai_client_factory = OpenAIClientFactory()
@@ -0,0 +1,152 @@
+"""Сервис доставки результатов тестов на сайт через outbox."""
+
+import asyncio
+import random
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import settings
+from bot.database.database import db
+from bot.services.site_api_service import site_api_service
+
+
+class ResultOutboxService:
+    """Фоновая отправка результатов тестов на сайт.
+
+    Результаты попадают в таблицу result_outbox вместе с test_results.
+    Сервис забирает ожидающие записи пачками, отправляет их одним запросом
+    и повторяет неудачные отправки с экспоненциальной задержкой, поэтому
+    пользователь не ждет сайт, а результаты переживают его недоступность.
+    Доставленным считается только результат, который сайт подтвердил в
+    ответе по его idempotency_key; отклоненный сайтом результат больше
+    не отправляется, остальные повторяются.
+    """
+
+    def __init__(self):
+        """Инициализация сервиса."""
+        self.sent = 0
+        self.rejected = 0
+        self.retried = 0
+        self.batches = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """Сигнал о появлении новых результатов."""
+        self._wakeup.set()
+
+    def _backoff(self, attempts: int) -> float:
+        """Задержка перед следующей попыткой с джиттером."""
+        delay = min(
+            settings.result_outbox_max_backoff,
+            settings.result_outbox_base_backoff * 2 ** (attempts - 1)
+        )
+        return delay * random.uniform(0.5, 1.0)
+
+    async def ship_batch(self) -> int:
+        """Отправка одной пачки результатов."""
+        batch = await db.claim_outbox_batch(
+            limit=settings.result_outbox_batch_size,
+            lease_seconds=settings.result_outbox_lease
+        )
+        if not batch:
+            return 0
+
+        outbox_ids = {item["idempotency_key"]: item.pop("outbox_id") for item in batch}
+        attempts = max(item.pop("attempts") for item in batch)
+
+        self.batches += 1
+        response = await site_api_service.submit_test_results_bulk(batch)
+        sent, rejected, retry, error = self._split_response(response, list(outbox_ids))
+
+        if sent:
+            await db.mark_outbox_sent([outbox_ids[key] for key in sent])
+            self.sent += len(sent)
+        if rejected:
+            await db.mark_outbox_failed(
+                {outbox_ids[key]: reason for key, reason in rejected.items()}
+            )
+            self.rejected += len(rejected)
+        if retry:
+            await db.reschedule_outbox(
+                [outbox_ids[key] for key in retry],
+                delay_seconds=self._backoff(attempts),
+                error=error,
+                max_attempts=settings.result_outbox_max_attempts
+            )
+            self.retried += len(retry)
+
+        return len(outbox_ids)
+
+    @staticmethod
+    def _split_response(
+        response: Optional[Dict[str, Any]],
+        keys: List[str]
+    ) -> Tuple[List[str], Dict[str, str], List[str], str]:
+        """Разбор ответа сайта: доставленные, отклоненные (с причиной) и повторяемые ключи."""
+        results = response.get("results") if isinstance(response, dict) else None
+        if not isinstance(results, list):
+            error = "site api request failed" if response is None else "unexpected site api response"
+            return [], {}, keys, error
+
+        statuses = {
+            result.get("idempotency_key"): result
+            for result in results
+            if isinstance(result, dict)
+        }
+        sent, rejected, retry = [], {}, []
+        for key in keys:
+            result = statuses.get(key, {})
+            status = result.get("status")
+            if status in ("accepted", "duplicate"):
+                sent.append(key)
+            elif status == "rejected":
+                rejected[key] = str(result.get("error") or "rejected by site")
+            else:
+                retry.append(key)
+        return sent, rejected, retry, "site api did not confirm result"
+
+    async def _run_periodic(self):
+        """Цикл отправки: до опустошения очереди, затем ожидание."""
+        while True:
+            try:
+                while await self.ship_batch() >= settings.result_outbox_batch_size:
+                    pass
+            except Exception as e:
+                print(f"Ошибка отправки результатов на сайт: {e}")
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    timeout=settings.result_outbox_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        """Запуск фоновой отправки."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_periodic())
+
+    async def stop(self):
+        """Остановка фоновой отправки."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика отправки."""
+        return {
+            "batches": self.batches,
+            "sent": self.sent,
+            "rejected": self.rejected,
+            "retried": self.retried
+        }
+
+
+# Глобальный экземпляр сервиса
+result_outbox_service = ResultOutboxService()
@@ -1,8 +1,17 @@
 """Сервис для работы с API сайта."""
 
+import asyncio
+import re
+import time
 import httpx
 from typing import Dict, Any, Optional, List
+from datetime import datetime, timezone
+from urllib.parse import urlencode
 from config import settings
+from bot.utils.metrics import LatencyStats
+from bot.utils.response_cache import ResponseCache
+from bot.utils.single_flight import SingleFlight
+from bot.utils.circuit_breaker import CircuitBreaker
 
 
 class SiteAPIService:
@@ -16,6 +25,164 @@ class SiteAPIService:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0
+        self.endpoint_stats: Dict[str, LatencyStats] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        
+        # Кэш редко меняющихся ответов
+        self.cache = ResponseCache(
+            maxsize=settings.site_api_cache_size,
+            stale_ttl=settings.site_api_stale_ttl
+        )
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        
+        # Одинаковые одновременные GET-запросы выполняются один раз
+        self.single_flight = SingleFlight("site_api")
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Долгоживущий HTTP-клиент с пулом keep-alive соединений."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(
+                    settings.site_api_read_timeout,
+                    connect=settings.site_api_connect_timeout
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.site_api_max_connections,
+                    max_keepalive_connections=settings.site_api_max_keepalive
+                ),
+                http2=self._http2_available()
+            )
+        return self._client
+    
+    @staticmethod
+    def _http2_available() -> bool:
+        """HTTP/2 включается настройкой и требует пакет h2."""
+        if not settings.site_api_http2:
+            return False
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            print("HTTP/2 для API сайта недоступен: не установлен пакет h2")
+            return False
+    
+    async def close(self):
+        """Закрытие HTTP-клиента."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    @staticmethod
+    def _endpoint_name(endpoint: str) -> str:
+        """Шаблон endpoint без идентификаторов и параметров запроса."""
+        return re.sub(r"/\d+", "/{id}", endpoint.split("?", 1)[0])
+    
+    def _get_stats(self, name: str) -> LatencyStats:
+        """Статистика задержек endpoint."""
+        stats = self.endpoint_stats.get(name)
+        if stats is None:
+            stats = self.endpoint_stats[name] = LatencyStats()
+        return stats
+    
+    def _get_breaker(self, name: str) -> CircuitBreaker:
+        """Circuit breaker endpoint."""
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(
+                failure_threshold=settings.site_api_breaker_threshold,
+                recovery_timeout=settings.site_api_breaker_recovery
+            )
+        return breaker
+    
+    def _adaptive_timeout(self, name: str) -> httpx.Timeout:
+        """Таймаут чтения по наблюдаемому p95 задержки endpoint."""
+        read_timeout = settings.site_api_read_timeout
+        stats = self.endpoint_stats.get(name)
+        if stats is not None and stats.count >= settings.site_api_timeout_min_samples:
+            read_timeout = min(
+                read_timeout,
+                max(
+                    settings.site_api_min_timeout,
+                    stats.percentile(95) * settings.site_api_timeout_factor
+                )
+            )
+        return httpx.Timeout(read_timeout, connect=settings.site_api_connect_timeout)
+    
+    async def _send(
+        self, 
+        method: str, 
+        endpoint: str, 
+        data: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Optional[httpx.Response]:
+        """Отправка HTTP-запроса к API с учетом задержки."""
+        if method.upper() == "GET":
+            key = (endpoint, tuple(sorted((headers or {}).items())))
+            return await self.single_flight.do(
+                key,
+                lambda: self._send_once(method, endpoint, data, headers)
+            )
+        return await self._send_once(method, endpoint, data, headers)
+    
+    async def _send_once(
+        self, 
+        method: str, 
+        endpoint: str, 
+        data: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Optional[httpx.Response]:
+        """Одиночный HTTP-запрос к API."""
+        method = method.upper()
+        if method not in ("GET", "POST"):
+            print(f"Неподдерживаемый метод API запроса: {method}")
+            return None
+        
+        name = self._endpoint_name(endpoint)
+        breaker = self._get_breaker(name)
+        
+        # Пока сайт недоступен, не ждем таймаута, а сразу отказываем
+        if not breaker.allow():
+            return None
+        
+        started = time.monotonic()
+        error = True
+        # True — успех, False — ошибка, None — запрос прерван (отмена, остановка)
+        outcome: Optional[bool] = None
+        self.in_flight += 1
+        try:
+            url = f"{self.base_url}{endpoint}"
+            timeout = self._adaptive_timeout(name)
+            
+            if method == "GET":
+                response = await self.client.get(url, headers=headers, timeout=timeout)
+            else:
+                response = await self.client.post(
+                    url, json=data, headers=headers, timeout=timeout
+                )
+            
+            error = response.status_code >= 400
+            outcome = response.status_code < 500
+            return response
+            
+        except Exception as e:
+            outcome = False
+            print(f"Ошибка API запроса: {e}")
+            return None
+        finally:
+            # Исход учитывается всегда, иначе прерванная проба оставит
+            # выключатель полуоткрытым без свободных мест
+            if outcome is None:
+                breaker.release()
+            elif outcome:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            self.in_flight -= 1
+            self._get_stats(name).observe(time.monotonic() - started, error)
     
     async def _make_request(
         self, 
@@ -24,34 +191,84 @@ class SiteAPIService:
         data: Optional[Dict[str, Any]] = None
     ) -> Optional[Dict[str, Any]]:
         """Выполнение HTTP-запроса к API."""
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                url = f"{self.base_url}{endpoint}"
-                
-                if method.upper() == "GET":
-                    response = await client.get(url, headers=self.headers)
-                elif method.upper() == "POST":
-                    response = await client.post(url, headers=self.headers, json=data)
-                else:
-                    return None
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"API error: {response.status_code} - {response.text}")
-                    return None
-                    
-        except Exception as e:
-            print(f"Ошибка API запроса: {e}")
+        response = await self._send(method, endpoint, data)
+        if response is None:
+            return None
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print(f"API error: {response.status_code} - {response.text}")
             return None
     
+    async def _cached_get(self, endpoint: str, ttl: float) -> Optional[Any]:
+        """GET-запрос через кэш со stale-while-revalidate."""
+        entry = self.cache.get(endpoint)
+        
+        if entry is not None and entry.is_fresh():
+            self.cache.hits += 1
+            return entry.value
+        
+        if entry is not None:
+            # Отдаем устаревшие данные сразу, обновляем в фоне
+            self.cache.stale_hits += 1
+            self._schedule_refresh(endpoint, ttl)
+            return entry.value
+        
+        self.cache.misses += 1
+        return await self._refresh(endpoint, ttl)
+    
+    def _schedule_refresh(self, endpoint: str, ttl: float):
+        """Запуск фонового обновления записи (не более одного на ключ)."""
+        if endpoint in self._refresh_tasks:
+            return
+        
+        task = asyncio.create_task(self._refresh(endpoint, ttl))
+        self._refresh_tasks[endpoint] = task
+        task.add_done_callback(lambda _: self._refresh_tasks.pop(endpoint, None))
+    
+    async def _refresh(self, endpoint: str, ttl: float) -> Optional[Any]:
+        """Загрузка ответа с условными заголовками ETag/Last-Modified."""
+        entry = self.cache.get(endpoint)
+        stale_value = entry.value if entry is not None else None
+        headers = entry.conditional_headers() if entry is not None else None
+        
+        response = await self._send("GET", endpoint, headers=headers)
+        if response is None:
+            return stale_value
+        
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(endpoint, ttl)
+            return stale_value
+        
+        if response.status_code == 200:
+            value = response.json()
+            self.cache.set(
+                endpoint,
+                value,
+                ttl,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified")
+            )
+            return value
+        
+        print(f"API error: {response.status_code} - {response.text}")
+        return stale_value
+    
+    def invalidate_cache(self, prefix: str = "") -> int:
+        """Сброс закэшированных ответов по префиксу endpoint."""
+        return self.cache.invalidate(prefix)
+    
     async def get_tests_list(self) -> Optional[List[Dict[str, Any]]]:
         """Получение списка тестов с сайта."""
-        return await self._make_request("GET", "/api/tests")
+        return await self._cached_get("/api/tests", settings.site_api_catalog_ttl)
     
     async def get_test_questions(self, test_id: int) -> Optional[List[Dict[str, Any]]]:
         """Получение вопросов теста по ID."""
-        return await self._make_request("GET", f"/api/tests/{test_id}/questions")
+        return await self._cached_get(
+            f"/api/tests/{test_id}/questions",
+            settings.site_api_catalog_ttl
+        )
     
     async def submit_test_result(
         self, 
@@ -64,10 +281,27 @@ class SiteAPIService:
             "test_id": test_id,
             "telegram_user_id": user_id,
             "answers": answers,
-            "timestamp": "2024-01-01T00:00:00Z"  # В реальном проекте текущее время
+            "timestamp": datetime.now(timezone.utc).isoformat()
         }
         return await self._make_request("POST", f"/api/tests/{test_id}/results", data)
     
+    async def submit_test_results_bulk(
+        self, 
+        results: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """Пакетная отправка результатов тестов на сайт.
+        
+        У каждого результата есть idempotency_key, по которому сайт
+        отбрасывает повторы при ретраях. Ответ — итог по каждому результату:
+        {"results": [{"idempotency_key": "...", "status": "accepted" |
+        "duplicate" | "rejected" | "error", "error": "..."}]}.
+        """
+        return await self._make_request(
+            "POST",
+            "/api/tests/results/bulk",
+            {"results": results}
+        )
+    
     async def check_subscription_status(self, telegram_user_id: int) -> Optional[Dict[str, Any]]:
         """Проверка статуса подписки по Telegram user_id."""
         return await self._make_request("GET", f"/api/users/{telegram_user_id}/subscription")
@@ -76,19 +310,63 @@ class SiteAPIService:
         """Проверка баланса пакетов по Telegram user_id."""
         return await self._make_request("GET", f"/api/users/{telegram_user_id}/packages")
     
+    async def get_entitlement_changes(
+        self, 
+        updated_since: Optional[str] = None, 
+        cursor: Optional[str] = None, 
+        limit: int = 500
+    ) -> Optional[Dict[str, Any]]:
+        """Получение страницы изменений подписок и пакетов.
+        
+        Ответ: {"items": [...], "next_cursor": "..." | null}.
+        """
+        params = {"limit": limit}
+        if updated_since:
+            params["updated_since"] = updated_since
+        if cursor:
+            params["cursor"] = cursor
+        return await self._make_request("GET", f"/api/entitlements?{urlencode(params)}")
+    
     async def get_user_profile(self, telegram_user_id: int) -> Optional[Dict[str, Any]]:
         """Получение профиля пользователя с сайта."""
-        return await self._make_request("GET", f"/api/users/{telegram_user_id}/profile")
+        return await self._cached_get(
+            f"/api/users/{telegram_user_id}/profile",
+            settings.site_api_profile_ttl
+        )
     
     async def is_api_available(self) -> bool:
         """Проверка доступности API."""
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.base_url}/api/health")
-                return response.status_code == 200
+            response = await self.client.get(f"{self.base_url}/api/health", timeout=5.0)
+            return response.status_code == 200
         except Exception:
             return False
     
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Статистика пула соединений и задержек по endpoint."""
+        connections = []
+        if self._client is not None:
+            # У httpx нет публичного API для пула, читаем его мягко
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "max_connections": settings.site_api_max_connections,
+            "connections": len(connections),
+            "idle_connections": idle,
+            "in_flight": self.in_flight,
+            "cache": self.cache.get_stats(),
+            "single_flight": self.single_flight.get_stats(),
+            "endpoints": {
+                name: {
+                    **stats.get_stats(),
+                    "breaker": self._get_breaker(name).get_stats()
+                }
+                for name, stats in self.endpoint_stats.items()
+            }
+        }
+    
     def get_webview_url(self, section: str, user_id: Optional[int] = None) -> str:
         """Формирование URL для WebView."""
         base_url = self.base_url.replace("/api", "")
@@ -7,6 +7,7 @@ from pathlib import Path
 
 from bot.database.database import db
 from bot.data.messages import TEST_MESSAGES
+from bot.services.result_outbox_service import result_outbox_service
 
 
 class TestService:
@@ -102,6 +103,8 @@ class TestService:
                     "result": result
                 }
             )
+            # Результат уже в outbox, отправка на сайт пойдет в фоне
+            result_outbox_service.notify()
             return True
         except Exception as e:
             print(f"Ошибка сохранения результата теста: {e}")
@@ -0,0 +1,76 @@
+"""Пул процессов для тяжелой обработки медиа."""
+
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import settings
+from bot.utils.metrics import LatencyStats
+
+
+class WorkerPool:
+    """Общий пул процессов для CPU-задач.
+
+    Декодирование и пересжатие медиа выполняются вне процесса бота,
+    поэтому цикл событий не блокируется и не конкурирует за GIL.
+    Процессы запускаются лениво при первой задаче через forkserver:
+    fork самого бота с потоками aiofiles и asyncio небезопасен.
+    Функции для пула (bot.utils.image_processing, video_processing,
+    audio_processing) зависят только от аргументов и не импортируют
+    настройки и сервисы бота: процесс пула не должен их инициализировать.
+    """
+
+    def __init__(self, max_workers: int):
+        """Инициализация пула."""
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0
+        self.task_stats: Dict[str, LatencyStats] = {}
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Пул процессов."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполнение func(*args) в процессе пула."""
+        loop = asyncio.get_running_loop()
+        stats = self.task_stats.get(func.__name__)
+        if stats is None:
+            stats = self.task_stats[func.__name__] = LatencyStats()
+
+        started = time.monotonic()
+        error = True
+        self.in_flight += 1
+        try:
+            result = await loop.run_in_executor(self.executor, func, *args)
+            error = False
+            return result
+        finally:
+            self.in_flight -= 1
+            stats.observe(time.monotonic() - started, error)
+
+    def shutdown(self):
+        """Остановка процессов пула."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика пула."""
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "tasks": {name: stats.get_stats() for name, stats in self.task_stats.items()}
+        }
+
+
+# Глобальный пул обработки медиа
+media_worker_pool = WorkerPool(max_workers=settings.media_worker_processes)
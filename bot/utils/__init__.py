@@ -0,0 +1 @@
+"""Вспомогательные утилиты бота."""
@@ -0,0 +1,200 @@
+"""Контроль допуска к ограниченному ресурсу."""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from bot.utils.metrics import LatencyStats
+
+
+PositionCallback = Callable[[int], Awaitable[Any]]
+
+
+class UserBusyError(Exception):
+    """У пользователя уже есть запрос в работе или в очереди."""
+
+
+class _Waiter:
+    """Запрос в очереди на допуск."""
+
+    __slots__ = ("rank", "seq", "user_id", "tier", "future", "on_position",
+                 "position", "notified_at")
+
+    def __init__(self, rank: float, seq: int, user_id: int, tier: str,
+                 on_position: Optional[PositionCallback]):
+        self.rank = rank
+        self.seq = seq
+        self.user_id = user_id
+        self.tier = tier
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = 0
+        self.notified_at = 0.0
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class AdmissionController:
+    """Допуск к ресурсу с глобальным лимитом и одним запросом на пользователя.
+
+    Очередь упорядочена по времени постановки, сдвинутому на фору тарифа:
+    запрос подписчика с форой 30 секунд встает перед бесплатными запросами,
+    пришедшими за последние 30 секунд, но не обгоняет тех, кто ждет дольше.
+    Так платные тарифы идут первыми, а бесплатные не голодают.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        tier_priority: Optional[Dict[str, float]] = None,
+        queue_timeout: Optional[float] = None,
+        notify_interval: float = 3.0
+    ):
+        """Инициализация контроллера."""
+        self.max_concurrency = max_concurrency
+        self.tier_priority = tier_priority or {}
+        self.queue_timeout = queue_timeout
+        self.notify_interval = notify_interval
+        self.in_flight = 0
+        self._queue: List[_Waiter] = []
+        self._users: Set[int] = set()
+        self._seq = itertools.count()
+        # Ссылки на задачи уведомлений, чтобы их не собрал сборщик мусора
+        self._notify_tasks: Set[asyncio.Task] = set()
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.timed_out = 0
+        self.wait_stats: Dict[str, LatencyStats] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        """Число запросов в очереди."""
+        return len(self._queue)
+
+    def holds(self, user_id: int) -> bool:
+        """Есть ли у пользователя запрос в работе или в очереди."""
+        return user_id in self._users
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: int,
+        tier: str = "free",
+        on_position: Optional[PositionCallback] = None
+    ) -> AsyncIterator[None]:
+        """Занятие слота на время выполнения запроса.
+
+        on_position вызывается с номером в очереди, если запросу пришлось ждать.
+        """
+        if user_id in self._users:
+            self.rejected_busy += 1
+            raise UserBusyError(user_id)
+
+        self._users.add(user_id)
+        try:
+            await self._acquire(user_id, tier, on_position)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            self._users.discard(user_id)
+
+    async def _acquire(self, user_id: int, tier: str,
+                       on_position: Optional[PositionCallback]):
+        """Ожидание свободного слота."""
+        started = time.monotonic()
+        if self.in_flight < self.max_concurrency and not self._queue:
+            self.in_flight += 1
+            self._record_admit(tier, 0.0)
+            return
+
+        waiter = _Waiter(
+            rank=started - self.tier_priority.get(tier, 0.0),
+            seq=next(self._seq),
+            user_id=user_id,
+            tier=tier,
+            on_position=on_position
+        )
+        heapq.heappush(self._queue, waiter)
+        self._notify_positions(force=waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже выдан, но ждать его перестали — возвращаем
+                self._release()
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+            raise
+        self._record_admit(tier, time.monotonic() - started)
+
+    def _record_admit(self, tier: str, waited: float):
+        """Учет допуска."""
+        self.admitted += 1
+        stats = self.wait_stats.get(tier)
+        if stats is None:
+            stats = self.wait_stats[tier] = LatencyStats()
+        stats.observe(waited)
+
+    def _remove(self, waiter: _Waiter):
+        """Удаление запроса из очереди."""
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            return
+        heapq.heapify(self._queue)
+        self._notify_positions()
+
+    def _release(self):
+        """Освобождение слота и передача его следующему в очереди."""
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if not waiter.future.done():
+                # Слот переходит к ожидающему без уменьшения in_flight
+                waiter.future.set_result(None)
+                self._notify_positions()
+                return
+        self.in_flight -= 1
+
+    def _notify_positions(self, force: Optional[_Waiter] = None):
+        """Сообщение ожидающим об изменении их места в очереди."""
+        now = time.monotonic()
+        for position, waiter in enumerate(sorted(self._queue), start=1):
+            if waiter.on_position is None or waiter.position == position:
+                continue
+            if waiter is not force and now - waiter.notified_at < self.notify_interval:
+                continue
+            waiter.position = position
+            waiter.notified_at = now
+            task = asyncio.create_task(self._call_position(waiter.on_position, position))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    @staticmethod
+    async def _call_position(callback: PositionCallback, position: int):
+        """Вызов обработчика позиции без влияния на очередь."""
+        try:
+            await callback(position)
+        except Exception as e:
+            print(f"Ошибка уведомления о месте в очереди: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика допуска."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "rejected_busy": self.rejected_busy,
+            "timed_out": self.timed_out,
+            "wait": {tier: stats.get_stats() for tier, stats in self.wait_stats.items()}
+        }
@@ -0,0 +1,143 @@
+"""Подготовка голосовых сообщений к распознаванию речи."""
+
+import io
+import time
+import wave
+from typing import Any, Dict, List
+
+import av
+import numpy as np
+
+
+# Длина окна для оценки громкости, миллисекунды
+FRAME_MS = 30
+
+
+def decode_audio(path: str, sample_rate: int) -> np.ndarray:
+    """Декодирование файла (OGG/Opus и др.) в моно int16 с частотой sample_rate."""
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    parts: List[np.ndarray] = []
+    with av.open(path) as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                parts.append(resampled.to_ndarray().reshape(-1))
+    for resampled in resampler.resample(None):
+        parts.append(resampled.to_ndarray().reshape(-1))
+    if not parts:
+        return np.zeros(0, dtype=np.int16)
+    return np.concatenate(parts).astype(np.int16, copy=False)
+
+
+def frame_levels(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Громкость окон по FRAME_MS в dBFS."""
+    frame = sample_rate * FRAME_MS // 1000
+    count = len(samples) // frame
+    if count == 0:
+        return np.zeros(0)
+    windows = samples[:count * frame].reshape(count, frame).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(windows * windows, axis=1))
+    return 20 * np.log10(rms + 1e-10)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, threshold_db: float) -> np.ndarray:
+    """Обрезка тишины в начале и в конце записи."""
+    voiced = np.flatnonzero(frame_levels(samples, sample_rate) >= threshold_db)
+    if voiced.size == 0:
+        return samples[:0]
+    frame = sample_rate * FRAME_MS // 1000
+    # Оставляем по окну запаса, чтобы не срезать тихие края слов
+    start = max(int(voiced[0]) - 1, 0) * frame
+    end = min((int(voiced[-1]) + 2) * frame, len(samples))
+    return samples[start:end]
+
+
+def split_on_pauses(
+    samples: np.ndarray,
+    sample_rate: int,
+    threshold_db: float,
+    min_pause: float,
+    max_chunk: float
+) -> List[np.ndarray]:
+    """Деление записи на фрагменты не длиннее max_chunk секунд.
+
+    Резать можно только посередине паузы не короче min_pause секунд;
+    фрагмент обрывается на последней такой паузе перед пределом длины.
+    Если пауз нет, фрагмент режется ровно по пределу.
+    """
+    frame = sample_rate * FRAME_MS // 1000
+    silent = frame_levels(samples, sample_rate) < threshold_db
+    min_pause_frames = max(1, int(min_pause * 1000 / FRAME_MS))
+
+    # Точки разреза — середины достаточно длинных пауз, в сэмплах
+    cuts = []
+    run_start = None
+    for index, is_silent in enumerate(np.append(silent, False)):
+        if is_silent and run_start is None:
+            run_start = index
+        elif not is_silent and run_start is not None:
+            if index - run_start >= min_pause_frames:
+                cuts.append((run_start + index) // 2 * frame)
+            run_start = None
+
+    max_samples = int(max_chunk * sample_rate)
+    chunks = []
+    start = 0
+    while len(samples) - start > max_samples:
+        limit = start + max_samples
+        inside = [cut for cut in cuts if start < cut <= limit]
+        end = inside[-1] if inside else limit
+        chunks.append(samples[start:end])
+        start = end
+    if start < len(samples):
+        chunks.append(samples[start:])
+    return chunks
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """Моно 16-бит WAV."""
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.astype("<i2", copy=False).tobytes())
+    return output.getvalue()
+
+
+def prepare_voice(
+    path: str,
+    sample_rate: int,
+    silence_threshold_db: float,
+    min_pause: float,
+    max_chunk: float
+) -> Dict[str, Any]:
+    """Декодирование, обрезка тишины и деление голосового на фрагменты WAV.
+
+    Возвращает фрагменты по порядку, длительность до и после обрезки и
+    время каждого этапа в секундах.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    samples = decode_audio(path, sample_rate)
+    original_duration = len(samples) / sample_rate
+    timings["decode"] = time.perf_counter() - started
+
+    stage_started = time.perf_counter()
+    samples = trim_silence(samples, sample_rate, silence_threshold_db)
+    timings["trim"] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    chunks = split_on_pauses(samples, sample_rate, silence_threshold_db, min_pause, max_chunk)
+    timings["split"] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    encoded = [encode_wav(chunk, sample_rate) for chunk in chunks]
+    timings["encode"] = time.perf_counter() - stage_started
+
+    return {
+        "chunks": encoded,
+        "duration": round(len(samples) / sample_rate, 2),
+        "original_duration": round(original_duration, 2),
+        "timings": timings
+    }
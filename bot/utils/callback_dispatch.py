@@ -0,0 +1,133 @@
+"""Скомпилированная таблица маршрутизации callback-запросов."""
+
+from typing import Any, Dict, Optional, Type, Union
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject, CallbackType
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+
+class CallbackRoute:
+    """Маршрут callback-запроса."""
+
+    __slots__ = ("handler", "factory", "key", "flags")
+
+    def __init__(
+        self,
+        key: str,
+        handler: CallbackType,
+        factory: Optional[Type[CallbackData]] = None,
+        flags: Optional[Dict[str, Any]] = None
+    ):
+        """Инициализация маршрута."""
+        self.key = key
+        self.handler = CallableObject(handler)
+        self.factory = factory
+        self.flags = flags or {}
+
+
+class _TrieNode:
+    """Узел префиксного дерева."""
+
+    __slots__ = ("children", "route")
+
+    def __init__(self):
+        """Инициализация узла."""
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.route: Optional[CallbackRoute] = None
+
+
+class CallbackDispatchTable:
+    """Таблица маршрутизации callback-данных.
+
+    Точные значения хранятся в словаре, префиксы — в префиксном дереве,
+    поэтому стоимость поиска зависит от длины callback-данных,
+    а не от количества зарегистрированных кнопок.
+    """
+
+    def __init__(self, name: str = "callback_dispatch"):
+        """Инициализация таблицы."""
+        self._exact: Dict[str, CallbackRoute] = {}
+        self._trie = _TrieNode()
+
+        # Один обработчик на все callback-запросы вместо цепочки фильтров
+        self.router = Router(name=name)
+        self.router.callback_query.register(self._dispatch, self._match)
+
+    def exact(
+        self,
+        value: str,
+        handler: CallbackType,
+        flags: Optional[Dict[str, Any]] = None
+    ):
+        """Регистрация обработчика для точного значения callback-данных."""
+        if value in self._exact:
+            raise ValueError(f"Callback '{value}' уже зарегистрирован")
+        self._exact[value] = CallbackRoute(value, handler, flags=flags)
+
+    def prefix(
+        self,
+        prefix: Union[str, Type[CallbackData]],
+        handler: CallbackType,
+        flags: Optional[Dict[str, Any]] = None
+    ):
+        """Регистрация обработчика для префикса или фабрики CallbackData."""
+        factory = None
+        if isinstance(prefix, type) and issubclass(prefix, CallbackData):
+            factory = prefix
+            prefix = f"{factory.__prefix__}{factory.__separator__}"
+
+        node = self._trie
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+
+        if node.route is not None:
+            raise ValueError(f"Префикс '{prefix}' уже зарегистрирован")
+        node.route = CallbackRoute(prefix, handler, factory, flags)
+
+    def resolve(self, data: str) -> Optional[CallbackRoute]:
+        """Поиск маршрута: точное совпадение, затем самый длинный префикс."""
+        route = self._exact.get(data)
+        if route is not None:
+            return route
+
+        node = self._trie
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route is not None:
+                route = node.route
+
+        return route
+
+    async def _match(self, callback: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        """Фильтр: находит маршрут и распаковывает типизированные данные."""
+        if callback.data is None:
+            return False
+
+        route = self.resolve(callback.data)
+        if route is None:
+            return False
+
+        result: Dict[str, Any] = {"callback_route": route}
+        if route.factory is not None:
+            try:
+                result["callback_data"] = route.factory.unpack(callback.data)
+            except (TypeError, ValueError):
+                return False
+
+        return result
+
+    async def _dispatch(
+        self,
+        callback: CallbackQuery,
+        callback_route: CallbackRoute,
+        **kwargs: Any
+    ) -> Any:
+        """Вызов обработчика найденного маршрута."""
+        return await callback_route.handler.call(callback, **kwargs)
+
+
+# Глобальная таблица маршрутизации callback-запросов
+callback_table = CallbackDispatchTable()
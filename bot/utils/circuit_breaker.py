@@ -0,0 +1,76 @@
+"""Автоматический выключатель для внешних вызовов."""
+
+import time
+from typing import Any, Dict
+
+
+class CircuitBreaker:
+    """Circuit breaker с полуоткрытым состоянием.
+
+    closed — вызовы проходят, считаются подряд идущие ошибки;
+    open — вызовы сразу отклоняются, пока не истечет recovery_timeout;
+    half_open — пропускается ограниченное число пробных вызовов,
+    успех закрывает выключатель, ошибка снова открывает его.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        """Инициализация выключателя."""
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.half_open_calls = 0
+
+        if self.state == self.HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.rejected += 1
+                return False
+            self.half_open_calls += 1
+
+        return True
+
+    def release(self):
+        """Возврат разрешения вызова, прерванного без результата."""
+        if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_success(self):
+        """Учет успешного вызова."""
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        """Учет неудачного вызова."""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние выключателя."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,48 @@
+"""Подготовка изображений для моделей с компьютерным зрением."""
+
+import base64
+import io
+from typing import Any, Dict
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+def prepare_image(data: bytes, max_side: int, quality: int) -> Dict[str, Any]:
+    """Декодирование, поворот по EXIF, уменьшение и сжатие в JPEG base64."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        width, height = image.size
+
+    encoded = output.getvalue()
+    return {
+        "base64": base64.b64encode(encoded).decode("ascii"),
+        "width": width,
+        "height": height,
+        "original_bytes": len(data),
+        "bytes": len(encoded)
+    }
+
+
+def difference_hash(gray: np.ndarray, size: int = 8) -> int:
+    """Перцептивный dHash кадра в оттенках серого.
+
+    Кадр сжимается до size x (size + 1), и каждый бит показывает, светлее
+    ли пиксель соседа справа. Похожие кадры дают хеши с малым расстоянием
+    Хэмминга, даже если отличаются сжатием или небольшим сдвигом яркости.
+    """
+    image = Image.fromarray(np.asarray(gray, dtype=np.uint8))
+    pixels = np.asarray(image.resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Число различающихся бит двух хешей."""
+    return bin(first ^ second).count("1")
@@ -0,0 +1,65 @@
+"""Асинхронные блокировки по ключу."""
+
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Hashable
+
+from bot.utils.metrics import LatencyStats
+
+
+class KeyedLock:
+    """Таблица блокировок по ключу (например, по user_id).
+
+    Блокировки хранятся по слабым ссылкам: пока ключ кто-то держит или ждет,
+    блокировка жива, после освобождения она удаляется из таблицы сама.
+    Поэтому память ограничена числом активных ключей, а общей блокировки
+    на всю таблицу нет.
+    """
+
+    def __init__(self):
+        """Инициализация таблицы."""
+        self._locks: "weakref.WeakValueDictionary[Hashable, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_stats = LatencyStats()
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable) -> AsyncIterator[None]:
+        """Критическая секция для ключа."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+
+        self.acquisitions += 1
+        if lock.locked():
+            self.contended += 1
+            started = time.monotonic()
+            async with lock:
+                self.wait_stats.observe(time.monotonic() - started)
+                yield
+        else:
+            async with lock:
+                yield
+
+    def locked(self, key: Hashable) -> bool:
+        """Проверка, занят ли ключ."""
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика блокировок."""
+        return {
+            "active_keys": len(self._locks),
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait": self.wait_stats.get_stats()
+        }
+
+
+# Глобальная таблица блокировок пользователей
+user_locks = KeyedLock()
@@ -0,0 +1,71 @@
+"""Сборка альбомов Telegram (media_group_id) из отдельных обновлений."""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class MediaGroupCollector:
+    """Накопление элементов альбома и одна обработка на весь альбом.
+
+    Telegram присылает каждое фото альбома отдельным обновлением с общим
+    media_group_id. Элементы копятся, пока новые приходят чаще, чем раз в
+    window секунд; после паузы альбом целиком передается в on_complete.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        on_complete: Callable[[Hashable, List[Any]], Awaitable[None]],
+        max_items: int = 10
+    ):
+        """Инициализация сборщика."""
+        self.window = window
+        self.on_complete = on_complete
+        self.max_items = max_items
+        self._items: Dict[Hashable, List[Any]] = {}
+        self._last_added: Dict[Hashable, float] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.groups = 0
+        self.items = 0
+
+    def collecting(self, key: Hashable) -> bool:
+        """Собирается ли уже альбом с этим ключом."""
+        return key in self._items
+
+    def add(self, key: Hashable, item: Any):
+        """Добавление элемента в альбом."""
+        self.items += 1
+        self._items.setdefault(key, []).append(item)
+        self._last_added[key] = time.monotonic()
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._complete_later(key))
+
+    async def _complete_later(self, key: Hashable):
+        """Передача альбома после паузы в поступлении элементов."""
+        try:
+            while len(self._items[key]) < self.max_items:
+                delay = self._last_added[key] + self.window - time.monotonic()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            items = self._items.pop(key)
+            self._last_added.pop(key, None)
+            self._tasks.pop(key, None)
+
+        self.groups += 1
+        try:
+            await self.on_complete(key, items)
+        except Exception as e:
+            print(f"Ошибка обработки альбома {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика сборки альбомов."""
+        return {
+            "collecting": len(self._items),
+            "groups": self.groups,
+            "items": self.items,
+            # Вызовов модели сэкономлено: по одному на альбом вместо одного на фото
+            "calls_saved": self.items - self.groups - sum(len(items) for items in self._items.values())
+        }
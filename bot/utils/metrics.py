@@ -0,0 +1,44 @@
+"""Простые метрики задержек."""
+
+from collections import deque
+from typing import Deque, Dict
+
+
+class LatencyStats:
+    """Статистика задержек по скользящему окну последних измерений."""
+
+    def __init__(self, window: int = 1000):
+        """Инициализация статистики."""
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._window: Deque[float] = deque(maxlen=window)
+
+    def observe(self, duration: float, error: bool = False):
+        """Регистрация измерения в секундах."""
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self._window.append(duration)
+        if error:
+            self.errors += 1
+
+    def percentile(self, q: float) -> float:
+        """Перцентиль задержки по окну (q от 0 до 100)."""
+        if not self._window:
+            return 0.0
+        values = sorted(self._window)
+        index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+    def get_stats(self) -> Dict[str, float]:
+        """Сводка в миллисекундах."""
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2)
+        }
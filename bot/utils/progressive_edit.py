@@ -0,0 +1,80 @@
+"""Постепенное обновление сообщения по мере генерации текста."""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+
+# Максимальная длина текста сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ProgressiveEditor:
+    """Редактирование одного сообщения не чаще заданного интервала.
+
+    update() только запоминает последний текст: промежуточные версии,
+    пришедшие между правками, пропускаются. Первая правка уходит сразу,
+    следующие — не чаще min_interval, после flood control — по retry_after.
+    finish() дожидается текущей правки и ставит окончательный текст.
+    """
+
+    def __init__(self, message: Message, min_interval: float = 1.0):
+        """Инициализация редактора."""
+        self.message = message
+        self.min_interval = min_interval
+        self.edits = 0
+        self._pending: Optional[str] = None
+        self._shown: Optional[str] = message.text
+        self._next_edit_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str):
+        """Новая версия текста для показа."""
+        self._pending = text[:MAX_MESSAGE_LENGTH]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        """Показ последней версии текста с учетом интервала правок."""
+        while self._pending is not None and self._pending != self._shown:
+            delay = self._next_edit_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._edit(self._pending)
+
+    async def _edit(self, text: str, **kwargs: Any) -> bool:
+        """Одна правка сообщения."""
+        try:
+            await self.message.edit_text(text, **kwargs)
+        except TelegramRetryAfter as e:
+            self._next_edit_at = time.monotonic() + e.retry_after
+            return False
+        except TelegramBadRequest as e:
+            # Текст не изменился — считаем его показанным
+            if "message is not modified" not in str(e):
+                raise
+        self._shown = text
+        self.edits += 1
+        self._next_edit_at = time.monotonic() + self.min_interval
+        return True
+
+    async def finish(self, text: str, **kwargs: Any):
+        """Окончательный текст сообщения."""
+        self._pending = None
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+        text = text[:MAX_MESSAGE_LENGTH]
+        while not await self._edit(text, **kwargs):
+            await asyncio.sleep(max(self._next_edit_at - time.monotonic(), 0))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Число выполненных правок."""
+        return {"edits": self.edits}
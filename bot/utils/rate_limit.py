@@ -0,0 +1,115 @@
+"""Учет ограничений частоты запросов внешнего API."""
+
+import asyncio
+import email.utils
+import random
+import re
+import time
+from typing import Any, Dict, Mapping, Optional
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Разбор длительности вида "20ms", "1s", "6m0s" или "1.5" в секунды."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_delay_from_headers(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Задержка, которую просит API, по заголовкам ответа.
+
+    Учитываются retry-after-ms, retry-after (секунды или HTTP-дата)
+    и x-ratelimit-reset-* для исчерпанных лимитов x-ratelimit-remaining-*.
+    """
+    if not headers:
+        return None
+
+    retry_after_ms = parse_duration(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        delay = parse_duration(retry_after)
+        if delay is None:
+            parsed = email.utils.parsedate_tz(retry_after)
+            if parsed is not None:
+                delay = email.utils.mktime_tz(parsed) - time.time()
+        if delay is not None:
+            return max(delay, 0.0)
+
+    delays = []
+    for limit in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{limit}") == "0":
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{limit}"))
+            if reset is not None:
+                delays.append(reset)
+    return max(delays) if delays else None
+
+
+class RateLimitGate:
+    """Общая для процесса пауза после ограничения частоты запросов.
+
+    Когда API отвечает 429 или сообщает об исчерпанном лимите, шлюз
+    запоминает момент, до которого новые запросы ждут. Ожидающие
+    отпускаются с небольшим разбросом, чтобы не прийти к API все сразу.
+    """
+
+    def __init__(self, max_delay: float = 60.0, release_jitter: float = 1.0):
+        """Инициализация шлюза."""
+        self.max_delay = max_delay
+        self.release_jitter = release_jitter
+        self.blocked_until = 0.0
+        self.rate_limited = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def observe(self, status_code: int, headers: Optional[Mapping[str, str]]) -> Optional[float]:
+        """Учет ответа API, возвращает запрошенную задержку."""
+        delay = retry_delay_from_headers(headers)
+        if status_code == 429:
+            self.rate_limited += 1
+        elif delay is None:
+            return None
+
+        if delay is not None:
+            delay = min(delay, self.max_delay)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def remaining(self, now: Optional[float] = None) -> float:
+        """Сколько еще действует пауза."""
+        if now is None:
+            now = time.monotonic()
+        return max(self.blocked_until - now, 0.0)
+
+    async def wait(self):
+        """Ожидание окончания паузы перед запросом."""
+        delay = self.remaining()
+        if delay <= 0:
+            return
+        delay += random.uniform(0, self.release_jitter)
+        self.waits += 1
+        self.wait_seconds += delay
+        await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика ограничений."""
+        return {
+            "rate_limited": self.rate_limited,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "blocked_for": round(self.remaining(), 3)
+        }
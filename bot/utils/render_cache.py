@@ -0,0 +1,180 @@
+"""Кэш готовых клавиатур и их сериализованного представления."""
+
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Tuple, TypeVar
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+from aiohttp import FormData
+
+
+T = TypeVar("T")
+
+
+class FrozenList(list):
+    """Список, запрещающий изменение."""
+
+    def _readonly(self, *args: Any, **kwargs: Any):
+        raise TypeError("Закэшированный объект нельзя изменять")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+
+_frozen_classes: Dict[type, type] = {}
+
+
+def _hashable(value: Any) -> Hashable:
+    """Аргумент в виде, пригодном для ключа кэша."""
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _frozen_class(cls: type) -> type:
+    """Подкласс модели aiogram с запретом присваивания полей."""
+    frozen = _frozen_classes.get(cls)
+    if frozen is None:
+        frozen = type(cls.__name__, (cls,), {
+            "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__,
+            "model_config": {**cls.model_config, "frozen": True}
+        })
+        _frozen_classes[cls] = frozen
+    return frozen
+
+
+def freeze(value: Any) -> Any:
+    """Неизменяемая копия объекта aiogram вместе с вложенными объектами и списками."""
+    if isinstance(value, TelegramObject):
+        fields = {
+            name: freeze(item)
+            for name, item in {**value.__dict__, **(value.model_extra or {})}.items()
+        }
+        return _frozen_class(type(value)).model_construct(
+            _fields_set=set(value.model_fields_set), **fields
+        )
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+class RenderCache:
+    """Кэш неизменяемых ответов бота.
+
+    Клавиатуры aiogram (MutableTelegramObject) изменяемы, поэтому перед
+    сохранением объект замораживается: присваивание полей и изменение
+    списков кнопок вызывают ошибку. Одну и ту же клавиатуру можно безопасно
+    переиспользовать для всех пользователей, а сериализованный JSON,
+    хранящийся рядом с объектом, не устаревает и отдается сессии без
+    повторного model_dump.
+    """
+
+    def __init__(self):
+        """Инициализация кэша."""
+        self._objects: Dict[Hashable, Any] = {}
+        self._payloads: Dict[int, Tuple[Any, str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.payload_hits = 0
+        self.payload_misses = 0
+
+    def cached(self, func: Callable[..., T]) -> Callable[..., T]:
+        """Декоратор: результат функции строится один раз для набора аргументов."""
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            key = (
+                func.__qualname__,
+                *(_hashable(arg) for arg in args),
+                *sorted((name, _hashable(arg)) for name, arg in kwargs.items())
+            )
+            return self.get_or_build(key, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    def get_or_build(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """Получение объекта из кэша или его построение."""
+        obj = self._objects.get(key)
+        if obj is not None:
+            self.hits += 1
+            return obj
+
+        self.misses += 1
+        obj = freeze(factory())
+        self._objects[key] = obj
+        if isinstance(obj, TelegramObject):
+            # Помечаем объект как кэшируемый, JSON посчитает сессия
+            self._payloads[id(obj)] = (obj, "")
+        return obj
+
+    def is_cached(self, value: Any) -> bool:
+        """Проверка, что объект построен этим кэшем."""
+        entry = self._payloads.get(id(value))
+        return entry is not None and entry[0] is value
+
+    def get_payload(self, value: Any, build: Callable[[], str]) -> str:
+        """Получение сериализованного представления объекта."""
+        obj, payload = self._payloads[id(value)]
+        if payload:
+            self.payload_hits += 1
+            return payload
+
+        self.payload_misses += 1
+        payload = build()
+        self._payloads[id(value)] = (obj, payload)
+        return payload
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика попаданий в кэш."""
+        return {
+            "objects": len(self._objects),
+            "hits": self.hits,
+            "misses": self.misses,
+            "payload_hits": self.payload_hits,
+            "payload_misses": self.payload_misses
+        }
+
+
+class RenderCacheSession(AiohttpSession):
+    """Сессия, отправляющая закэшированные объекты без повторной сериализации."""
+
+    def __init__(self, cache: "RenderCache", **kwargs: Any):
+        """Инициализация сессии."""
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        """Формирование тела запроса с подстановкой готового JSON."""
+        cached = {
+            key: value
+            for key in method.model_fields
+            if self.cache.is_cached(value := getattr(method, key, None))
+        }
+        if not cached:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, Any] = {}
+        for key, value in method.model_dump(warnings=False, exclude=set(cached)).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+
+        for key, value in cached.items():
+            payload = self.cache.get_payload(
+                value,
+                lambda: self.prepare_value(value, bot=bot, files=files)
+            )
+            form.add_field(key, payload)
+
+        for key, value in files.items():
+            form.add_field(
+                key,
+                value.read(bot),
+                filename=value.filename or key,
+            )
+        return form
+
+
+# Глобальный кэш отрисовки
+render_cache = RenderCache()
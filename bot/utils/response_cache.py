@@ -0,0 +1,121 @@
+"""LRU-кэш ответов с TTL и условной ревалидацией."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class CacheEntry:
+    """Запись кэша ответа."""
+
+    __slots__ = ("value", "expires_at", "stale_until", "etag", "last_modified")
+
+    def __init__(
+        self,
+        value: Any,
+        expires_at: float,
+        stale_until: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ):
+        """Инициализация записи."""
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        """Запись еще не устарела."""
+        if now is None:
+            now = time.monotonic()
+        return now < self.expires_at
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Заголовки условного запроса для ревалидации."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Кэш ответов с TTL, окном stale-while-revalidate и вытеснением LRU.
+
+    Устаревшую запись можно отдавать еще stale_ttl секунд, пока ее
+    обновляют в фоне. Записи старше этого окна считаются отсутствующими.
+    """
+
+    def __init__(self, maxsize: int = 1000, stale_ttl: float = 3600.0):
+        """Инициализация кэша."""
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Получение записи без учета свежести."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if time.monotonic() >= entry.stale_until:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> CacheEntry:
+        """Сохранение ответа."""
+        now = time.monotonic()
+        entry = CacheEntry(value, now + ttl, now + ttl + self.stale_ttl, etag, last_modified)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return entry
+
+    def touch(self, key: str, ttl: float):
+        """Продление записи после ответа 304 Not Modified."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = time.monotonic()
+            entry.expires_at = now + ttl
+            entry.stale_until = now + ttl + self.stale_ttl
+            self.revalidated += 1
+
+    def invalidate(self, prefix: str = "") -> int:
+        """Удаление записей с ключами, начинающимися с prefix."""
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика кэша."""
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,131 @@
+"""Семантический кэш ответов по близости вопросов."""
+
+import re
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Нормализация вопроса: регистр, ё, пунктуация и пробелы."""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class SemanticCache:
+    """Кэш ответов с поиском по косинусной близости эмбеддингов.
+
+    Векторы нормированы и лежат в одной матрице, поэтому поиск — одно
+    матричное умножение. Точное совпадение нормализованного текста
+    находится без вектора. Записи живут ttl секунд; при переполнении
+    вытесняется давно не использованная запись.
+    """
+
+    def __init__(self, maxsize: int, threshold: float, ttl: float):
+        """Инициализация кэша."""
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors: Optional[np.ndarray] = None
+        self._answers: List[Optional[str]] = [None] * maxsize
+        self._questions: List[Optional[str]] = [None] * maxsize
+        self._expires_at = np.zeros(maxsize)
+        self._last_used = np.zeros(maxsize)
+        self._by_question: Dict[str, int] = {}
+        self.size = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_exact(self, question: str, now: Optional[float] = None) -> Optional[str]:
+        """Ответ на точно такой же нормализованный вопрос."""
+        if now is None:
+            now = time.monotonic()
+        index = self._by_question.get(question)
+        if index is None or self._expires_at[index] <= now:
+            return None
+        self.hits += 1
+        self.exact_hits += 1
+        self._last_used[index] = now
+        return self._answers[index]
+
+    def search(self, vector: Sequence[float], now: Optional[float] = None) -> Optional[str]:
+        """Ответ на самый близкий вопрос, если он выше порога."""
+        if now is None:
+            now = time.monotonic()
+        if self.size == 0:
+            self.misses += 1
+            return None
+
+        query = self._normalize(vector)
+        scores = self._vectors[:self.size] @ query
+        scores[self._expires_at[:self.size] <= now] = -1.0
+        index = int(np.argmax(scores))
+        if scores[index] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._last_used[index] = now
+        return self._answers[index]
+
+    def add(self, question: str, vector: Sequence[float], answer: str,
+            now: Optional[float] = None):
+        """Сохранение ответа на вопрос."""
+        if now is None:
+            now = time.monotonic()
+        query = self._normalize(vector)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.maxsize, query.shape[0]), dtype=np.float32)
+
+        index = self._by_question.get(question)
+        if index is None:
+            index = self._free_slot(now)
+        self._vectors[index] = query
+        self._answers[index] = answer
+        self._questions[index] = question
+        self._expires_at[index] = now + self.ttl
+        self._last_used[index] = now
+        self._by_question[question] = index
+
+    def _free_slot(self, now: float) -> int:
+        """Свободная ячейка: новая, с истекшей записью или самая старая."""
+        if self.size < self.maxsize:
+            self.size += 1
+            return self.size - 1
+
+        expired = np.flatnonzero(self._expires_at <= now)
+        if expired.size:
+            index = int(expired[0])
+        else:
+            index = int(np.argmin(self._last_used))
+            self.evictions += 1
+        del self._by_question[self._questions[index]]
+        return index
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        """Вектор единичной длины."""
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша."""
+        lookups = self.hits + self.misses
+        return {
+            "size": self.size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "exact_hits": self.exact_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
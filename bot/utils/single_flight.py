@@ -0,0 +1,49 @@
+"""Объединение одновременных одинаковых вызовов."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Группа single-flight.
+
+    Пока вызов с ключом выполняется, все остальные вызовы с тем же ключом
+    не запускаются заново, а ждут общий результат (или общее исключение).
+    """
+
+    def __init__(self, name: str = "default"):
+        """Инициализация группы."""
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Выполнение func один раз для всех одновременных вызовов с ключом."""
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: отмена одного ожидающего не отменяет вызов для остальных
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(func())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        """Удаление завершенного вызова из таблицы."""
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика объединения вызовов."""
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight)
+        }
@@ -0,0 +1,145 @@
+"""Извлечение ключевых кадров видео для моделей с компьютерным зрением."""
+
+import base64
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from bot.utils.image_processing import difference_hash, hamming_distance
+
+
+def _resize(frame: np.ndarray, max_side: int) -> np.ndarray:
+    """Уменьшение кадра до max_side по длинной стороне."""
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(
+        frame,
+        (max(1, round(width * scale)), max(1, round(height * scale))),
+        interpolation=cv2.INTER_AREA
+    )
+
+
+def _histogram(frame: np.ndarray) -> np.ndarray:
+    """Нормированная гистограмма оттенка и насыщенности кадра."""
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    histogram = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(histogram, histogram).flatten()
+
+
+def extract_keyframes(
+    path: str,
+    max_frames: int,
+    sample_interval: float,
+    scene_threshold: float,
+    hash_distance: int,
+    max_side: int,
+    quality: int
+) -> Dict[str, Any]:
+    """Ключевые кадры видео в хронологическом порядке, JPEG base64.
+
+    Кадры берутся раз в sample_interval секунд. Кадр считается сменой
+    сцены, если расстояние Бхаттачарьи между его гистограммой и
+    гистограммой предыдущего взятого кадра не меньше scene_threshold;
+    первый кадр берется всегда. Почти одинаковые кадры (dHash отличается
+    не больше чем на hash_distance бит, а гистограмма — меньше чем на
+    scene_threshold) схлопываются в один, а из оставшихся сохраняются
+    max_frames с самой резкой сменой сцены.
+
+    Если смен сцены меньше max_frames (видео снято одним планом),
+    оставшиеся места занимают кадры, равномерно распределенные по
+    времени: каждый следующий берется как можно дальше от уже выбранных.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Не удалось открыть видео")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    step = max(1, int(round(fps * sample_interval)))
+
+    # (оценка смены сцены, время, dHash, гистограмма, кадр)
+    kept: List[Tuple[float, float, int, np.ndarray, np.ndarray]] = []
+    # Равномерная выборка для заполнения: (время, кадр); при переполнении
+    # прореживается вдвое, поэтому памяти нужно не больше 2 * max_frames кадров
+    spread: List[Tuple[float, np.ndarray]] = []
+    spread_stride = 1
+    previous = None
+    index = sampled = duplicates = 0
+    try:
+        while capture.grab():
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    sampled += 1
+                    frame = _resize(frame, max_side)
+                    if (sampled - 1) % spread_stride == 0:
+                        spread.append((index / fps, frame))
+                        if len(spread) > 2 * max_frames:
+                            spread = spread[::2]
+                            spread_stride *= 2
+
+                    histogram = _histogram(frame)
+                    score = 1.0 if previous is None else cv2.compareHist(
+                        previous, histogram, cv2.HISTCMP_BHATTACHARYYA
+                    )
+                    previous = histogram
+
+                    if score >= scene_threshold:
+                        frame_hash = difference_hash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+                        # dHash не различает однотонные кадры разных цветов,
+                        # поэтому дубль должен совпадать и по гистограмме
+                        duplicate = next(
+                            (
+                                position for position, (_, _, other_hash, other_histogram, _) in enumerate(kept)
+                                if hamming_distance(frame_hash, other_hash) <= hash_distance
+                                and cv2.compareHist(
+                                    other_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA
+                                ) < scene_threshold
+                            ),
+                            None
+                        )
+                        if duplicate is not None:
+                            duplicates += 1
+                            if kept[duplicate][0] < score:
+                                kept[duplicate] = (score, index / fps, frame_hash, histogram, frame)
+                        else:
+                            kept.append((score, index / fps, frame_hash, histogram, frame))
+                            if len(kept) > max_frames:
+                                weakest = min(range(len(kept)), key=lambda position: kept[position][0])
+                                del kept[weakest]
+            index += 1
+    finally:
+        capture.release()
+
+    chosen = [(timestamp, frame) for _, timestamp, _, _, frame in kept]
+    filled = 0
+    while len(chosen) < max_frames:
+        taken = {timestamp for timestamp, _ in chosen}
+        candidates = [item for item in spread if item[0] not in taken]
+        if not candidates:
+            break
+        chosen.append(max(
+            candidates,
+            key=lambda item: min((abs(item[0] - timestamp) for timestamp in taken), default=0.0)
+        ))
+        filled += 1
+
+    chosen.sort(key=lambda item: item[0])
+    frames = []
+    timestamps = []
+    for timestamp, frame in chosen:
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            frames.append(base64.b64encode(encoded.tobytes()).decode("ascii"))
+            timestamps.append(round(timestamp, 2))
+
+    return {
+        "frames": frames,
+        "timestamps": timestamps,
+        "duration": round(index / fps, 2),
+        "sampled": sampled,
+        "duplicates": duplicates,
+        "filled": filled
+    }
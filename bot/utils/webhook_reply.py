@@ -0,0 +1,63 @@
+"""Ответ на обновление прямо в теле ответа webhook."""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.methods import TelegramMethod
+
+
+logger = logging.getLogger(__name__)
+
+# Ссылки на фоновые запросы, чтобы их не собрал сборщик мусора
+_pipelined_tasks: Set[asyncio.Task] = set()
+
+
+async def _silent_call(method: TelegramMethod[Any]):
+    """Выполнение запроса к Bot API без проброса ошибок."""
+    try:
+        await method
+    except TelegramAPIError as e:
+        logger.error(f"Ошибка фонового запроса {method.__api_method__}: {e}")
+
+
+def webhook_reply(
+    method: TelegramMethod[Any],
+    *pipelined: TelegramMethod[Any]
+) -> TelegramMethod[Any]:
+    """Подготовка ответа обработчика через webhook.
+
+    Первый метод возвращается диспетчеру и уходит в теле ответа webhook,
+    остальные отправляются сразу и параллельно, не дожидаясь друг друга.
+    В режиме polling диспетчер выполнит возвращенный метод сам.
+    """
+    for extra in pipelined:
+        task = asyncio.create_task(_silent_call(extra))
+        _pipelined_tasks.add(task)
+        task.add_done_callback(_pipelined_tasks.discard)
+
+    return method
+
+
+def build_webhook_response(
+    bot: Bot,
+    method: TelegramMethod[Any]
+) -> Optional[Dict[str, Any]]:
+    """Сериализация метода в JSON-тело ответа webhook.
+
+    Возвращает None, если метод содержит файлы: их нельзя передать в JSON.
+    """
+    files: Dict[str, Any] = {}
+    payload: Dict[str, Any] = {"method": method.__api_method__}
+
+    for key, value in method.model_dump(warnings=False).items():
+        value = bot.session.prepare_value(value, bot=bot, files=files, _dumps_json=False)
+        if value is None:
+            continue
+        payload[key] = value
+
+    if files:
+        return None
+
+    return payload
@@ -14,6 +14,8 @@ class Settings(BaseSettings):
     # Webhook
     webhook_url: str = Field(..., env="WEBHOOK_URL")
     webhook_path: str = Field("/webhook", env="WEBHOOK_PATH")
+    webhook_reply: bool = Field(True, env="WEBHOOK_REPLY")
+    webhook_reply_timeout: float = Field(2.0, env="WEBHOOK_REPLY_TIMEOUT")
     
     # База данных
     db_dsn: str = Field(..., env="DB_DSN")
@@ -21,16 +23,148 @@ class Settings(BaseSettings):
     # API сайта
     site_api_url: str = Field(..., env="SITE_API_URL")
     site_api_key: str = Field(..., env="SITE_API_KEY")
+    site_api_connect_timeout: float = Field(5.0, env="SITE_API_CONNECT_TIMEOUT")
+    site_api_read_timeout: float = Field(30.0, env="SITE_API_READ_TIMEOUT")
+    site_api_max_connections: int = Field(20, env="SITE_API_MAX_CONNECTIONS")
+    site_api_max_keepalive: int = Field(10, env="SITE_API_MAX_KEEPALIVE")
+    site_api_http2: bool = Field(False, env="SITE_API_HTTP2")
+    site_api_cache_size: int = Field(1000, env="SITE_API_CACHE_SIZE")
+    site_api_catalog_ttl: float = Field(600.0, env="SITE_API_CATALOG_TTL")
+    site_api_profile_ttl: float = Field(60.0, env="SITE_API_PROFILE_TTL")
+    site_api_stale_ttl: float = Field(3600.0, env="SITE_API_STALE_TTL")
+    site_api_breaker_threshold: int = Field(5, env="SITE_API_BREAKER_THRESHOLD")
+    site_api_breaker_recovery: float = Field(30.0, env="SITE_API_BREAKER_RECOVERY")
+    site_api_min_timeout: float = Field(1.0, env="SITE_API_MIN_TIMEOUT")
+    site_api_timeout_factor: float = Field(3.0, env="SITE_API_TIMEOUT_FACTOR")
+    site_api_timeout_min_samples: int = Field(20, env="SITE_API_TIMEOUT_MIN_SAMPLES")
+    site_webhook_secret: str = Field("", env="SITE_WEBHOOK_SECRET")
+    site_webhook_tolerance: float = Field(300.0, env="SITE_WEBHOOK_TOLERANCE")
+    
+    # Синхронизация подписок и пакетов с сайтом
+    entitlement_sync_interval: float = Field(300.0, env="ENTITLEMENT_SYNC_INTERVAL")
+    entitlement_sync_page_size: int = Field(500, env="ENTITLEMENT_SYNC_PAGE_SIZE")
+    entitlement_sync_batch_size: int = Field(200, env="ENTITLEMENT_SYNC_BATCH_SIZE")
+    
+    # Отправка результатов тестов на сайт
+    result_outbox_interval: float = Field(10.0, env="RESULT_OUTBOX_INTERVAL")
+    result_outbox_batch_size: int = Field(100, env="RESULT_OUTBOX_BATCH_SIZE")
+    result_outbox_lease: float = Field(60.0, env="RESULT_OUTBOX_LEASE")
+    result_outbox_max_attempts: int = Field(20, env="RESULT_OUTBOX_MAX_ATTEMPTS")
+    result_outbox_base_backoff: float = Field(5.0, env="RESULT_OUTBOX_BASE_BACKOFF")
+    result_outbox_max_backoff: float = Field(900.0, env="RESULT_OUTBOX_MAX_BACKOFF")
+    
+    # Очередь ИИ-анализа медиа: аренда задачи, попытки, задержки повторов,
+    # опрос очереди, воркеров на процесс ai_worker.py и в процессе webhook
+    ai_job_lease: float = Field(600.0, env="AI_JOB_LEASE")
+    ai_job_max_attempts: int = Field(5, env="AI_JOB_MAX_ATTEMPTS")
+    ai_job_base_backoff: float = Field(10.0, env="AI_JOB_BASE_BACKOFF")
+    ai_job_max_backoff: float = Field(600.0, env="AI_JOB_MAX_BACKOFF")
+    ai_job_poll_interval: float = Field(2.0, env="AI_JOB_POLL_INTERVAL")
+    ai_job_worker_concurrency: int = Field(4, env="AI_JOB_WORKER_CONCURRENCY")
+    ai_job_inline_workers: int = Field(0, env="AI_JOB_INLINE_WORKERS")
+    ai_job_stats_interval: float = Field(60.0, env="AI_JOB_STATS_INTERVAL")
+    
+    # Сборка альбома: пауза после последнего фото (с) и максимум фото
+    media_group_window: float = Field(1.0, env="MEDIA_GROUP_WINDOW")
+    media_group_max_photos: int = Field(10, env="MEDIA_GROUP_MAX_PHOTOS")
     
     # OpenAI
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
+    openai_connect_timeout: float = Field(5.0, env="OPENAI_CONNECT_TIMEOUT")
+    openai_timeout: float = Field(120.0, env="OPENAI_TIMEOUT")
+    openai_max_connections: int = Field(50, env="OPENAI_MAX_CONNECTIONS")
+    openai_max_keepalive: int = Field(20, env="OPENAI_MAX_KEEPALIVE")
+    openai_max_retries: int = Field(4, env="OPENAI_MAX_RETRIES")
+    openai_base_retry_delay: float = Field(0.5, env="OPENAI_BASE_RETRY_DELAY")
+    openai_max_retry_delay: float = Field(60.0, env="OPENAI_MAX_RETRY_DELAY")
+    openai_release_jitter: float = Field(1.0, env="OPENAI_RELEASE_JITTER")
+    
+    # Маршрутизация моделей: кандидаты через запятую в порядке приоритета
+    llm_route_short_question: str = Field("gpt-4,gpt-3.5-turbo", env="LLM_ROUTE_SHORT_QUESTION")
+    llm_route_long_question: str = Field("gpt-4,gpt-4-1106-preview", env="LLM_ROUTE_LONG_QUESTION")
+    llm_route_vision: str = Field("gpt-4-vision-preview", env="LLM_ROUTE_VISION")
+    llm_route_transcription: str = Field("whisper-1", env="LLM_ROUTE_TRANSCRIPTION")
+    llm_route_transcript_analysis: str = Field("gpt-4,gpt-3.5-turbo", env="LLM_ROUTE_TRANSCRIPT_ANALYSIS")
+    # Цели по p95 задержки (секунды); для консультаций — до первого фрагмента
+    llm_target_short_question: float = Field(5.0, env="LLM_TARGET_SHORT_QUESTION")
+    llm_target_long_question: float = Field(10.0, env="LLM_TARGET_LONG_QUESTION")
+    llm_target_vision: float = Field(30.0, env="LLM_TARGET_VISION")
+    llm_target_transcription: float = Field(30.0, env="LLM_TARGET_TRANSCRIPTION")
+    llm_target_transcript_analysis: float = Field(30.0, env="LLM_TARGET_TRANSCRIPT_ANALYSIS")
+    llm_router_long_question_tokens: int = Field(300, env="LLM_ROUTER_LONG_QUESTION_TOKENS")
+    llm_router_horizon: float = Field(300.0, env="LLM_ROUTER_HORIZON")
+    llm_router_min_samples: int = Field(10, env="LLM_ROUTER_MIN_SAMPLES")
+    llm_router_max_error_rate: float = Field(0.2, env="LLM_ROUTER_MAX_ERROR_RATE")
+    
+    # Очередь запросов к LLM
+    llm_max_concurrency: int = Field(8, env="LLM_MAX_CONCURRENCY")
+    llm_queue_timeout: float = Field(180.0, env="LLM_QUEUE_TIMEOUT")
+    llm_queue_notify_interval: float = Field(3.0, env="LLM_QUEUE_NOTIFY_INTERVAL")
+    llm_subscription_priority: float = Field(60.0, env="LLM_SUBSCRIPTION_PRIORITY")
+    llm_package_priority: float = Field(30.0, env="LLM_PACKAGE_PRIORITY")
     
     # Пути
     storage_path: str = Field("./storage", env="STORAGE_PATH")
     
+    # Загрузка медиа из Telegram
+    media_max_size: int = Field(20 * 1024 * 1024, env="MEDIA_MAX_SIZE")
+    media_spool_max_memory: int = Field(2 * 1024 * 1024, env="MEDIA_SPOOL_MAX_MEMORY")
+    media_chunk_size: int = Field(64 * 1024, env="MEDIA_CHUNK_SIZE")
+    media_download_timeout: int = Field(60, env="MEDIA_DOWNLOAD_TIMEOUT")
+    media_worker_processes: int = Field(2, env="MEDIA_WORKER_PROCESSES")
+    
+    # Хранилище медиа по хешу содержимого: корень (пусто — STORAGE_PATH/media,
+    # можно указать tmpfs, например /dev/shm/humanology), лимит размера,
+    # возраст забытых временных файлов и интервал очистки (с)
+    media_storage_path: str = Field("", env="MEDIA_STORAGE_PATH")
+    media_storage_max_bytes: int = Field(1024 * 1024 * 1024, env="MEDIA_STORAGE_MAX_BYTES")
+    media_storage_orphan_age: float = Field(3600.0, env="MEDIA_STORAGE_ORPHAN_AGE")
+    media_storage_sweep_interval: float = Field(600.0, env="MEDIA_STORAGE_SWEEP_INTERVAL")
+    
+    # Подготовка фото для модели: длинная сторона, качество JPEG, detail
+    vision_image_max_side: int = Field(512, env="VISION_IMAGE_MAX_SIDE")
+    vision_image_quality: int = Field(85, env="VISION_IMAGE_QUALITY")
+    vision_image_detail: str = Field("high", env="VISION_IMAGE_DETAIL")
+    
+    # Ключевые кадры видео: не больше кадров, шаг выборки (с), порог смены
+    # сцены (расстояние Бхаттачарьи) и порог дублей по dHash (бит из 64)
+    video_max_keyframes: int = Field(6, env="VIDEO_MAX_KEYFRAMES")
+    video_sample_interval: float = Field(0.5, env="VIDEO_SAMPLE_INTERVAL")
+    video_scene_threshold: float = Field(0.3, env="VIDEO_SCENE_THRESHOLD")
+    video_hash_distance: int = Field(6, env="VIDEO_HASH_DISTANCE")
+    
+    # Голосовые: частота для распознавания, порог тишины (dBFS), минимальная
+    # пауза для разреза (с), длина фрагмента (с) и параллельных запросов
+    voice_sample_rate: int = Field(16000, env="VOICE_SAMPLE_RATE")
+    voice_silence_threshold_db: float = Field(-40.0, env="VOICE_SILENCE_THRESHOLD_DB")
+    voice_min_pause: float = Field(0.4, env="VOICE_MIN_PAUSE")
+    voice_max_chunk_seconds: float = Field(30.0, env="VOICE_MAX_CHUNK_SECONDS")
+    voice_transcription_concurrency: int = Field(4, env="VOICE_TRANSCRIPTION_CONCURRENCY")
+    
+    # Кэш результатов анализа медиа: записей в памяти и их время жизни
+    ai_result_cache_size: int = Field(1000, env="AI_RESULT_CACHE_SIZE")
+    ai_result_cache_ttl: float = Field(86400.0, env="AI_RESULT_CACHE_TTL")
+    
     # Лимиты
     free_consultation_limit: int = Field(5, env="FREE_CONSULTATION_LIMIT")
     
+    # Интервал правок сообщения при потоковом ответе консультации
+    consultation_stream_edit_interval: float = Field(1.0, env="CONSULTATION_STREAM_EDIT_INTERVAL")
+    
+    # Память диалога консультации (в токенах)
+    consultation_history_budget: int = Field(2000, env="CONSULTATION_HISTORY_BUDGET")
+    consultation_memory_keep_tokens: int = Field(800, env="CONSULTATION_MEMORY_KEEP_TOKENS")
+    consultation_summary_model: str = Field("gpt-3.5-turbo", env="CONSULTATION_SUMMARY_MODEL")
+    consultation_summary_max_tokens: int = Field(300, env="CONSULTATION_SUMMARY_MAX_TOKENS")
+    consultation_chars_per_token: int = Field(2, env="CONSULTATION_CHARS_PER_TOKEN")
+    
+    # Семантический кэш ответов консультаций
+    semantic_cache_enabled: bool = Field(True, env="SEMANTIC_CACHE_ENABLED")
+    semantic_cache_size: int = Field(5000, env="SEMANTIC_CACHE_SIZE")
+    semantic_cache_threshold: float = Field(0.95, env="SEMANTIC_CACHE_THRESHOLD")
+    semantic_cache_ttl: float = Field(86400.0, env="SEMANTIC_CACHE_TTL")
+    semantic_cache_embedding_model: str = Field("text-embedding-ada-002", env="SEMANTIC_CACHE_EMBEDDING_MODEL")
+    
     # Настройки сервера
     host: str = Field("0.0.0.0", env="HOST")
     port: int = Field(8000, env="PORT")
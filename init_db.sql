@@ -17,9 +17,13 @@ CREATE TABLE IF NOT EXISTS users (
     first_name VARCHAR(100),
     last_name VARCHAR(100),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    answer_cache_opt_out BOOLEAN NOT NULL DEFAULT FALSE
 );
 
+-- Отказ от готовых ответов для уже существующих таблиц
+ALTER TABLE users ADD COLUMN IF NOT EXISTS answer_cache_opt_out BOOLEAN NOT NULL DEFAULT FALSE;
+
 -- Создание индекса для telegram_id
 CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
 
@@ -49,6 +53,22 @@ CREATE TABLE IF NOT EXISTS test_results (
 CREATE INDEX IF NOT EXISTS idx_test_results_user_id ON test_results(user_id);
 CREATE INDEX IF NOT EXISTS idx_test_results_test_type ON test_results(test_type);
 
+-- Очередь отправки результатов тестов на сайт (transactional outbox)
+CREATE TABLE IF NOT EXISTS result_outbox (
+    id SERIAL PRIMARY KEY,
+    test_result_id INTEGER NOT NULL REFERENCES test_results(id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(64) UNIQUE NOT NULL,
+    status VARCHAR(20) DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Индекс для выборки ожидающих отправки записей
+CREATE INDEX IF NOT EXISTS idx_result_outbox_pending ON result_outbox(status, next_attempt_at);
+
 -- Таблица премиум доступа
 CREATE TABLE IF NOT EXISTS premium_access (
     id SERIAL PRIMARY KEY,
@@ -57,6 +77,7 @@ CREATE TABLE IF NOT EXISTS premium_access (
     is_active BOOLEAN DEFAULT TRUE,
     expires_at TIMESTAMP WITH TIME ZONE,
     remaining_uses INTEGER,
+    site_updated_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -65,6 +86,7 @@ CREATE TABLE IF NOT EXISTS premium_access (
 CREATE INDEX IF NOT EXISTS idx_premium_access_user_id ON premium_access(user_id);
 CREATE INDEX IF NOT EXISTS idx_premium_access_type ON premium_access(access_type);
 CREATE INDEX IF NOT EXISTS idx_premium_access_active ON premium_access(is_active);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_premium_access_user_type ON premium_access(user_id, access_type);
 
 -- Таблица консультаций
 CREATE TABLE IF NOT EXISTS consultations (
@@ -73,9 +95,15 @@ CREATE TABLE IF NOT EXISTS consultations (
     message_count INTEGER DEFAULT 0,
     last_message_at TIMESTAMP WITH TIME ZONE,
     is_active BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    summary TEXT,
+    history BYTEA
 );
 
+-- Память диалога для уже существующих таблиц
+ALTER TABLE consultations ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE consultations ADD COLUMN IF NOT EXISTS history BYTEA;
+
 -- Создание индекса для user_id в консультациях
 CREATE INDEX IF NOT EXISTS idx_consultations_user_id ON consultations(user_id);
 
@@ -85,6 +113,8 @@ CREATE TABLE IF NOT EXISTS ai_analyses (
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     media_type VARCHAR(20) NOT NULL,
     file_id VARCHAR(200) NOT NULL,
+    file_unique_id VARCHAR(100),
+    content_hash VARCHAR(64),
     analysis_result TEXT NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -93,6 +123,35 @@ CREATE TABLE IF NOT EXISTS ai_analyses (
 CREATE INDEX IF NOT EXISTS idx_ai_analyses_user_id ON ai_analyses(user_id);
 CREATE INDEX IF NOT EXISTS idx_ai_analyses_media_type ON ai_analyses(media_type);
 
+-- Ключи кэша результатов анализа для уже существующих таблиц
+ALTER TABLE ai_analyses ADD COLUMN IF NOT EXISTS file_unique_id VARCHAR(100);
+ALTER TABLE ai_analyses ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+CREATE INDEX IF NOT EXISTS idx_ai_analyses_file_unique_id ON ai_analyses(media_type, file_unique_id);
+CREATE INDEX IF NOT EXISTS idx_ai_analyses_content_hash ON ai_analyses(media_type, content_hash);
+
+-- Очередь задач ИИ-анализа медиа
+CREATE TABLE IF NOT EXISTS ai_jobs (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    chat_id BIGINT NOT NULL,
+    message_id INTEGER NOT NULL,
+    media_type VARCHAR(20) NOT NULL,
+    file_id VARCHAR(200) NOT NULL,
+    file_unique_id VARCHAR(100),
+    files TEXT,
+    status VARCHAR(20) DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    lease_token VARCHAR(32),
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Индекс для выборки задач воркерами
+CREATE INDEX IF NOT EXISTS idx_ai_jobs_pending ON ai_jobs(status, next_attempt_at);
+
 -- Создание триггера для автоматического обновления updated_at
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -157,9 +216,11 @@ AND (pa.expires_at IS NULL OR pa.expires_at > CURRENT_TIMESTAMP);
 COMMENT ON TABLE users IS 'Пользователи бота';
 COMMENT ON TABLE user_logs IS 'Логи действий пользователей';
 COMMENT ON TABLE test_results IS 'Результаты тестов';
+COMMENT ON TABLE result_outbox IS 'Очередь отправки результатов тестов на сайт';
 COMMENT ON TABLE premium_access IS 'Премиум доступ пользователей';
 COMMENT ON TABLE consultations IS 'Консультации с ИИ';
 COMMENT ON TABLE ai_analyses IS 'Результаты ИИ-анализа';
+COMMENT ON TABLE ai_jobs IS 'Очередь задач ИИ-анализа';
 
 -- Проверка создания таблиц
 SELECT table_name, table_type 
@@ -1,5 +1,6 @@
 """Главный файл приложения."""
 
+import json
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
@@ -8,6 +9,22 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from config import settings
 from bot.bot import telegram_bot
+from bot.utils.render_cache import render_cache
+from bot.middlewares.early_answer import early_answer_middleware
+from bot.utils.keyed_lock import user_locks
+from bot.services.site_api_service import site_api_service
+from bot.database.database import db
+from bot.services.entitlement_sync_service import entitlement_sync_service
+from bot.services.result_outbox_service import result_outbox_service
+from bot.services.openai_client import openai_client_factory
+from bot.services.llm_admission import llm_admission
+from bot.services.consultation_service import answer_cache
+from bot.services.model_router import model_router
+from bot.services.media_download_service import media_download_service
+from bot.services.media_storage import media_storage
+from bot.services.ai_service import ai_service
+from bot.services.ai_job_service import ai_job_service
+from bot.handlers.ai_analysis_handler import ai_analysis_handler
 
 
 # Настройка логирования
@@ -56,6 +73,34 @@ async def health_check():
     return {"status": "ok", "message": "Bot is running"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики внутренних компонентов бота."""
+    try:
+        ai_job_queue = await db.get_ai_job_stats()
+    except Exception as e:
+        ai_job_queue = {"error": str(e)}
+    
+    return {
+        "render_cache": render_cache.get_stats(),
+        "callback_answer": early_answer_middleware.get_stats(),
+        "user_locks": user_locks.get_stats(),
+        "site_api": site_api_service.get_pool_stats(),
+        "db_single_flight": db.single_flight.get_stats(),
+        "entitlement_sync": entitlement_sync_service.get_stats(),
+        "result_outbox": result_outbox_service.get_stats(),
+        "openai": openai_client_factory.get_stats(),
+        "llm_admission": llm_admission.get_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "model_router": model_router.get_stats(),
+        "media_download": media_download_service.get_stats(),
+        "media_storage": media_storage.get_stats(),
+        "ai_media": ai_service.get_stats(),
+        "media_groups": ai_analysis_handler.albums.get_stats(),
+        "ai_jobs": {**ai_job_service.get_stats(), "queue": ai_job_queue}
+    }
+
+
 @app.get("/")
 async def root():
     """Корневой endpoint."""
@@ -70,11 +115,10 @@ async def root():
 async def webhook_handler(request: Request):
     """Обработчик webhook от Telegram."""
     try:
-        # Получаем обработчик webhook от бота
-        webhook_handler = await telegram_bot.get_webhook_handler()
+        update = await request.json()
         
-        # Обрабатываем запрос
-        return await webhook_handler.handle(request)
+        # Обрабатываем обновление, быстрый ответ уходит в теле ответа
+        return await telegram_bot.feed_webhook_update(update)
         
     except Exception as e:
         logger.error(f"Ошибка обработки webhook: {e}")
@@ -84,6 +128,38 @@ async def webhook_handler(request: Request):
         )
 
 
+@app.post("/api/entitlements/push")
+async def entitlements_push(request: Request):
+    """Прием изменений подписок и пакетов от сайта.
+    
+    Тело: {"items": [...]}, заголовок X-Timestamp — время отправки (Unix),
+    X-Signature — HMAC-SHA256 строки "<X-Timestamp>.<тело>".
+    """
+    body = await request.body()
+    timestamp = request.headers.get("X-Timestamp", "")
+    signature = request.headers.get("X-Signature", "")
+    if not entitlement_sync_service.verify_signature(body, timestamp, signature):
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Unauthorized"}
+        )
+    
+    try:
+        items = json.loads(body).get("items", [])
+    except (ValueError, AttributeError):
+        items = None
+    if not isinstance(items, list) or not all(
+        entitlement_sync_service.is_valid_item(item) for item in items
+    ):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Invalid payload"}
+        )
+    
+    updated = await entitlement_sync_service.apply_changes(items)
+    return {"status": "ok", "updated": updated}
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Глобальный обработчик исключений."""
@@ -1,9 +1,40 @@
 """Базовые тесты для проверки работоспособности."""
 
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import httpx
+import openai
 import pytest
-from unittest.mock import AsyncMock, patch
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects import postgresql
+from unittest.mock import AsyncMock, MagicMock, patch
 from bot.services.test_service import TestService
 from bot.services.consultation_service import ConsultationService
+from bot.services.conversation_memory import ConversationMemory, count_tokens
+from bot.services.model_router import ModelRouter
+from bot.services.media_download_service import MediaDownloadService, MediaTooLargeError
+from bot.services.media_storage import MediaStorage
+from bot.services.ai_result_cache import AIResultCache
+from bot.services.ai_job_service import AIJobService
+from bot.services.site_api_service import SiteAPIService
+from bot.utils.circuit_breaker import CircuitBreaker
+from bot.services.entitlement_sync_service import EntitlementSyncService
+from bot.services.result_outbox_service import ResultOutboxService
+from bot.database.database import db as database
+from bot.database.models import AIJob
+from aiogram import Router
+from aiogram.types import CallbackQuery
+from bot.middlewares.early_answer import EarlyCallbackAnswerMiddleware
+from bot.handlers.base import BaseHandler
+from bot.handlers.test_handler import TestHandler
+from bot.handlers.ai_analysis_handler import AIAnalysisHandler
+from bot.bot import telegram_bot
+from bot.data.callbacks import TestAnswerCallback as AnswerCallback
+from bot.utils.keyed_lock import user_locks
 
 
 class TestTestService:
@@ -76,6 +107,878 @@ class TestConsultationService:
         message = self.consultation_service.get_limit_reached_message()
         assert "Достигнут лимит" in message
         assert "5" in message
+    
+    @pytest.mark.asyncio
+    async def test_stream_failure_records_elapsed_time(self):
+        """Обрыв потока учитывается как ошибка модели с реальной длительностью."""
+        async def deltas():
+            await asyncio.sleep(0.02)
+            yield "Привет"
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+        
+        memory = MagicMock()
+        memory.build_messages = MagicMock(return_value=[])
+        with patch("bot.services.consultation_service.model_router") as router:
+            router.call = AsyncMock(return_value=((deltas(), "Здравствуйте"), "gpt-4"))
+            with pytest.raises(openai.APIConnectionError):
+                await self.consultation_service._generate_reply(memory, "вопрос")
+        
+        model, duration = router.record.call_args.args
+        assert model == "gpt-4" and duration >= 0.02
+        assert router.record.call_args.kwargs == {"error": True}
+
+
+
+class TestConversationMemory:
+    """Тесты памяти диалога консультации."""
+    
+    def test_dump_and_load(self):
+        """История сохраняется в сжатом виде и восстанавливается."""
+        memory = ConversationMemory(summary="Пользователь — ИЛЭ")
+        memory.add_turn("Кто я?", "Вероятно, интуитивно-логический экстраверт.")
+        
+        summary, history = memory.dump()
+        restored = ConversationMemory.load(summary, history)
+        
+        assert isinstance(history, bytes)
+        assert restored.summary == "Пользователь — ИЛЭ"
+        assert restored.turns == memory.turns
+    
+    def test_build_messages_respects_budget(self):
+        """В запрос попадают только новые реплики, помещающиеся в бюджет."""
+        memory = ConversationMemory(summary="кратко")
+        for i in range(50):
+            memory.add_turn(f"вопрос {i} " * 20, f"ответ {i} " * 20)
+        budget = 500
+        
+        messages = memory.build_messages("system", "новый вопрос", budget=budget)
+        history_tokens = sum(count_tokens(m["content"]) for m in messages[1:-1])
+        
+        assert history_tokens <= budget
+        assert messages[-1] == {"role": "user", "content": "новый вопрос"}
+        assert messages[-2]["content"].startswith("ответ 49")
+        assert "кратко" in messages[1]["content"]
+    
+    def test_split_for_compaction(self):
+        """Старые пары реплик отделяются, новые остаются в пределах лимита."""
+        memory = ConversationMemory()
+        for i in range(10):
+            memory.add_turn(f"вопрос {i}", f"ответ {i}")
+        
+        old = memory.split_for_compaction(keep_tokens=count_tokens("вопрос 9") * 5)
+        
+        assert old[0] == ("user", "вопрос 0")
+        assert memory.turns[-1] == ("assistant", "ответ 9")
+        assert len(memory.turns) % 2 == 0
+        assert len(old) + len(memory.turns) == 20
+
+
+
+class TestModelRouter:
+    """Тесты маршрутизации моделей."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.router = ModelRouter(
+            routes={"short": ["primary", "fallback"]},
+            targets={"short": 1.0},
+            min_samples=3
+        )
+    
+    def test_slow_model_is_demoted(self):
+        """Модель с p95 выше цели уходит в конец списка."""
+        for _ in range(3):
+            self.router.record("primary", 2.0)
+        
+        assert self.router.candidates("short") == ["fallback", "primary"]
+    
+    def test_failing_model_is_tried_after_slow_one(self):
+        """Среди деградировавших сначала модель с меньшей долей ошибок."""
+        router = ModelRouter(
+            routes={"short": ["broken", "slow", "fast"]},
+            targets={"short": 1.0},
+            min_samples=3
+        )
+        for _ in range(3):
+            router.record("broken", 0.1, error=True)
+            router.record("slow", 2.0)
+        
+        assert router.candidates("short") == ["fast", "slow", "broken"]
+    
+    @staticmethod
+    def _status_error(status_code):
+        """Ошибка API OpenAI с заданным HTTP-статусом."""
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        response = httpx.Response(status_code, request=request)
+        error_class = openai.RateLimitError if status_code == 429 else (
+            openai.InternalServerError if status_code >= 500 else openai.BadRequestError
+        )
+        return error_class("error", response=response, body=None)
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("status_code", [429, 503])
+    async def test_failover_on_model_failure(self, status_code):
+        """При 429 и 5xx запрос уходит на следующую модель."""
+        async def request(model):
+            if model == "primary":
+                raise self._status_error(status_code)
+            return f"answer from {model}"
+        
+        result, model = await self.router.call("short", request)
+        
+        assert (result, model) == ("answer from fallback", "fallback")
+        assert self.router.get_stats()["failovers"] == 1
+        assert self.router.health["primary"].errors == 1
+    
+    @pytest.mark.asyncio
+    async def test_no_failover_on_bad_request(self):
+        """Некорректный запрос не повторяется на других моделях."""
+        request = AsyncMock(side_effect=self._status_error(400))
+        
+        with pytest.raises(openai.BadRequestError):
+            await self.router.call("short", request)
+        
+        request.assert_awaited_once_with("primary")
+        assert self.router.get_stats()["failovers"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_failover_on_timeout(self):
+        """Медленная модель прерывается по цели класса."""
+        router = ModelRouter(routes={"short": ["slow", "fast"]}, targets={"short": 0.01})
+        
+        async def request(model):
+            if model == "slow":
+                await asyncio.sleep(1)
+            return model
+        
+        assert await router.call("short", request) == ("fast", "fast")
+
+
+
+class TestMediaDownloadService:
+    """Тесты потоковой загрузки медиа."""
+    
+    @pytest.fixture(autouse=True)
+    def _service(self, tmp_path):
+        """Сервис с хранилищем во временном каталоге."""
+        self.storage = MediaStorage(tmp_path, max_bytes=1024 * 1024, orphan_age=3600)
+        self.service = MediaDownloadService(self.storage)
+    
+    def _make_bot(self, chunks, file_size=None):
+        """Бот, отдающий файл указанными фрагментами."""
+        async def stream_content(url, **kwargs):
+            for chunk in chunks:
+                yield chunk
+        
+        bot = MagicMock(token="123:abc")
+        bot.get_file = AsyncMock(return_value=MagicMock(
+            file_size=file_size, file_unique_id="uniq", file_path="photos/file.jpg"
+        ))
+        bot.session.stream_content = stream_content
+        return bot
+    
+    @pytest.mark.asyncio
+    async def test_small_file_stays_in_memory(self):
+        """Небольшой файл не пишется на диск."""
+        media = await self.service.download(self._make_bot([b"ab", b"cd"]), "file", "photo")
+        
+        assert media.in_memory
+        assert await media.read() == b"abcd"
+        assert media.file_unique_id == "uniq"
+        assert media.content_hash == hashlib.sha256(b"abcd").hexdigest()
+    
+    @pytest.mark.asyncio
+    async def test_large_file_spooled_to_disk(self):
+        """Крупный файл пишется на диск и переносится в хранилище."""
+        chunks = [b"x" * 1024] * 4
+        with patch("bot.services.media_download_service.settings") as settings:
+            settings.media_spool_max_memory = 2048
+            settings.media_max_size = 10 * 1024
+            media = await self.service.download(self._make_bot(chunks), "file", "video")
+        
+        stored = self.storage.path_for(hashlib.sha256(b"".join(chunks)).hexdigest())
+        assert not media.in_memory
+        assert media.path.parent == self.storage.pins_path
+        assert media.path.samefile(stored)
+        assert await media.read() == b"".join(chunks)
+        await media.cleanup()
+        assert stored.exists()
+        assert list(self.storage.tmp_path.iterdir()) == []
+        assert list(self.storage.pins_path.iterdir()) == []
+    
+    @pytest.mark.asyncio
+    async def test_repeated_file_served_from_storage(self):
+        """Повторная загрузка того же file_unique_id не обращается к Telegram."""
+        bot = self._make_bot([b"ab", b"cd"])
+        await (await self.service.download(bot, "file", "photo")).cleanup()
+        
+        bot.session.stream_content = MagicMock(side_effect=AssertionError("повторная загрузка"))
+        media = await self.service.download(bot, "other_file_id", "photo")
+        
+        assert await media.read() == b"abcd"
+        assert media.content_hash == hashlib.sha256(b"abcd").hexdigest()
+        assert self.service.from_storage == 1
+    
+    @pytest.mark.asyncio
+    async def test_size_cap(self):
+        """Файл больше лимита отклоняется до и во время загрузки."""
+        with patch("bot.services.media_download_service.settings") as settings:
+            settings.media_spool_max_memory = 1024
+            settings.media_max_size = 3
+            with pytest.raises(MediaTooLargeError):
+                await self.service.download(self._make_bot([b"ab"], file_size=10), "file", "photo")
+            with pytest.raises(MediaTooLargeError):
+                await self.service.download(self._make_bot([b"ab", b"cd"]), "file", "photo")
+
+
+class TestMediaStorage:
+    """Тесты хранилища медиа."""
+    
+    @pytest.mark.asyncio
+    async def test_lru_eviction_by_size(self, tmp_path):
+        """Сверх лимита удаляются давно не использованные файлы."""
+        storage = MediaStorage(tmp_path, max_bytes=10, orphan_age=3600)
+        await storage.store("aa11", "first", data=b"12345")
+        await storage.store("bb22", "second", data=b"12345")
+        assert await storage.lookup("first") is not None
+        
+        await storage.store("cc33", "third", data=b"12345")
+        
+        assert await storage.lookup("second") is None
+        assert not storage.path_for("bb22").exists()
+        assert await storage.lookup("first") is not None
+        assert storage.get_stats()["evictions"] == 1
+        assert storage.size == 10
+    
+    @pytest.mark.asyncio
+    async def test_sweep_reconciles_and_removes_orphans(self, tmp_path):
+        """Очистка подхватывает чужие файлы и удаляет старые временные."""
+        import os
+        
+        storage = MediaStorage(tmp_path, max_bytes=1024, orphan_age=60)
+        foreign = storage.path_for("dd44")
+        foreign.parent.mkdir(parents=True)
+        foreign.write_bytes(b"123")
+        orphan = storage.temp_file("video")
+        orphan.write_bytes(b"partial")
+        os.utime(orphan, (0, 0))
+        fresh = storage.temp_file("photo")
+        fresh.write_bytes(b"in progress")
+        
+        await storage.sweep()
+        
+        assert storage.size == 3
+        assert not orphan.exists()
+        assert fresh.exists()
+        assert storage.orphans_removed == 1
+    
+    def test_no_directories_until_used(self, tmp_path):
+        """Создание хранилища не трогает диск."""
+        MediaStorage(tmp_path / "media", max_bytes=1024, orphan_age=60)
+        
+        assert not (tmp_path / "media").exists()
+    
+    @pytest.mark.asyncio
+    async def test_pinned_file_survives_eviction(self, tmp_path):
+        """Вытеснение не удаляет данные, которые еще читаются."""
+        storage = MediaStorage(tmp_path, max_bytes=5, orphan_age=3600)
+        pin = await storage.store("aa11", "first", data=b"12345", pin_suffix="photo")
+        await storage.store("bb22", "second", data=b"67890")
+        
+        assert not storage.path_for("aa11").exists()
+        assert pin.read_bytes() == b"12345"
+        
+        await storage.unpin(pin)
+        assert not pin.exists()
+    
+    @pytest.mark.asyncio
+    async def test_store_hit_with_missing_file_restores(self, tmp_path):
+        """Файл, удаленный другим процессом, сохраняется заново."""
+        storage = MediaStorage(tmp_path, max_bytes=1024, orphan_age=3600)
+        path = await storage.store("aa11", "first", data=b"12345")
+        path.unlink()
+        
+        assert await storage.store("aa11", "first", data=b"12345") == path
+        assert path.read_bytes() == b"12345"
+        assert storage.size == 5
+    
+    @pytest.mark.asyncio
+    async def test_sweep_removes_stale_pins(self, tmp_path):
+        """Очистка удаляет закрепления, брошенные после падения."""
+        storage = MediaStorage(tmp_path, max_bytes=1024, orphan_age=60)
+        pin = await storage.store("aa11", "first", data=b"12345", pin_suffix="photo")
+        stale = storage.pins_path / "0-dead.photo"
+        stale.write_bytes(b"old")
+        
+        await storage.sweep()
+        
+        assert pin.exists()
+        assert not stale.exists()
+
+
+class TestAIResultCache:
+    """Тесты кэша результатов анализа."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.cache = AIResultCache()
+    
+    @pytest.mark.asyncio
+    async def test_memory_hit_by_any_key(self):
+        """Результат находится в памяти по file_unique_id и по хешу."""
+        result = {"status": "success", "analysis": "ok"}
+        self.cache.put("photo", result, "uniq", "hash")
+        
+        with patch("bot.services.ai_result_cache.db") as db:
+            db.find_ai_analysis = AsyncMock(return_value=None)
+            assert await self.cache.get("photo", file_unique_id="uniq") == result
+            assert await self.cache.get("photo", content_hash="hash") == result
+            assert await self.cache.get("voice", file_unique_id="uniq") is None
+        
+        assert self.cache.memory_hits == 2
+        db.find_ai_analysis.assert_awaited_once_with("voice", "uniq", None)
+    
+    @pytest.mark.asyncio
+    async def test_db_hit_fills_memory(self):
+        """Результат из БД запоминается в памяти."""
+        result = {"status": "success", "analysis": "ok"}
+        with patch("bot.services.ai_result_cache.db") as db:
+            db.find_ai_analysis = AsyncMock(return_value=result)
+            assert await self.cache.get("photo", content_hash="hash") == result
+            assert await self.cache.get("photo", content_hash="hash") == result
+        
+        db.find_ai_analysis.assert_awaited_once()
+        assert self.cache.get_stats()["db_hits"] == 1
+        assert self.cache.get_stats()["memory_hits"] == 1
+
+
+class TestAIJobService:
+    """Тесты воркера очереди ИИ-анализа."""
+    
+    JOB = {
+        "id": 7, "user_id": 1, "chat_id": 100, "message_id": 5,
+        "media_type": "photo", "file_id": "file", "file_unique_id": "uniq",
+        "attempts": 1, "waited": 0.5, "lease_token": "token"
+    }
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.service = AIJobService()
+        self.bot = MagicMock()
+        self.bot.edit_message_text = AsyncMock()
+        self.bot.delete_message = AsyncMock()
+        self.bot.send_message = AsyncMock()
+    
+    async def _process(self, result, job=None, owned=True):
+        """Обработка одной задачи с заданным результатом анализа."""
+        with patch("bot.services.ai_job_service.db") as db, \
+                patch("bot.services.ai_job_service.ai_service") as ai_service:
+            db.claim_ai_job = AsyncMock(return_value=dict(job or self.JOB))
+            db.finish_ai_job = AsyncMock(return_value=owned)
+            db.reschedule_ai_job = AsyncMock(return_value=owned)
+            ai_service.analyze_media = AsyncMock(return_value=result)
+            assert await self.service.process_one(self.bot)
+        return db
+    
+    @pytest.mark.asyncio
+    async def test_success_delivers_result(self):
+        """Успешная задача завершается и заменяет сообщение о ходе работы ответом."""
+        db = await self._process({"status": "success", "analysis": "тип"})
+        
+        db.finish_ai_job.assert_awaited_once_with(7, "token", "done")
+        self.bot.delete_message.assert_awaited_once_with(100, 5)
+        assert "тип" in self.bot.send_message.call_args.args[1]
+        assert self.service.succeeded == 1
+    
+    @pytest.mark.asyncio
+    async def test_failure_is_retried_then_failed(self):
+        """Ошибка повторяется с задержкой, пока не кончатся попытки."""
+        db = await self._process({"status": "error", "message": "сбой"})
+        db.reschedule_ai_job.assert_awaited_once()
+        assert self.service.retried == 1
+        self.bot.send_message.assert_not_awaited()
+        
+        with patch("bot.services.ai_job_service.settings") as settings:
+            settings.ai_job_max_attempts = 1
+            settings.ai_job_lease = 60
+            db = await self._process({"status": "error", "message": "сбой"})
+        db.finish_ai_job.assert_awaited_once_with(7, "token", "failed", error="сбой")
+        assert self.service.failed == 1
+    
+    @pytest.mark.asyncio
+    async def test_non_retryable_fails_at_once(self):
+        """Неповторяемая ошибка сразу отвечает пользователю."""
+        db = await self._process({
+            "status": "error", "message": "big", "user_message": "слишком большой", "retryable": False
+        })
+        
+        db.reschedule_ai_job.assert_not_awaited()
+        assert self.bot.send_message.call_args.args[1] == "слишком большой"
+    
+    @pytest.mark.asyncio
+    async def test_lost_lease_does_not_deliver(self):
+        """Если задачу уже забрал другой воркер, ответ не отправляется второй раз."""
+        await self._process({"status": "success", "analysis": "тип"}, owned=False)
+        
+        self.bot.send_message.assert_not_awaited()
+        assert self.service.get_stats()["lost"] == 1
+        assert self.service.succeeded == 0
+    
+    @pytest.mark.asyncio
+    async def test_lease_is_renewed_while_running(self):
+        """Долгая задача продлевает аренду и прерывается, когда аренда потеряна."""
+        renewals = []
+        
+        async def renew(job_id, lease_token, lease_seconds):
+            renewals.append(lease_token)
+            return len(renewals) < 3
+        
+        async def analyze(**kwargs):
+            await asyncio.sleep(10)
+        
+        with patch("bot.services.ai_job_service.db") as db, \
+                patch("bot.services.ai_job_service.ai_service") as ai_service, \
+                patch("bot.services.ai_job_service.settings") as settings:
+            settings.ai_job_lease = 0.03
+            db.claim_ai_job = AsyncMock(return_value=dict(self.JOB))
+            db.renew_ai_job_lease = AsyncMock(side_effect=renew)
+            db.finish_ai_job = AsyncMock(return_value=True)
+            ai_service.analyze_media = AsyncMock(side_effect=analyze)
+            assert await asyncio.wait_for(self.service.process_one(self.bot), timeout=1)
+        
+        assert renewals == ["token"] * 3
+        db.finish_ai_job.assert_not_awaited()
+        self.bot.send_message.assert_not_awaited()
+        assert self.service.lost == 1
+    
+    @staticmethod
+    def _session(result):
+        """Сессия БД, возвращающая заданный результат запроса."""
+        session = MagicMock()
+        session.execute = AsyncMock(return_value=result)
+        
+        @asynccontextmanager
+        async def get_session():
+            yield session
+        
+        return get_session
+    
+    @pytest.mark.asyncio
+    async def test_claim_with_aware_timestamps(self):
+        """Захват считает ожидание по времени с часовым поясом, как его отдает asyncpg."""
+        created = datetime.now(timezone.utc) - timedelta(seconds=30)
+        job = AIJob(
+            id=7, user_id=1, chat_id=100, message_id=5, media_type="photo",
+            file_id="file", file_unique_id="uniq", attempts=0, created_at=created
+        )
+        result = MagicMock(scalar_one_or_none=MagicMock(return_value=job))
+        
+        with patch.object(database, "get_session", self._session(result)):
+            claimed = await database.claim_ai_job(lease_seconds=60)
+        
+        assert 29 < claimed["waited"] < 40
+        assert job.next_attempt_at - job.started_at == timedelta(seconds=60)
+    
+    @pytest.mark.asyncio
+    async def test_stats_with_aware_timestamps(self):
+        """Возраст старейшей задачи считается по времени с часовым поясом."""
+        oldest = datetime.now(timezone.utc) - timedelta(seconds=90)
+        result = MagicMock(one=MagicMock(return_value=(2, oldest, 6, 0)))
+        
+        with patch.object(database, "get_session", self._session(result)):
+            stats = await database.get_ai_job_stats(window_seconds=60)
+        
+        assert 89 < stats["oldest_pending_seconds"] < 100
+        assert stats["pending"] == 2 and stats["done_per_minute"] == 6
+
+
+class TestTestHandler:
+    """Тесты обработчика ответов на тест."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        with patch("bot.handlers.test_handler.callback_table"):
+            self.handler = TestHandler(Router())
+    
+    def _callback(self, telegram_id, entered, release):
+        """Нажатие кнопки ответа пользователем telegram_id."""
+        async def edit_text(*args, **kwargs):
+            entered.append(telegram_id)
+            await release.wait()
+        
+        callback = MagicMock()
+        callback.from_user.id = telegram_id
+        # Отправитель сообщения с кнопками — бот, одинаковый для всех
+        callback.message.from_user.id = 999
+        callback.message.edit_text = AsyncMock(side_effect=edit_text)
+        return callback
+    
+    @pytest.mark.asyncio
+    async def test_answers_of_different_users_do_not_contend(self):
+        """Ответы разных пользователей обрабатываются параллельно."""
+        entered, release = [], asyncio.Event()
+        callbacks = [self._callback(telegram_id, entered, release) for telegram_id in (1, 2)]
+        contended = user_locks.contended
+        
+        with patch("bot.handlers.base.db") as db:
+            db.get_or_create_user = AsyncMock(
+                side_effect=lambda telegram_id, **kwargs: MagicMock(id=telegram_id + 100)
+            )
+            for telegram_id in (1, 2):
+                self.handler.user_tests[telegram_id + 100] = {
+                    "current_question": 1, "answers": [], "total_questions": 16
+                }
+            tasks = [
+                asyncio.create_task(self.handler._handle_test_answer(
+                    callback, AnswerCallback(question_id=1, answer_index=0)
+                ))
+                for callback in callbacks
+            ]
+            for _ in range(10):
+                await asyncio.sleep(0)
+            
+            assert user_locks.contended == contended
+            assert user_locks.locked(1) and user_locks.locked(2)
+            release.set()
+            await asyncio.gather(*tasks)
+    
+    @pytest.mark.asyncio
+    async def test_user_is_resolved_from_callback_sender(self):
+        """Пользователь берется из callback.from_user, а не из сообщения бота."""
+        callback = self._callback(42, [], asyncio.Event())
+        
+        with patch("bot.handlers.base.db") as db:
+            db.get_or_create_user = AsyncMock(return_value=MagicMock(id=7))
+            assert await self.handler._get_or_create_user(callback) == 7
+        
+        assert db.get_or_create_user.await_args.kwargs["telegram_id"] == 42
+
+
+class TestAIAnalysisHandler:
+    """Тесты обработчика ИИ-анализа."""
+    
+    @pytest.mark.asyncio
+    async def test_album_db_failure_answers_user(self):
+        """Сбой БД при постановке альбома сообщается пользователю."""
+        with patch("bot.handlers.ai_analysis_handler.callback_table"):
+            handler = AIAnalysisHandler(Router())
+        message = MagicMock(message_id=1)
+        message.answer = AsyncMock()
+        
+        handler._get_or_create_user = AsyncMock(side_effect=ConnectionError("db down"))
+        
+        with patch("bot.handlers.ai_analysis_handler.ai_job_service") as ai_job_service:
+            ai_job_service.enqueue = AsyncMock()
+            await handler._process_album("album", [message])
+        
+        message.answer.assert_awaited_once()
+        ai_job_service.enqueue.assert_not_awaited()
+
+
+class TestSiteAPIService:
+    """Тесты сервиса API сайта."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.service = SiteAPIService()
+        self.service._client = MagicMock(is_closed=False)
+        # Выключатель открыт, и пауза уже истекла: следующий вызов — проба
+        self.breaker = self.service._get_breaker("/test")
+        self.breaker.recovery_timeout = 0
+        self.breaker.state = CircuitBreaker.OPEN
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_probe_releases_breaker(self):
+        """Отмененная проба не блокирует endpoint навсегда."""
+        self.service._client.post = AsyncMock(side_effect=asyncio.CancelledError)
+        
+        with pytest.raises(asyncio.CancelledError):
+            await self.service._send_once("POST", "/test", {})
+        
+        assert self.breaker.state == CircuitBreaker.HALF_OPEN
+        assert self.service.in_flight == 0
+        self.service._client.post = AsyncMock(return_value=MagicMock(status_code=200))
+        assert await self.service._send_once("POST", "/test", {}) is not None
+        assert self.breaker.state == CircuitBreaker.CLOSED
+    
+    @pytest.mark.asyncio
+    async def test_unsupported_method_does_not_use_probe(self):
+        """Неподдерживаемый метод не занимает пробный вызов."""
+        assert await self.service._send_once("PUT", "/test") is None
+        assert self.breaker.state == CircuitBreaker.OPEN
+        assert self.breaker.allow()
+
+
+class TestEntitlementSync:
+    """Тесты синхронизации подписок и push-endpoint."""
+    
+    SECRET = "secret"
+    ITEM = {
+        "telegram_user_id": 1, "access_type": "subscription", "is_active": True,
+        "expires_at": "2026-12-01T00:00:00+00:00", "updated_at": "2026-10-01T12:00:00+00:00"
+    }
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.service = EntitlementSyncService()
+    
+    def _sign(self, body, timestamp):
+        """Подпись запроса так, как ее считает сайт."""
+        return hmac.new(
+            self.SECRET.encode(), f"{timestamp}.".encode() + body, hashlib.sha256
+        ).hexdigest()
+    
+    def _push(self, payload, timestamp=None, signature=None):
+        """Запрос к push-endpoint."""
+        from fastapi.testclient import TestClient
+        from main import app
+        
+        body = json.dumps(payload).encode()
+        timestamp = str(int(time.time())) if timestamp is None else timestamp
+        headers = {
+            "X-Timestamp": timestamp,
+            "X-Signature": signature or self._sign(body, timestamp)
+        }
+        return TestClient(app).post("/api/entitlements/push", content=body, headers=headers)
+    
+    def test_signature_covers_timestamp(self):
+        """Подпись проверяется вместе со временем отправки."""
+        body = b'{"items": []}'
+        with patch("bot.services.entitlement_sync_service.settings") as settings:
+            settings.site_webhook_secret = self.SECRET
+            settings.site_webhook_tolerance = 300
+            signature = self._sign(body, "1000")
+            
+            assert self.service.verify_signature(body, "1000", signature, now=1100)
+            assert not self.service.verify_signature(body, "1001", signature, now=1100)
+            assert not self.service.verify_signature(body + b" ", "1000", signature, now=1100)
+            # Перехваченный запрос нельзя повторить позже
+            assert not self.service.verify_signature(body, "1000", signature, now=2000)
+    
+    def test_item_validation(self):
+        """Изменение без пользователя или версии некорректно."""
+        assert self.service.is_valid_item(self.ITEM)
+        for field in ("telegram_user_id", "access_type", "updated_at"):
+            item = dict(self.ITEM)
+            del item[field]
+            assert not self.service.is_valid_item(item)
+        assert not self.service.is_valid_item({**self.ITEM, "expires_at": "завтра"})
+        assert not self.service.is_valid_item("item")
+    
+    def test_push_endpoint(self):
+        """Неподписанный запрос — 401, некорректные изменения — 400, иначе применяются."""
+        with patch("bot.services.entitlement_sync_service.settings") as settings, \
+                patch("main.entitlement_sync_service.apply_changes", AsyncMock(return_value=1)) as apply:
+            settings.site_webhook_secret = self.SECRET
+            settings.site_webhook_tolerance = 300
+            
+            assert self._push({"items": [self.ITEM]}, signature="bad").status_code == 401
+            assert self._push({"items": [self.ITEM]}, timestamp="1000").status_code == 401
+            broken = {key: value for key, value in self.ITEM.items() if key != "telegram_user_id"}
+            assert self._push({"items": [broken]}).status_code == 400
+            assert self._push({"items": "all"}).status_code == 400
+            apply.assert_not_awaited()
+            
+            response = self._push({"items": [self.ITEM]})
+        
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok", "updated": 1}
+        apply.assert_awaited_once_with([self.ITEM])
+    
+    @pytest.mark.asyncio
+    async def test_upsert_keeps_newer_version(self):
+        """Из пакета берется самое новое изменение, а в БД оно не перекрывает более новое."""
+        session = MagicMock()
+        session.execute = AsyncMock(side_effect=[
+            MagicMock(),
+            MagicMock(all=MagicMock(return_value=[(10, 1)])),
+            MagicMock(rowcount=0)
+        ])
+        
+        @asynccontextmanager
+        async def get_session():
+            yield session
+        
+        older = {**self.ITEM, "is_active": False, "updated_at": "2026-09-01T00:00:00+00:00"}
+        with patch.object(database, "get_session", get_session):
+            assert await database.upsert_entitlements([self.ITEM, older]) == 0
+        
+        stmt = session.execute.await_args_list[2].args[0]
+        params = stmt.compile(dialect=postgresql.dialect()).params
+        assert [value for key, value in params.items() if key.startswith("is_active")] == [True]
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        assert "WHERE premium_access.site_updated_at IS NULL" in sql
+        assert "premium_access.site_updated_at < excluded.site_updated_at" in sql
+    
+    @pytest.mark.asyncio
+    async def test_schema_upgrade_merges_duplicates_before_index(self):
+        """Обновление схемы сводит дубли premium_access до создания уникального индекса."""
+        conn = MagicMock()
+        conn.execute = AsyncMock()
+        conn.run_sync = AsyncMock()
+        
+        @asynccontextmanager
+        async def begin():
+            yield conn
+        
+        engine = MagicMock(begin=begin)
+        with patch.object(database, "engine", engine):
+            await database.create_tables()
+        
+        statements = [" ".join(str(call.args[0]).split()) for call in conn.execute.await_args_list]
+        assert "pg_advisory_xact_lock" in statements[0]
+        merge = next(i for i, sql in enumerate(statements) if sql.startswith("UPDATE premium_access"))
+        dedupe = next(i for i, sql in enumerate(statements) if sql.startswith("DELETE FROM premium_access"))
+        index = next(i for i, sql in enumerate(statements) if "uq_premium_access_user_type" in sql)
+        assert merge < dedupe < index
+        assert "SUM(remaining_uses) FILTER (WHERE is_active)" in statements[merge]
+
+
+class TestResultOutbox:
+    """Тесты доставки результатов тестов на сайт."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.service = ResultOutboxService()
+        self.batch = [
+            {"outbox_id": outbox_id, "attempts": attempts, "idempotency_key": key, "result": {}}
+            for outbox_id, attempts, key in ((1, 1, "a"), (2, 3, "b"), (3, 1, "c"))
+        ]
+    
+    async def _ship(self, response):
+        """Отправка пачки с заданным ответом сайта."""
+        with patch("bot.services.result_outbox_service.db") as db, \
+                patch("bot.services.result_outbox_service.site_api_service") as site_api:
+            db.claim_outbox_batch = AsyncMock(return_value=self.batch)
+            db.mark_outbox_sent = AsyncMock()
+            db.mark_outbox_failed = AsyncMock()
+            db.reschedule_outbox = AsyncMock()
+            site_api.submit_test_results_bulk = AsyncMock(return_value=response)
+            assert await self.service.ship_batch() == 3
+        return db, site_api
+    
+    @pytest.mark.asyncio
+    async def test_unavailable_site_retries_batch(self):
+        """Без ответа сайта вся пачка откладывается с задержкой по числу попыток."""
+        with patch.object(self.service, "_backoff", return_value=8) as backoff:
+            db, site_api = await self._ship(None)
+        
+        sent = site_api.submit_test_results_bulk.await_args.args[0]
+        assert all("outbox_id" not in item and "attempts" not in item for item in sent)
+        backoff.assert_called_once_with(3)
+        db.reschedule_outbox.assert_awaited_once()
+        assert db.reschedule_outbox.await_args.args[0] == [1, 2, 3]
+        assert db.reschedule_outbox.await_args.kwargs["delay_seconds"] == 8
+        db.mark_outbox_sent.assert_not_awaited()
+        assert self.service.retried == 3
+    
+    @pytest.mark.asyncio
+    async def test_partial_failure(self):
+        """Доставленными считаются только подтвержденные сайтом результаты."""
+        db, _ = await self._ship({"results": [
+            {"idempotency_key": "a", "status": "accepted"},
+            {"idempotency_key": "b", "status": "rejected", "error": "unknown test"}
+        ]})
+        
+        db.mark_outbox_sent.assert_awaited_once_with([1])
+        db.mark_outbox_failed.assert_awaited_once_with({2: "unknown test"})
+        assert db.reschedule_outbox.await_args.args[0] == [3]
+        assert self.service.get_stats()["sent"] == 1
+        assert self.service.get_stats()["rejected"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_unexpected_response_is_not_marked_sent(self):
+        """Ответ без итогов по результатам не подтверждает доставку."""
+        db, _ = await self._ship({"status": "ok"})
+        
+        db.mark_outbox_sent.assert_not_awaited()
+        assert db.reschedule_outbox.await_args.args[0] == [1, 2, 3]
+    
+    @pytest.mark.asyncio
+    async def test_claim_leases_rows(self):
+        """Захват блокирует строки с SKIP LOCKED и продлевает их аренду."""
+        outbox = MagicMock(id=5, attempts=1, idempotency_key="key", next_attempt_at=None)
+        test_result = MagicMock(test_type="main", result_data="{}", completed_at=datetime(2026, 10, 1))
+        session = MagicMock()
+        session.execute = AsyncMock(return_value=MagicMock(
+            all=MagicMock(return_value=[(outbox, test_result, 42)])
+        ))
+        
+        @asynccontextmanager
+        async def get_session():
+            yield session
+        
+        with patch.object(database, "get_session", get_session):
+            batch = await database.claim_outbox_batch(limit=10, lease_seconds=60)
+        
+        assert batch[0]["outbox_id"] == 5 and batch[0]["attempts"] == 2
+        assert batch[0]["telegram_user_id"] == 42
+        assert outbox.next_attempt_at > datetime.utcnow() + timedelta(seconds=50)
+        sql = str(session.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+        assert "FOR UPDATE OF result_outbox SKIP LOCKED" in sql
+
+
+class TestEarlyCallbackAnswerMiddleware:
+    """Тесты раннего ответа на callback-запросы."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.middleware = EarlyCallbackAnswerMiddleware()
+        self.handler = BaseHandler(Router())
+        self.callback = MagicMock(spec=CallbackQuery)
+        self.callback.id = "cb"
+        self.callback.answer = AsyncMock()
+        self.callback.message = MagicMock()
+        self.callback.message.answer = AsyncMock()
+    
+    def _patch_middleware(self):
+        """Подмена глобального middleware в базовом обработчике."""
+        return patch("bot.handlers.base.early_answer_middleware", self.middleware)
+    
+    @pytest.mark.asyncio
+    async def test_answer_is_sent_before_handler_finishes(self):
+        """Ответ уходит, пока обработчик еще работает."""
+        release = asyncio.Event()
+        
+        async def handler(event, data):
+            await asyncio.sleep(0)
+            self.callback.answer.assert_awaited_once()
+            release.set()
+        
+        await self.middleware(handler, self.callback, {})
+        
+        assert release.is_set()
+        assert self.middleware.pending_answer(self.callback) is None
+    
+    @pytest.mark.asyncio
+    async def test_error_after_early_answer_is_sent_as_message(self):
+        """После раннего ответа ошибка приходит сообщением, а не алертом."""
+        async def handler(event, data):
+            await self.handler._handle_callback_error(event, "general")
+        
+        with self._patch_middleware():
+            await self.middleware(handler, self.callback, {})
+        await asyncio.gather(*self.middleware._tasks)
+        
+        self.callback.answer.assert_awaited_once()
+        assert not self.callback.answer.await_args.kwargs["show_alert"]
+        self.callback.message.answer.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_opted_out_route_answers_with_alert(self):
+        """Маршрут с pre=False получает один ответ — алерт с ошибкой."""
+        route = MagicMock(flags={"callback_answer": {"pre": False}})
+        
+        async def handler(event, data):
+            self.callback.answer.assert_not_awaited()
+            await self.handler._handle_callback_error(event, "general")
+        
+        with self._patch_middleware():
+            await self.middleware(handler, self.callback, {"callback_route": route})
+        
+        self.callback.answer.assert_awaited_once()
+        assert self.callback.answer.await_args.kwargs["show_alert"] is True
+        self.callback.message.answer.assert_not_awaited()
 
 
 @pytest.mark.asyncio
@@ -96,3 +999,79 @@ async def test_bot_initialization():
 
 if __name__ == "__main__":
     pytest.main([__file__])
+
+
+class TestWebhookReply:
+    """Тесты ответа на обновление через тело webhook."""
+    
+    UPDATE = {
+        "update_id": 1,
+        "message": {
+            "message_id": 1, "date": 0, "text": "привет",
+            "chat": {"id": 5, "type": "private"}
+        }
+    }
+    
+    async def _feed(self, handler, timeout=1.0):
+        """Обработка обновления диспетчером с одним обработчиком сообщений."""
+        from aiogram import Dispatcher
+        
+        dp = Dispatcher()
+        dp.message.register(handler)
+        dp.silent_call_request = AsyncMock()
+        with patch.object(telegram_bot, "dp", dp), \
+                patch("bot.bot.settings") as settings:
+            settings.webhook_reply = True
+            settings.webhook_reply_timeout = timeout
+            payload = await telegram_bot.feed_webhook_update(dict(self.UPDATE))
+        return payload, dp
+    
+    @pytest.mark.asyncio
+    async def test_returned_method_goes_into_body(self):
+        """Метод, возвращенный обработчиком, уходит в теле ответа."""
+        from aiogram.methods import SendMessage
+        
+        async def handler(message):
+            return SendMessage(chat_id=message.chat.id, text="ответ")
+        
+        payload, dp = await self._feed(handler)
+        
+        assert payload == {"method": "sendMessage", "chat_id": 5, "text": "ответ"}
+        dp.silent_call_request.assert_not_awaited()
+    
+    @pytest.mark.asyncio
+    async def test_method_with_file_is_sent_separately(self):
+        """Метод с файлом отправляется обычным запросом, тело ответа пустое."""
+        from aiogram.methods import SendPhoto
+        from aiogram.types import BufferedInputFile
+        
+        method = SendPhoto(chat_id=5, photo=BufferedInputFile(b"jpeg", filename="photo.jpg"))
+        
+        async def handler(message):
+            return method
+        
+        payload, dp = await self._feed(handler)
+        
+        assert payload == {}
+        dp.silent_call_request.assert_awaited_once_with(bot=telegram_bot.bot, result=method)
+    
+    @pytest.mark.asyncio
+    async def test_slow_handler_finishes_in_background(self):
+        """Медленный обработчик не держит ответ webhook, его метод отправляется позже."""
+        from aiogram.methods import SendMessage
+        
+        finished = asyncio.Event()
+        
+        async def handler(message):
+            await asyncio.sleep(0.05)
+            finished.set()
+            return SendMessage(chat_id=message.chat.id, text="поздний ответ")
+        
+        with pytest.warns(RuntimeWarning, match="slow response"):
+            payload, dp = await self._feed(handler, timeout=0.01)
+            assert payload == {}
+            assert not finished.is_set()
+            await asyncio.wait_for(finished.wait(), timeout=1)
+            await asyncio.sleep(0)
+        
+        assert dp.silent_call_request.await_args.kwargs["result"].text == "поздний ответ"
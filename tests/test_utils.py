@@ -0,0 +1,685 @@
+"""Тесты вспомогательных утилит."""
+
+import asyncio
+import base64
+import gc
+import io
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pydantic import ValidationError
+
+# Псевдоним: класс с префиксом Test pytest пытается собрать как тесты
+from bot.data.callbacks import TestAnswerCallback as AnswerCallback, AIMediaCallback
+from bot.utils.callback_dispatch import CallbackDispatchTable
+from bot.utils.render_cache import RenderCache
+from bot.utils.keyed_lock import KeyedLock
+from bot.utils.response_cache import ResponseCache
+from bot.utils.single_flight import SingleFlight
+from bot.utils.circuit_breaker import CircuitBreaker
+from bot.utils.admission import AdmissionController, UserBusyError
+from bot.utils.progressive_edit import ProgressiveEditor
+from bot.utils.semantic_cache import SemanticCache, normalize_question
+from bot.utils.image_processing import prepare_image, difference_hash, hamming_distance
+from bot.utils.video_processing import extract_keyframes
+from bot.utils.audio_processing import trim_silence, split_on_pauses, encode_wav
+from bot.utils.media_group import MediaGroupCollector
+from bot.utils.webhook_reply import build_webhook_response
+from bot.utils.rate_limit import RateLimitGate, parse_duration, retry_delay_from_headers
+
+
+class TestCallbackDispatchTable:
+    """Тесты таблицы маршрутизации callback-запросов."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.table = CallbackDispatchTable()
+        self.menu = AsyncMock()
+        self.analysis = AsyncMock()
+        self.answer = AsyncMock()
+        self.media = AsyncMock()
+        
+        self.table.exact("back_to_menu", self.menu)
+        self.table.exact("ai_analysis", self.analysis)
+        self.table.prefix(AnswerCallback, self.answer)
+        self.table.prefix(AIMediaCallback, self.media)
+    
+    def test_exact_has_priority_over_prefix(self):
+        """Точное совпадение важнее префикса ai_."""
+        assert self.table.resolve("ai_analysis").key == "ai_analysis"
+        assert self.table.resolve("ai_photo").key == "ai_"
+    
+    def test_unknown_callback(self):
+        """Неизвестные данные не находят маршрут."""
+        assert self.table.resolve("unknown") is None
+        assert self.table.resolve("test") is None
+    
+    def test_duplicate_registration(self):
+        """Повторная регистрация запрещена."""
+        with pytest.raises(ValueError):
+            self.table.exact("back_to_menu", self.menu)
+        with pytest.raises(ValueError):
+            self.table.prefix("test_answer:", self.answer)
+    
+    @pytest.mark.asyncio
+    async def test_dispatch_unpacks_callback_data(self):
+        """Фабрика распаковывает данные и передает их обработчику."""
+        callback = MagicMock(data="test_answer:3:1")
+        
+        data = await self.table._match(callback)
+        await self.table._dispatch(callback, **data)
+        
+        self.answer.assert_awaited_once()
+        callback_data = self.answer.await_args.kwargs["callback_data"]
+        assert callback_data == AnswerCallback(question_id=3, answer_index=1)
+    
+    @pytest.mark.asyncio
+    async def test_invalid_callback_data(self):
+        """Некорректные данные под префиксом отклоняются фильтром."""
+        callback = MagicMock(data="test_answer:x:1")
+        assert await self.table._match(callback) is False
+
+
+class TestRenderCache:
+    """Тесты кэша отрисовки."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.cache = RenderCache()
+    
+    def test_cached_builds_once(self):
+        """Объект строится один раз и переиспользуется."""
+        calls = []
+        
+        def factory(answers, question_id):
+            calls.append(question_id)
+            return object()
+        
+        cached = self.cache.cached(factory)
+        
+        first = cached(["a", "b"], 1)
+        second = cached(["a", "b"], 1)
+        other = cached(["a", "b"], 2)
+        
+        assert first is second
+        assert first is not other
+        assert calls == [1, 2]
+        assert self.cache.get_stats()["hits"] == 1
+        assert self.cache.get_stats()["misses"] == 2
+    
+    def test_keyword_arguments_are_part_of_key(self):
+        """Именованные аргументы входят в ключ кэша."""
+        cached = self.cache.cached(lambda question_id, answers=(): object())
+        
+        first = cached(1, answers=["a"])
+        
+        assert cached(1, answers=["a"]) is first
+        assert cached(1, answers=["b"]) is not first
+    
+    def test_cached_keyboard_is_frozen(self):
+        """Общую для всех пользователей клавиатуру нельзя изменить."""
+        cached = self.cache.cached(lambda: InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="a", callback_data="a")
+        ]]))
+        keyboard = cached()
+        
+        assert isinstance(keyboard, InlineKeyboardMarkup)
+        with pytest.raises(ValidationError):
+            keyboard.inline_keyboard = []
+        with pytest.raises(ValidationError):
+            keyboard.inline_keyboard[0][0].text = "b"
+        with pytest.raises(TypeError):
+            keyboard.inline_keyboard.append([])
+        assert keyboard.model_dump(exclude_none=True) == {
+            "inline_keyboard": [[{"text": "a", "callback_data": "a"}]]
+        }
+
+
+class TestKeyedLock:
+    """Тесты блокировок по ключу."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.locks = KeyedLock()
+    
+    @pytest.mark.asyncio
+    async def test_same_key_is_serialized(self):
+        """Секции одного ключа не пересекаются."""
+        events = []
+        
+        async def section(name):
+            async with self.locks.lock(1):
+                events.append(f"{name}:start")
+                await asyncio.sleep(0.01)
+                events.append(f"{name}:end")
+        
+        await asyncio.gather(section("a"), section("b"))
+        
+        assert events == ["a:start", "a:end", "b:start", "b:end"]
+        assert self.locks.get_stats()["contended"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_released_locks_are_evicted(self):
+        """После освобождения блокировка удаляется из таблицы."""
+        async with self.locks.lock(1):
+            assert self.locks.locked(1)
+            assert self.locks.get_stats()["active_keys"] == 1
+        
+        gc.collect()
+        assert self.locks.get_stats()["active_keys"] == 0
+
+
+class TestResponseCache:
+    """Тесты кэша ответов."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        self.cache = ResponseCache(maxsize=2, stale_ttl=60)
+    
+    def test_lru_eviction(self):
+        """При переполнении вытесняется давно неиспользуемая запись."""
+        self.cache.set("/a", 1, ttl=10)
+        self.cache.set("/b", 2, ttl=10)
+        self.cache.get("/a")
+        self.cache.set("/c", 3, ttl=10)
+        
+        assert self.cache.get("/b") is None
+        assert self.cache.get("/a").value == 1
+        assert self.cache.get_stats()["evictions"] == 1
+    
+    def test_stale_entry_is_kept_for_revalidation(self):
+        """Устаревшая запись доступна в окне stale и хранит ETag."""
+        self.cache.set("/a", 1, ttl=0, etag='"v1"')
+        
+        entry = self.cache.get("/a")
+        assert entry is not None
+        assert not entry.is_fresh()
+        assert entry.conditional_headers() == {"If-None-Match": '"v1"'}
+    
+    def test_invalidate_by_prefix(self):
+        """Сброс записей по префиксу."""
+        self.cache.set("/api/users/1/profile", 1, ttl=10)
+        self.cache.set("/api/tests", 2, ttl=10)
+        
+        assert self.cache.invalidate("/api/users/") == 1
+        assert self.cache.get("/api/tests").value == 2
+
+
+class TestSingleFlight:
+    """Тесты объединения одновременных вызовов."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_are_coalesced(self):
+        """Одновременные вызовы с одним ключом выполняются один раз."""
+        group = SingleFlight()
+        calls = []
+        
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"tests": []}
+        
+        results = await asyncio.gather(*(group.do("/api/tests", fetch) for _ in range(5)))
+        
+        assert calls == [1]
+        assert all(result == {"tests": []} for result in results)
+        assert group.get_stats() == {"calls": 5, "coalesced": 4, "in_flight": 0}
+    
+    @pytest.mark.asyncio
+    async def test_error_is_shared(self):
+        """Исключение передается всем ожидающим."""
+        group = SingleFlight()
+        
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("site down")
+        
+        results = await asyncio.gather(
+            group.do("key", fail), group.do("key", fail), return_exceptions=True
+        )
+        
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+
+class TestCircuitBreaker:
+    """Тесты circuit breaker."""
+    
+    def test_opens_after_threshold(self):
+        """После серии ошибок вызовы отклоняются."""
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        assert breaker.get_stats()["rejected"] == 1
+    
+    def test_half_open_probe(self):
+        """После паузы пропускается один пробный вызов."""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        
+        assert breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow()
+        
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+    
+    def test_released_probe_frees_slot(self):
+        """Прерванная проба освобождает место для следующей."""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        
+        assert breaker.allow()
+        breaker.release()
+        
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+
+
+
+class TestRateLimit:
+    """Тесты учета ограничений частоты запросов."""
+    
+    def test_parse_duration(self):
+        """Разбор длительностей из заголовков x-ratelimit-reset-*."""
+        assert parse_duration("20ms") == pytest.approx(0.02)
+        assert parse_duration("6m0s") == pytest.approx(360)
+        assert parse_duration("1.5") == pytest.approx(1.5)
+        assert parse_duration("soon") is None
+    
+    def test_retry_delay_from_headers(self):
+        """retry-after важнее сброса лимитов, сброс учитывается при нуле."""
+        assert retry_delay_from_headers({"retry-after": "3"}) == 3
+        assert retry_delay_from_headers({"retry-after-ms": "250"}) == pytest.approx(0.25)
+        assert retry_delay_from_headers({
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "2s",
+            "x-ratelimit-remaining-tokens": "100",
+            "x-ratelimit-reset-tokens": "10s"
+        }) == 2
+        assert retry_delay_from_headers({"x-ratelimit-remaining-requests": "5"}) is None
+    
+    def test_gate_blocks_after_429(self):
+        """После 429 пауза действует для всех запросов, но не дольше максимума."""
+        gate = RateLimitGate(max_delay=5)
+        gate.observe(200, {})
+        assert gate.remaining() == 0
+        
+        gate.observe(429, {"retry-after": "120"})
+        assert 4 < gate.remaining() <= 5
+        assert gate.get_stats()["rate_limited"] == 1
+
+
+
+class TestAdmissionController:
+    """Тесты контроля допуска к LLM."""
+    
+    @pytest.mark.asyncio
+    async def test_one_request_per_user(self):
+        """Второй запрос того же пользователя отклоняется."""
+        controller = AdmissionController(max_concurrency=2)
+        
+        async with controller.slot(1):
+            with pytest.raises(UserBusyError):
+                async with controller.slot(1):
+                    pass
+        
+        async with controller.slot(1):
+            pass
+        assert controller.get_stats()["rejected_busy"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_tier_priority_and_positions(self):
+        """Подписчик обгоняет бесплатных, ожидающие узнают место в очереди."""
+        controller = AdmissionController(
+            max_concurrency=1,
+            tier_priority={"subscription": 60.0}
+        )
+        order = []
+        positions = {}
+        release = asyncio.Event()
+        
+        async def holder():
+            async with controller.slot(0):
+                await release.wait()
+        
+        async def request(user_id, tier):
+            async def on_position(position):
+                positions.setdefault(user_id, position)
+            async with controller.slot(user_id, tier, on_position):
+                order.append(user_id)
+        
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(request(1, "free"))]
+        await asyncio.sleep(0)
+        waiting.append(asyncio.create_task(request(2, "subscription")))
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 2
+        
+        release.set()
+        await asyncio.gather(holding, *waiting)
+        
+        assert order == [2, 1]
+        assert positions == {1: 1, 2: 1}
+        assert controller.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_queue_timeout(self):
+        """По таймауту запрос уходит из очереди, слот не теряется."""
+        controller = AdmissionController(max_concurrency=1, queue_timeout=0.01)
+        
+        async with controller.slot(1):
+            with pytest.raises(asyncio.TimeoutError):
+                async with controller.slot(2):
+                    pass
+        
+        assert controller.queue_depth == 0
+        assert controller.in_flight == 0
+        assert controller.get_stats()["timed_out"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_position_notifications_are_referenced(self):
+        """Задача уведомления о месте хранится, пока не завершится."""
+        controller = AdmissionController(max_concurrency=1)
+        notified = asyncio.Event()
+        finish = asyncio.Event()
+        
+        async def on_position(position):
+            notified.set()
+            await finish.wait()
+        
+        async def request():
+            async with controller.slot(2, on_position=on_position):
+                pass
+        
+        async with controller.slot(1):
+            waiting = asyncio.create_task(request())
+            await asyncio.wait_for(notified.wait(), timeout=1)
+            assert len(controller._notify_tasks) == 1
+            finish.set()
+            # Задача завершается, затем отдельным шагом цикла вызывается discard
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            assert controller._notify_tasks == set()
+        await waiting
+
+
+
+class TestProgressiveEditor:
+    """Тесты постепенного обновления сообщения."""
+    
+    @pytest.mark.asyncio
+    async def test_throttles_intermediate_edits(self):
+        """Первая правка сразу, промежуточные схлопываются, финальная всегда."""
+        message = MagicMock(text="🤖 ИИ печатает...")
+        message.edit_text = AsyncMock()
+        editor = ProgressiveEditor(message, min_interval=60)
+        
+        editor.update("🤖 При")
+        await asyncio.sleep(0)
+        editor.update("🤖 Привет")
+        editor.update("🤖 Привет, как")
+        await editor.finish("🤖 Привет, как дела?")
+        
+        texts = [call.args[0] for call in message.edit_text.await_args_list]
+        assert texts == ["🤖 При", "🤖 Привет, как дела?"]
+
+
+
+class TestSemanticCache:
+    """Тесты семантического кэша ответов."""
+    
+    def test_normalize_question(self):
+        """Регистр, ё и пунктуация не влияют на вопрос."""
+        assert normalize_question("  Что такое ИДЕАЛИСТ?! ") == "что такое идеалист"
+        assert normalize_question("Моя квадра — чёрная") == "моя квадра черная"
+    
+    def test_similar_question_hits(self):
+        """Близкий вектор выше порога находит ответ, далекий — нет."""
+        cache = SemanticCache(maxsize=10, threshold=0.9, ttl=60)
+        cache.add("какая у меня квадра", [1.0, 0.0, 0.0], "Альфа", now=0)
+        
+        assert cache.get_exact("какая у меня квадра", now=1) == "Альфа"
+        assert cache.search([0.95, 0.1, 0.0], now=1) == "Альфа"
+        assert cache.search([0.0, 1.0, 0.0], now=1) is None
+        assert cache.search([1.0, 0.0, 0.0], now=61) is None
+        assert cache.get_stats()["hit_rate"] == 0.5
+    
+    def test_lru_eviction(self):
+        """При переполнении вытесняется давно не использованный ответ."""
+        cache = SemanticCache(maxsize=2, threshold=0.99, ttl=60)
+        cache.add("a", [1.0, 0.0], "A", now=0)
+        cache.add("b", [0.0, 1.0], "B", now=1)
+        cache.get_exact("a", now=2)
+        cache.add("c", [1.0, 1.0], "C", now=3)
+        
+        assert cache.get_exact("b", now=4) is None
+        assert cache.get_exact("a", now=4) == "A"
+        assert cache.get_exact("c", now=4) == "C"
+        assert cache.get_stats()["evictions"] == 1
+
+
+
+class TestAudioProcessing:
+    """Тесты подготовки голосовых сообщений."""
+    
+    SAMPLE_RATE = 16000
+    
+    def _tone(self, seconds):
+        import numpy as np
+        t = np.arange(int(seconds * self.SAMPLE_RATE)) / self.SAMPLE_RATE
+        return (np.sin(2 * np.pi * 300 * t) * 8000).astype(np.int16)
+    
+    def _silence(self, seconds):
+        import numpy as np
+        return np.zeros(int(seconds * self.SAMPLE_RATE), dtype=np.int16)
+    
+    def test_trim_silence(self):
+        """Тишина по краям обрезается, речь остается."""
+        import numpy as np
+        
+        samples = np.concatenate([self._silence(1), self._tone(2), self._silence(1)])
+        trimmed = trim_silence(samples, self.SAMPLE_RATE, -40)
+        
+        assert 2.0 <= len(trimmed) / self.SAMPLE_RATE <= 2.1
+        assert len(trim_silence(self._silence(1), self.SAMPLE_RATE, -40)) == 0
+    
+    def test_split_on_pauses(self):
+        """Запись режется по паузам, а без пауз — по пределу длины."""
+        import numpy as np
+        
+        samples = np.concatenate([
+            self._tone(4), self._silence(0.5), self._tone(4), self._silence(0.5), self._tone(2)
+        ])
+        chunks = split_on_pauses(samples, self.SAMPLE_RATE, -40, min_pause=0.3, max_chunk=6)
+        
+        cuts = np.cumsum([len(chunk) for chunk in chunks]) / self.SAMPLE_RATE
+        assert len(chunks) == 3
+        assert 4.0 < cuts[0] < 4.5 and 8.5 < cuts[1] < 9.0
+        assert sum(len(chunk) for chunk in chunks) == len(samples)
+        
+        chunks = split_on_pauses(self._tone(10), self.SAMPLE_RATE, -40, min_pause=0.3, max_chunk=4)
+        assert [len(chunk) / self.SAMPLE_RATE for chunk in chunks] == [4, 4, 2]
+    
+    def test_encode_wav(self):
+        """Фрагмент кодируется в моно 16-бит WAV."""
+        import wave
+        
+        with wave.open(io.BytesIO(encode_wav(self._tone(1), self.SAMPLE_RATE))) as wav:
+            assert wav.getnchannels() == 1
+            assert wav.getsampwidth() == 2
+            assert wav.getframerate() == self.SAMPLE_RATE
+            assert wav.getnframes() == self.SAMPLE_RATE
+
+
+class TestMediaGroupCollector:
+    """Тесты сборки альбомов."""
+    
+    @pytest.mark.asyncio
+    async def test_album_completed_once_after_pause(self):
+        """Элементы альбома передаются одним вызовом после паузы."""
+        completed = []
+        
+        async def on_complete(key, items):
+            completed.append((key, items))
+        
+        collector = MediaGroupCollector(window=0.05, on_complete=on_complete)
+        collector.add("album", 1)
+        await asyncio.sleep(0.03)
+        collector.add("album", 2)
+        collector.add("other", 3)
+        assert collector.collecting("album")
+        
+        await asyncio.sleep(0.1)
+        
+        assert sorted(completed) == [("album", [1, 2]), ("other", [3])]
+        assert not collector.collecting("album")
+        assert collector.get_stats()["calls_saved"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_full_album_completed_without_waiting(self):
+        """Полный альбом не ждет окончания паузы."""
+        completed = asyncio.Event()
+        
+        async def on_complete(key, items):
+            completed.set()
+        
+        collector = MediaGroupCollector(window=10, on_complete=on_complete, max_items=2)
+        collector.add("album", 1)
+        collector.add("album", 2)
+        
+        await asyncio.wait_for(completed.wait(), timeout=1)
+
+
+class TestImageProcessing:
+    """Тесты подготовки изображений."""
+    
+    def test_prepare_image_orients_and_downscales(self):
+        """Фото поворачивается по EXIF, уменьшается и кодируется в base64 JPEG."""
+        from PIL import Image
+        
+        source = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # повернуто на 90° по часовой стрелке
+        Image.new("RGBA", (2000, 1000)).save(source, format="PNG", exif=exif)
+        
+        result = prepare_image(source.getvalue(), max_side=512, quality=80)
+        decoded = Image.open(io.BytesIO(base64.b64decode(result["base64"])))
+        
+        assert decoded.format == "JPEG"
+        assert (result["width"], result["height"]) == decoded.size == (256, 512)
+        assert result["bytes"] < result["original_bytes"]
+    
+    def test_difference_hash_matches_similar_frames(self):
+        """Похожие кадры дают близкие хеши, разные — далекие."""
+        import numpy as np
+        
+        gradient = np.tile(np.arange(0, 256, 4, dtype=np.uint8), (48, 1))
+        brighter = np.clip(gradient.astype(np.int16) + 20, 0, 255).astype(np.uint8)
+        mirrored = gradient[:, ::-1]
+        
+        assert hamming_distance(difference_hash(gradient), difference_hash(brighter)) <= 2
+        assert hamming_distance(difference_hash(gradient), difference_hash(mirrored)) > 32
+
+
+class TestVideoProcessing:
+    """Тесты извлечения ключевых кадров."""
+    
+    KEYFRAMES = {
+        "max_frames": 6, "sample_interval": 0.5, "scene_threshold": 0.3,
+        "hash_distance": 6, "max_side": 128, "quality": 80
+    }
+    
+    @staticmethod
+    def _write_video(path, frames, fps=10):
+        """Запись кадров в видеофайл."""
+        import cv2
+        
+        height, width = frames[0].shape[:2]
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        return str(path)
+    
+    def test_single_shot_is_filled_evenly(self, tmp_path):
+        """Видео одним планом дает max_frames кадров по всей длительности."""
+        import cv2
+        import numpy as np
+        
+        frames = []
+        for index in range(300):
+            frame = np.full((120, 160, 3), (90, 120, 150), dtype=np.uint8)
+            cv2.circle(frame, (80, 60), 30, (170, 190, 220), -1)
+            # "Рот" открывается и закрывается, фон и освещение не меняются
+            cv2.ellipse(frame, (80, 72), (10, 2 + index % 6), 0, 0, 360, (40, 40, 120), -1)
+            frames.append(frame)
+        path = self._write_video(tmp_path / "talk.avi", frames)
+        
+        result = extract_keyframes(path, **self.KEYFRAMES)
+        
+        assert len(result["frames"]) == 6
+        assert result["filled"] == 5
+        assert result["timestamps"] == sorted(result["timestamps"])
+        assert result["timestamps"][0] == 0.0 and result["timestamps"][-1] > 25
+        gaps = np.diff(result["timestamps"])
+        assert gaps.min() > 3
+    
+    def test_flat_scene_cuts_are_not_collapsed(self, tmp_path):
+        """Однотонные сцены разных цветов остаются разными кадрами."""
+        import numpy as np
+        
+        colours = [(0, 0, 200), (0, 200, 0), (200, 0, 0), (0, 200, 200), (200, 0, 200), (200, 200, 0)]
+        frames = [
+            np.full((120, 160, 3), colour, dtype=np.uint8)
+            for colour in colours
+            for _ in range(10)
+        ]
+        path = self._write_video(tmp_path / "cuts.avi", frames)
+        
+        result = extract_keyframes(path, **self.KEYFRAMES)
+        
+        assert len(result["frames"]) == 6
+        assert result["filled"] == 0
+        assert result["timestamps"] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+class TestWebhookReply:
+    """Тесты ответа через тело webhook."""
+    
+    def setup_method(self):
+        """Настройка перед каждым тестом."""
+        from aiogram import Bot
+        
+        self.bot = Bot(token="123:abc")
+    
+    def test_method_serialized_into_body(self):
+        """Метод с клавиатурой превращается в JSON-тело ответа."""
+        from aiogram.methods import SendMessage
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="Меню", callback_data="back_to_menu")
+        ]])
+        payload = build_webhook_response(
+            self.bot, SendMessage(chat_id=5, text="Привет", reply_markup=keyboard)
+        )
+        
+        assert payload["method"] == "sendMessage"
+        assert payload["chat_id"] == 5 and payload["text"] == "Привет"
+        assert payload["reply_markup"] == {"inline_keyboard": [[
+            {"text": "Меню", "callback_data": "back_to_menu"}
+        ]]}
+    
+    def test_method_with_file_is_not_serialized(self):
+        """Файл нельзя передать в JSON, поэтому тело не строится."""
+        from aiogram.methods import SendPhoto
+        from aiogram.types import BufferedInputFile
+        
+        method = SendPhoto(chat_id=5, photo=BufferedInputFile(b"jpeg", filename="photo.jpg"))
+        
+        assert build_webhook_response(self.bot, method) is None